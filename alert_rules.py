@@ -0,0 +1,187 @@
+from bisect import bisect_left
+
+
+class AlertRule:
+    # Regula subskrybenta; None oznacza brak ograniczenia
+    __slots__ = (
+        "id",
+        "chat_id",
+        "max_price",
+        "countries",
+        "departure_airports",
+        "date_from",
+        "date_to",
+        "providers",
+    )
+
+    def __init__(
+        self,
+        id,
+        chat_id,
+        max_price=None,
+        countries=None,
+        departure_airports=None,
+        date_from=None,
+        date_to=None,
+        providers=None,
+    ):
+        self.id = id
+        self.chat_id = chat_id
+        self.max_price = float(max_price) if max_price is not None else None
+        self.countries = frozenset(countries) if countries else None
+        self.departure_airports = frozenset(departure_airports) if departure_airports else None
+        # Daty jako tekst RRRR-MM-DD - porownywane tak samo jak Offer.dates
+        self.date_from = str(date_from) if date_from is not None else None
+        self.date_to = str(date_to) if date_to is not None else None
+        self.providers = frozenset(providers) if providers else None
+
+    def __repr__(self):
+        return f"AlertRule({self.id}, {self.chat_id})"
+
+    def matches(self, offer):
+        # Wersja referencyjna (bez indeksow)
+        return (
+            (self.max_price is None or float(offer.price) <= self.max_price)
+            and (self.countries is None or offer.country in self.countries)
+            and (
+                self.departure_airports is None
+                or offer.departure_airport in self.departure_airports
+            )
+            and (self.providers is None or offer.provider in self.providers)
+            and (
+                (self.date_from is None and self.date_to is None)
+                or (
+                    bool(offer.dates)
+                    and (self.date_from is None or offer.dates >= self.date_from)
+                    and (self.date_to is None or offer.dates <= self.date_to)
+                )
+            )
+        )
+
+
+def iter_bits(bits):
+    while bits:
+        lowest = bits & -bits
+        yield lowest.bit_length() - 1
+        bits ^= lowest
+
+
+class RuleIndex:
+    # Reguly jako bity liczby calkowitej: indeksy odwrocone (kraj, lotnisko, provider) i
+    # przedzialowe (cena, data) daja dla kazdej oferty maske pasujacych regul, a przeciecie
+    # masek to kilka operacji AND zamiast petli po wszystkich regulach.
+    def __init__(self, rules=()):
+        self.rules = list(rules)
+        everyone = (1 << len(self.rules)) - 1
+        self.countries = self._inverted(lambda rule: rule.countries, everyone)
+        self.airports = self._inverted(lambda rule: rule.departure_airports, everyone)
+        self.providers = self._inverted(lambda rule: rule.providers, everyone)
+        self._build_prices(everyone)
+        self._build_dates()
+
+    def __len__(self):
+        return len(self.rules)
+
+    def _inverted(self, values, everyone):
+        # wartosc -> reguly z ta wartoscia + reguly bez ograniczenia; None -> tylko te drugie
+        index = {}
+        unrestricted = everyone
+        for bit, rule in enumerate(self.rules):
+            rule_values = values(rule)
+            if rule_values is None:
+                continue
+            unrestricted &= ~(1 << bit)
+            for value in rule_values:
+                index[value] = index.get(value, 0) | (1 << bit)
+        index = {value: bits | unrestricted for value, bits in index.items()}
+        index[None] = unrestricted
+        return index
+
+    def _build_prices(self, everyone):
+        # Reguly posortowane po max_price; dla ceny p pasuja reguly z max_price >= p (sufiks)
+        limited = sorted(
+            (rule.max_price, bit)
+            for bit, rule in enumerate(self.rules)
+            if rule.max_price is not None
+        )
+        self.price_bounds = []
+        self.price_bits = []
+        unlimited = everyone
+        for _, bit in limited:
+            unlimited &= ~(1 << bit)
+        suffix = unlimited
+        for price, bit in reversed(limited):
+            suffix |= 1 << bit
+            if self.price_bounds and self.price_bounds[-1] == price:
+                self.price_bits[-1] = suffix
+            else:
+                self.price_bounds.append(price)
+                self.price_bits.append(suffix)
+        self.price_bounds.reverse()
+        self.price_bits.reverse()
+        self.price_unlimited = unlimited
+
+    def _build_dates(self):
+        # Podzial osi dat na elementarne odcinki miedzy granicami przedzialow regul;
+        # dla kazdego odcinka maska regul, ktore go pokrywaja
+        bounds = set()
+        self.dates_unrestricted = 0
+        for bit, rule in enumerate(self.rules):
+            if rule.date_from is None and rule.date_to is None:
+                self.dates_unrestricted |= 1 << bit
+                continue
+            if rule.date_from is not None:
+                bounds.add(rule.date_from)
+            if rule.date_to is not None:
+                bounds.add(rule.date_to)
+        # Kazda granica jest osobnym punktem, a miedzy granicami sa odcinki otwarte:
+        # pozycja 2*i+1 to punkt bounds[i], parzyste pozycje to odcinki pomiedzy
+        self.date_bounds = sorted(bounds)
+        slots = [self.dates_unrestricted] * (2 * len(self.date_bounds) + 1)
+        for bit, rule in enumerate(self.rules):
+            if rule.date_from is None and rule.date_to is None:
+                continue
+            first = 0 if rule.date_from is None else 2 * bisect_left(self.date_bounds, rule.date_from) + 1
+            last = len(slots) - 1 if rule.date_to is None else 2 * bisect_left(self.date_bounds, rule.date_to) + 1
+            for slot in range(first, last + 1):
+                slots[slot] |= 1 << bit
+        self.date_slots = slots
+
+    def _price_mask(self, price):
+        position = bisect_left(self.price_bounds, price)
+        if position == len(self.price_bounds):
+            return self.price_unlimited
+        return self.price_bits[position]
+
+    def _date_mask(self, dates):
+        if not dates:
+            # Oferty bez daty (np. TUI) pasuja tylko do regul bez zakresu dat
+            return self.dates_unrestricted
+        position = bisect_left(self.date_bounds, dates)
+        if position < len(self.date_bounds) and self.date_bounds[position] == dates:
+            return self.date_slots[2 * position + 1]
+        return self.date_slots[2 * position]
+
+    def match(self, offer):
+        countries, airports, providers = self.countries, self.airports, self.providers
+        bits = countries.get(offer.country, countries[None])
+        if bits:
+            bits &= airports.get(offer.departure_airport, airports[None])
+        if bits:
+            bits &= providers.get(offer.provider, providers[None])
+        if bits:
+            bits &= self._price_mask(float(offer.price))
+        if bits:
+            bits &= self._date_mask(offer.dates)
+        return [self.rules[bit] for bit in iter_bits(bits)]
+
+    def deliveries(self, offers):
+        # chat_id -> oferty (kazda najwyzej raz na czat, w kolejnosci wejsciowej)
+        chats = {}
+        for offer in offers:
+            seen = set()
+            for rule in self.match(offer):
+                if rule.chat_id not in seen:
+                    seen.add(rule.chat_id)
+                    chats.setdefault(rule.chat_id, []).append(offer)
+        return chats
@@ -0,0 +1,374 @@
+# Benchmark calego potoku bez sieci:
+#   python -m benchmarks.pipeline_bench --offers 10000 --output wyniki.json
+#   python -m benchmarks.pipeline_bench --offers 10000 --baseline wyniki.json
+# Providerzy i Telegram sa zastapieni lokalnym serwerem (benchmarks/stub.py), a baza -
+# polaczeniem w pamieci pod prawdziwym DatabaseManager (DB_BULK_MODE=copy mierzy sciezke COPY).
+# Z --postgres uzywana jest prawdziwa baza z BENCH_DB_HOST/USER/PASSWORD/DATABASE
+# (tabele sa czyszczone, wiec nigdy nie wskazuj bazy produkcyjnej).
+import argparse
+import asyncio
+import csv
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+# Konfiguracja musi byc ustawiona przed importem modulow bota
+os.environ.setdefault("LOG_LEVEL", "WARN")
+os.environ["SEEN_INDEX_PATH"] = ""
+os.environ["FLIGHT_OUTBOX_JOURNAL"] = ""
+os.environ.setdefault("TELEGRAM_GLOBAL_RATE", "1000000")
+os.environ.setdefault("TELEGRAM_CHAT_RATE", "1000000")
+os.environ.setdefault("PROVIDER_TIMEOUT", "3600")
+os.environ.setdefault("PAGINATION_MAX_PAGES", "100000")
+
+from psycopg2.extensions import adapt  # noqa: E402
+
+from benchmarks.stub import LocalHttpClient, ProviderStub, fake_telegram_bot  # noqa: E402
+from flight_search import COPY_NULL, DataFetcher, DatabaseManager, TravelDealsBot  # noqa: E402
+
+STAGES = (
+    "fetch_cold",
+    "fetch_warm",
+    "add_to_db",
+    "add_to_db_repeat",
+    "check_active",
+    "render",
+    "deliver",
+)
+
+
+async def fetch_all(fetcher):
+    # Wszyscy providerzy rownolegle, tak jak w pierwszym cyklu schedulera
+    results = await asyncio.gather(*(fetcher.fetch_provider(name) for name in fetcher.providers))
+    offers = [offer for result in results for offer in result[0]]
+    all_offers = [offer for result in results for offer in result[1]]
+    return offers, all_offers
+
+
+class MemoryTables:
+    # Stan tabel destination_changes / current_offers / staging; offer_key -> [wiersz, active]
+    def __init__(self):
+        self.rows = {}
+        self.current = set()
+        self.staging = []
+
+    def insert(self, rows):
+        inserted = []
+        for values in rows:
+            key = int(values[-1])
+            if key not in self.rows:
+                self.rows[key] = [values, True]
+                inserted.append(key)
+        return inserted
+
+    def deactivate_missing(self, provider):
+        deactivated = 0
+        for key, row in self.rows.items():
+            if row[1] and (provider is None or row[0][7] == provider) and key not in self.current:
+                row[1] = False
+                deactivated += 1
+        return deactivated
+
+    def set_active(self, keys, active):
+        changed = 0
+        for key in keys:
+            row = self.rows.get(key)
+            if row is not None and row[1] != active:
+                row[1] = active
+                changed += 1
+        return changed
+
+
+class MemoryCursor:
+    # Zamiast serwera: zapytania sa renderowane tak jak przez kursor psycopg2 (mogrify w
+    # execute_values, csv w COPY), a ich skutek odwzorowany na MemoryTables. Etapy add_to_db
+    # i check_active mierza wiec caly kod zapisu bota, bez samego Postgresa.
+    def __init__(self, connection):
+        self.connection = connection
+        self.tables = connection.tables
+        self.rowcount = -1
+        self.rows = []
+        self.values = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def _quote(value):
+        adapted = adapt(value)
+        if hasattr(adapted, "encoding"):
+            adapted.encoding = "utf_8"
+        return adapted.getquoted()
+
+    def mogrify(self, template, args):
+        if isinstance(template, str):
+            template = template.encode("utf-8")
+        self.values.append(args)
+        return template % tuple(self._quote(value) for value in args)
+
+    def copy_expert(self, statement, buffer):
+        for row in csv.reader(buffer):
+            self.tables.staging.append([None if value == COPY_NULL else value for value in row])
+
+    def execute(self, query, params=None):
+        values, self.values = self.values, []
+        self.rows = []
+        self.rowcount = 0
+        if isinstance(query, bytes):
+            query = query.decode("utf-8")
+        if not isinstance(query, str):
+            # DDL partycji (psycopg2.sql) - bez skutku
+            return
+        statement = " ".join(query.split())
+        tables = self.tables
+        if "INSERT INTO destination_changes" in statement:
+            if "FROM staging_destination_changes" in statement:
+                values, tables.staging = tables.staging, []
+            inserted = tables.insert(values)
+            self.rows = [(1,)] * len(inserted)
+            self.rowcount = len(inserted)
+        elif statement.startswith("INSERT INTO current_offers"):
+            tables.current.update(row[0] for row in values)
+        elif statement.startswith("EXECUTE deactivate_missing"):
+            self.rowcount = tables.deactivate_missing(params[0] if params else None)
+        elif statement.startswith("EXECUTE activate_current_offers"):
+            self.rowcount = tables.set_active(tables.current, True)
+        elif statement.startswith("EXECUTE set_offers_active"):
+            self.rowcount = tables.set_active(params[0], "True)" in statement)
+        # CREATE / PREPARE / ANALYZE / SELECT 1 - bez skutku
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+
+class MemoryConnection:
+    encoding = "UTF8"
+    closed = 0
+
+    def __init__(self, tables):
+        self.tables = tables
+
+    def cursor(self):
+        return MemoryCursor(self)
+
+    def commit(self):
+        # current_offers i staging sa ON COMMIT DELETE ROWS
+        self.tables.current.clear()
+        self.tables.staging = []
+
+    def rollback(self):
+        self.commit()
+
+
+class MemoryPool:
+    closed = False
+
+    def __init__(self, tables):
+        self.conn = MemoryConnection(tables)
+
+    def getconn(self):
+        return self.conn
+
+    def putconn(self, conn):
+        pass
+
+    def closeall(self):
+        pass
+
+
+class MemoryDatabase(DatabaseManager):
+    # Prawdziwy DatabaseManager (partie, execute_values / COPY, przygotowane zapytania) na
+    # polaczeniu w pamieci - podmieniona jest tylko pula polaczen
+    def __init__(self):
+        super().__init__(None, None, None, None)
+        self.tables = MemoryTables()
+        self.memory_pool = MemoryPool(self.tables)
+
+    def connect(self):
+        return self.memory_pool
+
+    def create_table(self):
+        pass
+
+    def alert_rules(self):
+        return []
+
+
+def postgres_database():
+    db = DatabaseManager(
+        host=os.environ["BENCH_DB_HOST"],
+        user=os.environ["BENCH_DB_USER"],
+        password=os.environ["BENCH_DB_PASSWORD"],
+        database=os.environ["BENCH_DB_DATABASE"],
+    )
+    db.create_table()
+    with db.connection() as conn:
+        conn.cursor().execute("TRUNCATE destination_changes, price_observations")
+    return db
+
+
+class Timer:
+    def __init__(self):
+        self.results = {}
+
+    def record(self, stage, seconds, rows):
+        result = self.results.setdefault(stage, {"seconds": [], "rows": rows})
+        result["seconds"].append(seconds)
+
+    async def measure(self, stage, coroutine, rows=None):
+        started = time.perf_counter()
+        value = await coroutine
+        self.record(stage, time.perf_counter() - started, rows)
+        return value
+
+    def measure_sync(self, stage, function, *args, rows=None):
+        started = time.perf_counter()
+        value = function(*args)
+        self.record(stage, time.perf_counter() - started, rows)
+        return value
+
+
+async def run_once(stub, timer, use_postgres, deliver):
+    db = postgres_database() if use_postgres else MemoryDatabase()
+    fetcher = DataFetcher(http_client=LocalHttpClient(stub.url))
+    bot = TravelDealsBot("123456:benchmark", 1, db, fetcher)
+    bot.bot = bot.outbox.bot = fake_telegram_bot(stub.url)
+    try:
+        offers, all_offers = await timer.measure("fetch_cold", fetch_all(fetcher))
+        rows = len(all_offers)
+        timer.results["fetch_cold"]["rows"] = rows
+        await timer.measure("fetch_warm", fetch_all(fetcher), rows)
+        timer.measure_sync("add_to_db", db.add_to_db, all_offers, rows=rows)
+        timer.measure_sync("add_to_db_repeat", db.add_to_db, all_offers, rows=rows)
+        timer.measure_sync("check_active", db.check_active, all_offers, rows=rows)
+        timer.measure_sync("render", bot.queue_offers, offers, "all", rows=len(offers))
+        if deliver:
+            sent = len(stub.telegram_messages)
+            await timer.measure("deliver", bot.outbox.flush(), bot.outbox.pending)
+            timer.results["deliver"]["rows"] = len(stub.telegram_messages) - sent
+    finally:
+        await bot.outbox.close(timeout=0)
+        await bot.bot.session.close()
+        await fetcher.http.close()
+        db.close()
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout.strip()
+    except OSError:
+        return None
+
+
+def summarize(timer):
+    summary = {}
+    for stage in STAGES:
+        if stage not in timer.results:
+            continue
+        result = timer.results[stage]
+        median = statistics.median(result["seconds"])
+        summary[stage] = {
+            "median": median,
+            "min": min(result["seconds"]),
+            "seconds": result["seconds"],
+            "rows": result["rows"],
+            "rows_per_second": result["rows"] / median if result["rows"] and median else None,
+        }
+    return summary
+
+
+def print_report(report, baseline=None, threshold=0.2):
+    # Zwraca liczbe etapow wolniejszych od bazowego pomiaru o wiecej niz threshold
+    regressions = 0
+    meta = report["meta"]
+    print(
+        f"{meta['offers']} offers, {meta['repeat']} runs, db={meta['database']}, "
+        f"python {meta['python']}, commit {meta['commit']}"
+    )
+    for stage, result in report["results"].items():
+        line = f"{stage:18} {result['median'] * 1000:10.1f} ms"
+        if result["rows_per_second"]:
+            line += f" {result['rows_per_second']:14,.0f} rows/s"
+        previous = (baseline or {}).get("results", {}).get(stage)
+        if previous and previous["median"]:
+            change = result["median"] / previous["median"] - 1
+            line += f"  {change:+7.1%} vs baseline"
+            if change > threshold:
+                regressions += 1
+                line += "  REGRESSION"
+        print(line)
+    return regressions
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Offline FlightAlert pipeline benchmark")
+    parser.add_argument("--offers", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-etags", action="store_true", help="stub ignores If-None-Match")
+    parser.add_argument("--no-deliver", action="store_true", help="skip fake Telegram delivery")
+    parser.add_argument("--postgres", action="store_true", help="use BENCH_DB_* Postgres")
+    parser.add_argument("--output", help="write JSON report to this file")
+    parser.add_argument("--baseline", help="compare against an earlier JSON report")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    # Strony ITAKA tak duze, zeby liczba stron pozostala rozsadna takze przy 1M ofert
+    os.environ.setdefault("ITAKA_PAGE_SIZE", str(max(50, args.offers // 200)))
+
+    stub = ProviderStub(args.offers, etags=not args.no_etags)
+    await stub.start()
+    timer = Timer()
+    try:
+        for _ in range(args.repeat):
+            await run_once(stub, timer, args.postgres, not args.no_deliver)
+    finally:
+        await stub.stop()
+
+    report = {
+        "meta": {
+            "offers": args.offers,
+            "repeat": args.repeat,
+            "database": "postgres" if args.postgres else "memory",
+            "etags": not args.no_etags,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "commit": git_commit(),
+            "time": datetime.now().isoformat(timespec="seconds"),
+        },
+        "results": summarize(timer),
+    }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        for key in ("offers", "database", "etags"):
+            if baseline["meta"].get(key) != report["meta"][key]:
+                print(f"Warning: baseline was measured with {key}={baseline['meta'].get(key)}")
+    regressions = print_report(report, baseline, args.threshold)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,106 @@
+# Przepustowosc renderowania wiadomosci: python -m benchmarks.render_bench [liczba_ofert]
+import random
+import re
+import sys
+import time
+
+from message_renderer import markdown_v2_length, pack_messages
+from offer import PackageOffer
+from offer_search import OFFER_ROW
+
+
+def legacy_escape_markdown(text):
+    special_chars = r"\*_[]()~`>#+-=|{}.!"
+
+    def escape_char(match):
+        return f"\\{match.group(0)}"
+
+    return re.sub(f"[{re.escape(special_chars)}]", escape_char, text)
+
+
+def legacy_render(offers):
+    escape_markdown = legacy_escape_markdown
+    messages = []
+    message_string = ""
+    message_len = 0
+    for offer in offers:
+        link = offer.link
+        message_string_temp = f"{escape_markdown('- - '+offer.provider+' - -')} 🔗[Link]({link})\n✈️ {escape_markdown(str(offer.departure_place))}\n🌍{escape_markdown(str(offer.country + ' - ' + offer.city))}\n⭐{escape_markdown(str(offer.hotel_standard) + ' ' + offer.board_type)}\n📅{escape_markdown(str(offer.departure_date + ' - ' + offer.return_date))}\n💵 {escape_markdown(str(offer.full_price) + offer.currency)} {escape_markdown(str('('+str(int(offer.full_price)/offer.adults) + offer.currency+'/os)'))} \n\n"
+        temp_length = len(message_string_temp.replace(link, "").replace("\n", "")) - 4
+        if message_len + temp_length > 4096:
+            messages.append(message_string)
+            message_len = 0
+            message_string = ""
+        message_len += temp_length
+        message_string += message_string_temp
+    messages.append(message_string)
+    return messages
+
+
+def render(offers):
+    rows = (
+        OFFER_ROW.render(
+            provider=offer.provider,
+            link=offer.link,
+            departure_place=offer.departure_place,
+            country=offer.country,
+            city=offer.city,
+            hotel_standard=offer.hotel_standard,
+            board_type=offer.board_type,
+            departure_date=offer.departure_date,
+            return_date=offer.return_date,
+            full_price=offer.full_price,
+            currency=offer.currency,
+            per_person=int(offer.full_price) / offer.adults,
+        )
+        for offer in offers
+    )
+    return pack_messages(rows)
+
+
+def synthetic_offers(count, seed=1):
+    rng = random.Random(seed)
+    cities = ["Palma de Mallorca", "Hurghada (Red Sea)", "Side-Kumkoy", "Agia Napa", "Funchal!"]
+    return [
+        PackageOffer(
+            rng.choice(["TUI", "WakacjePL"]),
+            "https://example.com/",
+            adults=rng.choice([1, 2]),
+            offer_url=f"offer/{i}?code=A_{i}",
+            offer_code=f"A{i}",
+            departure_place="Warszawa (WAW)",
+            country=rng.choice(["Hiszpania", "Egipt", "Turcja", "Cypr"]),
+            city=rng.choice(cities),
+            hotel_standard=rng.choice([3, 3.5, 4, 5]),
+            board_type=rng.choice(["All Inclusive", "Śniadania", "HB+"]),
+            departure_date="2026-11-0" + str(rng.randint(1, 9)),
+            return_date="2026-11-1" + str(rng.randint(0, 9)),
+            full_price=rng.randint(900, 8000),
+            currency="PLN",
+        )
+        for i in range(count)
+    ]
+
+
+def bench(name, function, offers, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        messages = function(offers)
+        best = min(best, time.perf_counter() - start)
+    lengths = [markdown_v2_length(message) for message in messages]
+    print(
+        f"{name:8} {len(offers) / best:12,.0f} rows/s  {len(messages):5} messages  "
+        f"max {max(lengths)} chars  over limit: {sum(length > 4096 for length in lengths)}"
+    )
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    offers = synthetic_offers(count)
+    bench("legacy", legacy_render, offers)
+    bench("renderer", render, offers)
+
+
+if __name__ == "__main__":
+    main()
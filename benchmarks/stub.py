@@ -0,0 +1,171 @@
+import copy
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+from aiohttp import web
+
+from http_client import HttpClient
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+AIRPORTS = ["PMI", "HER", "AYT", "HRG", "RHO", "BOJ", "TFS", "FUE", "CFU", "SSH", "DJE", "LCA"]
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def synthetic_payloads(count):
+    # Nagrane odpowiedzi powielone do `count` ofert (40% Rainbow, 20% TUI, 40% ITAKA)
+    rainbow_count = count * 2 // 5
+    tui_count = count // 5
+    itaka_count = count - rainbow_count - tui_count
+    start = datetime(2024, 8, 1, 6, 0)
+
+    templates = load_fixture("rainbow.json")["Destynacje"]
+    rainbow = []
+    for i in range(rainbow_count):
+        item = copy.deepcopy(templates[i % len(templates)])
+        code = AIRPORTS[i % len(AIRPORTS)]
+        departure = start + timedelta(days=i % 180, minutes=i % 600)
+        price = 500 + i
+        item["Klucz"] = code
+        item["TerminWyjazdu"] = departure.strftime("%Y-%m-%dT%H:%M:%SZ")
+        item["Cena"] = f"{price:,}".replace(",", " ")
+        item["DataLayer"]["price"] = price
+        item["DataLayer"]["name"] = f"{item['Nazwa']} WAW - {code} {departure:%d/%m/%Y}"
+        rainbow.append(item)
+
+    templates = load_fixture("tui.json")
+    tui = []
+    for i in range(tui_count):
+        item = dict(templates[i % len(templates)])
+        item["airportCode"] = AIRPORTS[i % len(AIRPORTS)]
+        item["perPersonPrice"] = str(400 + i)
+        tui.append(item)
+
+    templates = load_fixture("itaka.json")["data"]["charterFlights"]["items"]
+    itaka = []
+    for i in range(itaka_count):
+        item = copy.deepcopy(templates[i % len(templates)])
+        item["departureRoute"]["airport"]["iata"] = AIRPORTS[i % len(AIRPORTS)]
+        item["departureRoute"]["date"] = (start + timedelta(days=i % 180)).strftime(
+            "%Y-%m-%dT%H:%M:%S"
+        )
+        item["pricePerPerson"]["amount"] = 300 + i
+        itaka.append(item)
+
+    return {"Destynacje": rainbow}, tui, itaka
+
+
+class ProviderStub:
+    # Lokalny serwer zamiast r.pl, tui.pl, itaka.pl i api.telegram.org
+    def __init__(self, count, etags=True):
+        rainbow, tui, self.itaka = synthetic_payloads(count)
+        self.bodies = {
+            "rainbow": json.dumps(rainbow, ensure_ascii=False).encode("utf-8"),
+            "tui": json.dumps(tui, ensure_ascii=False).encode("utf-8"),
+        }
+        self.etags = etags
+        self.telegram_messages = []
+        self.requests = 0
+        self.runner = None
+        self.url = None
+
+    def respond(self, request, body):
+        self.requests += 1
+        etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+        if self.etags and request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.Response(
+            body=body,
+            content_type="application/json",
+            headers={"ETag": etag} if self.etags else None,
+        )
+
+    async def rainbow(self, request):
+        return self.respond(request, self.bodies["rainbow"])
+
+    async def tui(self, request):
+        return self.respond(request, self.bodies["tui"])
+
+    async def itaka_graphql(self, request):
+        variables = (await request.json())["variables"]
+        page, limit = variables["page"], variables["limit"]
+        items = self.itaka[(page - 1) * limit : page * limit]
+        body = json.dumps(
+            {"data": {"charterFlights": {"items": items, "totalCount": len(self.itaka)}}}
+        ).encode("utf-8")
+        return self.respond(request, body)
+
+    async def telegram(self, request):
+        data = await request.post() if request.content_type != "application/json" else await request.json()
+        self.telegram_messages.append(data.get("text"))
+        return web.json_response(
+            {
+                "ok": True,
+                "result": {
+                    "message_id": len(self.telegram_messages),
+                    "date": int(datetime.now().timestamp()),
+                    "chat": {"id": int(data.get("chat_id", 0)), "type": "private"},
+                    "text": data.get("text"),
+                },
+            }
+        )
+
+    async def start(self, port=0):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_get("/api/wyszukiwanie/wyszukaj", self.rainbow)
+        app.router.add_post("/api/www/multiCharters", self.tui)
+        app.router.add_post("/api/graphql", self.itaka_graphql)
+        app.router.add_post("/bot{token}/{method}", self.telegram)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self.url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+
+class _RedirectedSession:
+    def __init__(self, session, base_url):
+        self.session = session
+        self.base_url = base_url
+
+    def request(self, method, url, **kwargs):
+        parts = urlsplit(url)
+        query = f"?{parts.query}" if parts.query else ""
+        return self.session.request(method, f"{self.base_url}{parts.path}{query}", **kwargs)
+
+    @property
+    def closed(self):
+        return self.session.closed
+
+    async def close(self):
+        await self.session.close()
+
+
+class LocalHttpClient(HttpClient):
+    # HttpClient, ktory wszystkie zapytania kieruje do ProviderStub
+    def __init__(self, base_url, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url
+
+    def session(self):
+        return _RedirectedSession(super().session(), self.base_url)
+
+
+def fake_telegram_bot(base_url, token="123456:benchmark"):
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    return Bot(token=token, session=AiohttpSession(api=TelegramAPIServer.from_base(base_url)))
@@ -0,0 +1,192 @@
+import asyncio
+import math
+import os
+import random
+import socket
+import time
+import uuid
+
+from logger import Logger
+from metrics import LEASES_HELD
+from migrations import migrate
+
+
+class Coordinator:
+    # Podzial zadan odpytywania miedzy procesy (workery gunicorna, kolejne maszyny) przez
+    # dzierzawy w tabeli job_leases. Kazdy proces co renew_interval odnawia swoje dzierzawy
+    # i zapisuje heartbeat; bierze najwyzej ceil(zadania / zywe procesy) zadan, a nadmiar
+    # oddaje, wiec nowy proces dostaje czesc pracy. Dzierzawa martwego procesu wygasa po ttl
+    # i przejmuje ja ktos inny.
+    def __init__(self, db, worker_id=None, ttl=None, renew_interval=None):
+        self.db = db
+        self.worker_id = worker_id or (
+            f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        )
+        self.ttl = ttl or float(os.getenv("LEASE_TTL", 30))
+        self.renew_interval = renew_interval or float(
+            os.getenv("LEASE_RENEW_INTERVAL", self.ttl / 3)
+        )
+        # nazwa zadania -> callback(przejete od innego procesu)
+        self.jobs = {}
+        # nazwa zadania -> lokalny termin waznosci (time.monotonic)
+        self.leases = {}
+        self._task = None
+        self._migrated = False
+
+    def register(self, name, on_acquire=None):
+        self.jobs[name] = on_acquire
+
+    def owns(self, name):
+        expires = self.leases.get(name)
+        return expires is not None and time.monotonic() < expires
+
+    def start(self):
+        # Wywolywane w dzialajacej petli; kilka schedulerow moze dzielic jednego koordynatora
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        Logger.info("Coordinator %s started", self.worker_id, worker=self.worker_id)
+        while True:
+            try:
+                acquired = await asyncio.to_thread(self.renew)
+                for name, takeover in acquired:
+                    callback = self.jobs.get(name)
+                    if callback is not None:
+                        callback(takeover)
+            except Exception as e:
+                # Bez bazy dzierzawy wygasaja same - lepiej nie pobierac niz pobierac podwojnie
+                Logger.error(f"Lease renewal failed: {e}")
+            LEASES_HELD.set(sum(self.owns(name) for name in self.jobs))
+            await asyncio.sleep(self.renew_interval)
+
+    def renew(self):
+        # Wykonywane w watku; zwraca [(zadanie, przejete od innego procesu)]
+        if not self._migrated:
+            migrate(self.db)
+            self._migrated = True
+        started = time.monotonic()
+        jobs = list(self.jobs)
+        acquired = []
+        with self.db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                INSERT INTO coordinator_workers (worker_id, heartbeat_at) VALUES (%s, now())
+                ON CONFLICT (worker_id) DO UPDATE SET heartbeat_at = now()
+                """,
+                (self.worker_id,),
+            )
+            cursor.execute(
+                "DELETE FROM coordinator_workers WHERE heartbeat_at < now() - %s * interval '1 second'",
+                (3 * self.ttl,),
+            )
+            cursor.execute(
+                "SELECT count(*) FROM coordinator_workers WHERE heartbeat_at >= now() - %s * interval '1 second'",
+                (self.ttl,),
+            )
+            workers = max(cursor.fetchone()[0], 1)
+            target = math.ceil(len(jobs) / workers)
+
+            cursor.execute(
+                """
+                UPDATE job_leases SET expires_at = now() + %s * interval '1 second'
+                WHERE owner = %s AND job = ANY(%s)
+                RETURNING job
+                """,
+                (self.ttl, self.worker_id, jobs),
+            )
+            held = sorted(row[0] for row in cursor.fetchall())
+            lost = [name for name in self.leases if name not in held]
+            released = held[target:]
+            if released:
+                # Nadmiar dla pozostalych procesow (np. po dolaczeniu nowego)
+                # Wiersz zostaje z wygasla data, zeby nastepca wiedzial, ze przejmuje zadanie
+                cursor.execute(
+                    """
+                    UPDATE job_leases SET expires_at = now() - interval '1 second'
+                    WHERE owner = %s AND job = ANY(%s)
+                    """,
+                    (self.worker_id, released),
+                )
+                Logger.info("Releasing %s jobs to other workers", len(released))
+                held = held[:target]
+
+            free = [name for name in jobs if name not in held]
+            if len(held) < target and free:
+                cursor.execute(
+                    """
+                    SELECT job, owner, expires_at >= now() FROM job_leases
+                    WHERE job = ANY(%s)
+                    FOR UPDATE
+                    """,
+                    (free,),
+                )
+                previous = {}
+                taken = set()
+                for name, owner, valid in cursor.fetchall():
+                    previous[name] = owner
+                    if valid:
+                        taken.add(name)
+                candidates = [name for name in free if name not in taken]
+                # Losowa kolejnosc, zeby procesy startujace jednoczesnie nie walczyly o te same zadania
+                random.shuffle(candidates)
+                for name in candidates[: target - len(held)]:
+                    cursor.execute(
+                        """
+                        INSERT INTO job_leases (job, owner, expires_at)
+                        VALUES (%s, %s, now() + %s * interval '1 second')
+                        ON CONFLICT (job) DO UPDATE
+                        SET owner = EXCLUDED.owner, expires_at = EXCLUDED.expires_at
+                        WHERE job_leases.expires_at < now()
+                        RETURNING job
+                        """,
+                        (name, self.worker_id, self.ttl),
+                    )
+                    if cursor.fetchone():
+                        held.append(name)
+                        takeover = previous.get(name) not in (None, self.worker_id)
+                        acquired.append((name, takeover))
+
+        # Lokalny termin liczony od poczatku rundy, wiec nigdy nie wykracza poza ten w bazie
+        expires = started + self.ttl
+        for name in lost:
+            Logger.warn("Lost lease on %s", name, job=name)
+            self.leases.pop(name, None)
+        for name in released:
+            self.leases.pop(name, None)
+        for name in held:
+            self.leases[name] = expires
+        for name, takeover in acquired:
+            Logger.info(
+                "Acquired lease on %s%s", name, " (taken over)" if takeover else "", job=name
+            )
+        return acquired
+
+    def release(self):
+        self.leases.clear()
+        with self.db.connection() as conn:
+            cursor = conn.cursor()
+            # Wiersze zostaja z wygasla data - nastepca wie, ze przejmuje zadanie od innego
+            # procesu (jego indeks widzianych ofert jest inny), tak jak przy oddawaniu nadmiaru
+            cursor.execute(
+                """
+                UPDATE job_leases SET expires_at = now() - interval '1 second'
+                WHERE owner = %s
+                """,
+                (self.worker_id,),
+            )
+            cursor.execute(
+                "DELETE FROM coordinator_workers WHERE worker_id = %s", (self.worker_id,)
+            )
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        # Oddanie dzierzaw od razu - inne procesy nie czekaja na wygasniecie
+        try:
+            await asyncio.to_thread(self.release)
+        except Exception as e:
+            Logger.error(f"Could not release leases: {e}")
+        self.db.close()
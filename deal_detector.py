@@ -0,0 +1,155 @@
+import os
+
+import numpy as np
+
+from logger import Logger
+
+
+def route_key(offer):
+    return (offer.airports, offer.dates, offer.brand)
+
+
+class DealDetector:
+    # Dla kazdej trasy (lotniska, data, marka) trzyma ostatnie `window` poziomow ceny w buforze
+    # cyklicznym numpy. Nowy poziom jest dopisywany tylko, gdy najnizsza cena trasy w cyklu sie
+    # zmienila; update() zwraca te poziomy do zapisu w route_price_levels, a seed() odtwarza
+    # z nich bufory na starcie.
+    # Okazja to cena nizsza od mediany o `threshold` i ponizej percentyla `percentile`.
+    def __init__(
+        self,
+        window=None,
+        threshold=None,
+        percentile=None,
+        min_history=None,
+        alert_new_routes=None,
+    ):
+        self.window = window or int(os.getenv("DEAL_WINDOW", 30))
+        self.threshold = threshold if threshold is not None else float(
+            os.getenv("DEAL_THRESHOLD", 0.15)
+        )
+        self.percentile = percentile or float(os.getenv("DEAL_PERCENTILE", 25))
+        self.min_history = min_history or int(os.getenv("DEAL_MIN_HISTORY", 3))
+        if alert_new_routes is None:
+            alert_new_routes = os.getenv("DEAL_ALERT_NEW_ROUTES", "1") != "0"
+        self.alert_new_routes = alert_new_routes
+
+        self.routes = {}
+        self.prices = np.full((0, self.window), np.nan)
+        self.position = np.zeros(0, dtype=np.int64)
+        self.count = np.zeros(0, dtype=np.int64)
+        self.last = np.zeros(0)
+        self.median = np.zeros(0)
+        self.low = np.zeros(0)
+
+    def __len__(self):
+        return len(self.routes)
+
+    def _route_ids(self, keys):
+        routes = self.routes
+        ids = np.fromiter((routes.setdefault(key, len(routes)) for key in keys), np.int64)
+        if len(routes) > len(self.prices):
+            self._grow(len(routes))
+        return ids
+
+    def _grow(self, size):
+        size = max(size, 2 * len(self.prices), 1024)
+        grown = len(self.prices)
+
+        def extend(array, fill):
+            extra = np.full((size - grown,) + array.shape[1:], fill, dtype=array.dtype)
+            return np.concatenate([array, extra])
+
+        self.prices = extend(self.prices, np.nan)
+        self.position = extend(self.position, 0)
+        self.count = extend(self.count, 0)
+        self.last = extend(self.last, np.nan)
+        self.median = extend(self.median, np.nan)
+        self.low = extend(self.low, np.nan)
+
+    def _push(self, ids, prices):
+        # ids sa unikalne; dopisywane sa tylko trasy, ktorych cena sie zmienila (zwraca maske)
+        changed = self.last[ids] != prices
+        ids = ids[changed]
+        prices = prices[changed]
+        if not len(ids):
+            return changed
+        self.prices[ids, self.position[ids]] = prices
+        self.position[ids] = (self.position[ids] + 1) % self.window
+        self.count[ids] += 1
+        self.last[ids] = prices
+        self._refresh(ids)
+        return changed
+
+    def _refresh(self, ids):
+        # Niewypelnione pozycje bufora to NaN - po sortowaniu laduja na koncu wiersza, wiec
+        # kwantyle liczone sa recznie na pierwszych n wartosciach (np.nan* jest wielokrotnie wolniejsze)
+        rows = np.sort(self.prices[ids], axis=1)
+        filled = np.minimum(self.count[ids], self.window)
+        self.median[ids] = self._quantile(rows, filled, 0.5)
+        self.low[ids] = self._quantile(rows, filled, self.percentile / 100)
+
+    @staticmethod
+    def _quantile(rows, filled, q):
+        position = (filled - 1) * q
+        below = np.floor(position).astype(np.int64)
+        above = np.ceil(position).astype(np.int64)
+        low = np.take_along_axis(rows, below[:, None], axis=1)[:, 0]
+        high = np.take_along_axis(rows, above[:, None], axis=1)[:, 0]
+        return low + (position - below) * (high - low)
+
+    def update(self, offers):
+        # Jedna obserwacja na trase na cykl: najnizsza cena trasy. Zwraca nowe poziomy
+        # [(airports, dates, brand, price)] - w tym samym ksztalcie, ktory przyjmuje seed()
+        if not offers:
+            return []
+        keys = [route_key(offer) for offer in offers]
+        ids = self._route_ids(keys)
+        prices = np.fromiter((offer.price for offer in offers), float, len(offers))
+        unique, first, inverse = np.unique(ids, return_index=True, return_inverse=True)
+        lowest = np.full(len(unique), np.inf)
+        np.minimum.at(lowest, inverse, prices)
+        changed = self._push(unique, lowest)
+        return [
+            keys[index] + (float(price),)
+            for index, price in zip(first[changed], lowest[changed])
+        ]
+
+    def seed(self, rows):
+        # rows: poziomy z update() (airports, dates, brand, price) w kolejnosci obserwacji
+        history = {}
+        for airports, dates, brand, price in rows:
+            if price is None:
+                continue
+            levels = history.setdefault((airports, dates, brand), [])
+            if not levels or levels[-1] != price:
+                levels.append(float(price))
+        if not history:
+            return
+        ids = self._route_ids(history)
+        for route_id, levels in zip(ids, history.values()):
+            levels = levels[-self.window :]
+            self.prices[route_id, : len(levels)] = levels
+            self.position[route_id] = len(levels) % self.window
+            self.count[route_id] += len(levels)
+            self.last[route_id] = levels[-1]
+        self._refresh(ids)
+        Logger.info("Seeded deal baselines for %s routes", len(history))
+
+    def score(self, offers):
+        # Cena / mediana trasy (NaN dla tras bez wystarczajacej historii)
+        ids = self._route_ids(route_key(offer) for offer in offers)
+        prices = np.fromiter((offer.price for offer in offers), float, len(offers))
+        median = np.where(self.count[ids] >= self.min_history, self.median[ids], np.nan)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return prices / median, prices <= self.low[ids], self.count[ids]
+
+    def deals(self, offers):
+        # Oferty bijace baseline; wywolywac przed update() z tego samego cyklu
+        if not offers:
+            return []
+        ratio, below_low, count = self.score(offers)
+        beats = (ratio <= 1 - self.threshold) & below_low
+        if self.alert_new_routes:
+            # Bez historii zostaje dawne zachowanie: kazda nowa oferta jest ogloszona
+            beats |= count < self.min_history
+        return [offer for offer, deal in zip(offers, beats) if deal]
@@ -1,310 +1,730 @@
 import asyncio
-import inspect
+import csv
+import functools
+import io
 import time
 import aiohttp  # Zamiast requests
-import pandas as pd
-from datetime import datetime
+from datetime import datetime, timedelta
 import psycopg2
+import psycopg2.extras
+import psycopg2.pool
 from psycopg2 import sql
 import json
+import threading
+import weakref
+from contextlib import contextmanager
 from aiogram import Bot
 from telegram.ext import Application
 from dotenv import load_dotenv
 import os
 
-load_dotenv()
-
-
-class Logger:
-    @staticmethod
-    def _send(text):
-        print(f"[{datetime.now()}]{text}")
+from alert_rules import AlertRule, RuleIndex
+from deal_detector import DealDetector
+from http_client import HttpClient
+from logger import Logger
+from message_renderer import MessageTemplate, pack_messages
+from metrics import (
+    DB_ROWS_WRITTEN,
+    NEW_OFFERS,
+    OFFER_EVENTS,
+    ROWS_FETCHED,
+    STAGE_DURATION,
+    UNCHANGED_PAYLOADS,
+)
+from migrations import ensure_price_partition, migrate, month_start, next_month
+from offer import Offer
+from outbox import TelegramOutbox
+from pagination import paginate
+from persistence import WriteBatch, WriteBehindWriter
+from scheduler import CHANGED, PRICES_MOVED, UNCHANGED, AdaptiveScheduler
+from seen_index import SeenOfferIndex
+from snapshot_delta import ADDED, REPRICED, DeltaEngine
+from worker_slot import worker_path
 
-    @staticmethod
-    def _format_message(level, text):
-        caller_frame = inspect.currentframe().f_back
-        caller_function = caller_frame.f_code.co_name
-
-        if caller_frame.f_back:
-            caller_function = caller_frame.f_back.f_code.co_name
-
-        if caller_frame.f_back:
-            caller_frame = caller_frame.f_back
+load_dotenv()
 
-        caller_class = None
-        if "self" in caller_frame.f_locals:
-            caller_class = caller_frame.f_locals["self"].__class__.__name__
+COPY_NULL = "\\N"
+SEPARATOR = "- - - - - - - - - - - - -"
+OFFER_ROW = MessageTemplate(
+    "🤑 {price}zł 📅 {dates}[{provider}]\n🗺️{country}\n🌴{name}\n"
+    "🛬({departure_airport} - {code}) ✈️ {brand}\n" + SEPARATOR + "\n"
+)
 
-        class_info = f"[{caller_class}]"
-        return f"[{level}]{class_info}[{caller_function}]{text}"
+ITAKA_QUERY = "query charterFlights($adultsCount: Int!, $childrenCount: Int, $dateFrom: String, $dateTo: String, $departureRegions: [String!], $destinationRegions: [String!], $infantsCount: Int, $oneWay: Boolean, $page: Int, $limit: Int, $sort: CharterFlightSortDirection) {\n  charterFlights(\n    adultsCount: $adultsCount\n    childrenCount: $childrenCount\n    dateFrom: $dateFrom\n    dateTo: $dateTo\n    departureRegions: $departureRegions\n    destinationRegions: $destinationRegions\n    infantsCount: $infantsCount\n    oneWay: $oneWay\n    page: $page\n    limit: $limit\n    sort: $sort\n  ) {\n    items {\n      supplierObjectId\n      departureRoute {\n        airport {\n          city\n          iata\n          name\n          __typename\n        }\n        date\n        __typename\n      }\n      departureRouteId\n      returnRoute {\n        airport {\n          city\n          iata\n          name\n          __typename\n        }\n        date\n        __typename\n      }\n      returnRouteId\n      pricePerPerson {\n        amount\n        currency\n        __typename\n      }\n      pricePerGroup {\n        amount\n        currency\n        __typename\n      }\n      priceListCode\n      oneWay\n      url\n      offerId\n      participants {\n        adultsNumber\n        childrenAge\n        __typename\n      }\n      __typename\n    }\n    totalCount\n    __typename\n  }\n}\n"
 
-    @staticmethod
-    def info(text):
-        message = Logger._format_message("INFO", text)
-        Logger._send(message)
 
-    @staticmethod
-    def debug(text):
-        message = Logger._format_message("DEBUG", text)
-        Logger._send(message)
+class IncompleteFetch(Exception):
+    # Provider zwrocil tylko czesc ofert (np. pominiete strony)
+    pass
 
-    @staticmethod
-    def warn(text):
-        message = Logger._format_message("WARN", text)
-        Logger._send(message)
 
-    @staticmethod
-    def error(text):
-        message = Logger._format_message("ERROR", text)
-        Logger._send(message)
+def render_offer_messages(offers):
+    return pack_messages(
+        OFFER_ROW.render(
+            price=offer.price,
+            dates=offer.dates,
+            provider=offer.provider[0],
+            country=offer.country,
+            name=offer.name,
+            departure_airport=offer.departure_airport,
+            code=offer.code,
+            brand=offer.brand,
+        )
+        for offer in offers
+    )
 
 
 class DatabaseManager:
-    def __init__(self, host, user, password, database):
+    def __init__(
+        self,
+        host,
+        user,
+        password,
+        database,
+        min_connections=None,
+        max_connections=None,
+        health_check_interval=None,
+        batch_size=None,
+        bulk_mode=None,
+    ):
         Logger.info("Database Manager Initialisation")
         self.host = host
         self.user = user
         self.password = password
         self.database = database
-        self.connection = None
+        self.max_connections = max_connections or int(os.getenv("DB_POOL_MAX", 4))
+        # ThreadedConnectionPool zamyka polaczenia oddane ponad minconn, wiec domyslnie
+        # min = max - polaczenia (i przygotowane na nich zapytania) zyja miedzy cyklami
+        self.min_connections = min_connections or int(
+            os.getenv("DB_POOL_MIN", self.max_connections)
+        )
+        self.health_check_interval = health_check_interval or float(
+            os.getenv("DB_HEALTH_CHECK_INTERVAL", 60)
+        )
+        self.batch_size = batch_size or int(os.getenv("DB_BATCH_SIZE", 1000))
+        # "values" - wielowierszowe INSERT-y, "copy" - COPY do tabeli tymczasowej + jeden upsert
+        self.bulk_mode = bulk_mode or os.getenv("DB_BULK_MODE", "values")
+        self.pool = None
+        self._pool_lock = threading.Lock()
+        # polaczenie -> czas ostatniego uzycia / przygotowane zapytania; slabe klucze, bo
+        # id() zamknietego polaczenia moze dostac nowe polaczenie
+        self._last_used = weakref.WeakKeyDictionary()
+        self._prepared = weakref.WeakKeyDictionary()
+        self._partition_months = set()
 
     def connect(self):
-        Logger.info("Database Manager Connection")
-        self.connection = psycopg2.connect(
-            host=self.host,
-            user=self.user,
-            password=self.password,
-            database=self.database,
-        )
+        with self._pool_lock:
+            if self.pool is None or self.pool.closed:
+                Logger.info("Database Manager Connection")
+                self.pool = psycopg2.pool.ThreadedConnectionPool(
+                    self.min_connections,
+                    self.max_connections,
+                    host=self.host,
+                    user=self.user,
+                    password=self.password,
+                    database=self.database,
+                )
+        return self.pool
+
+    def close(self):
+        with self._pool_lock:
+            if self.pool is not None and not self.pool.closed:
+                Logger.info("Closing Database connection pool")
+                self.pool.closeall()
+            self.pool = None
+            self._last_used.clear()
+            self._prepared.clear()
+            self._partition_months.clear()
+
+    def _forget(self, conn):
+        self._last_used.pop(conn, None)
+        self._prepared.pop(conn, None)
+
+    def _discard(self, pool, conn):
+        self._forget(conn)
+        try:
+            pool.putconn(conn, close=True)
+        except Exception as e:
+            Logger.warn(f"Could not discard connection: {e}")
+
+    def _release(self, pool, conn):
+        self._last_used[conn] = time.monotonic()
+        pool.putconn(conn)
+        if conn.closed:
+            # Pula zamknela nadmiarowe polaczenie
+            self._forget(conn)
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(conn)
+        if last_used is not None and time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _checkout(self):
+        for attempt in range(2):
+            try:
+                pool = self.connect()
+                conn = pool.getconn()
+            except psycopg2.OperationalError as e:
+                Logger.warn(f"Database connection failed, reconnecting: {e}")
+                self.close()
+                continue
+            if self._is_healthy(conn):
+                return pool, conn
+            Logger.warn("Dropping broken database connection")
+            self._discard(pool, conn)
+        raise psycopg2.OperationalError("Could not obtain a healthy database connection")
+
+    @contextmanager
+    def connection(self):
+        pool, conn = self._checkout()
+        try:
+            yield conn
+            conn.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self._discard(pool, conn)
+            raise
+        except Exception:
+            conn.rollback()
+            self._release(pool, conn)
+            raise
+        else:
+            self._release(pool, conn)
+
+    def prepare(self, conn, cursor, name, statement):
+        # Zapytania sa przygotowywane raz na polaczenie i uzywane w kolejnych cyklach
+        prepared = self._prepared.setdefault(conn, set())
+        if name not in prepared:
+            cursor.execute(f"PREPARE {name} AS {statement}")
+            prepared.add(name)
 
     def create_table(self):
         try:
             Logger.info("Trying to create Table")
-            self.connect()
-            cursor = self.connection.cursor()
-            cursor.execute(
+            migrate(self)
+        except Exception as e:
+            Logger.error(f"{e}")
+
+    def ensure_partitions(self, cursor, when):
+        # Partycje biezacego i nastepnego miesiaca, DDL tylko raz na miesiac. Zwraca miesiac do
+        # zapamietania dopiero po commit - po rollbacku partycji nie ma i DDL trzeba powtorzyc
+        month = month_start(when)
+        if month in self._partition_months:
+            return None
+        ensure_price_partition(cursor, month)
+        ensure_price_partition(cursor, next_month(month))
+        return month
+
+    def offer_values(self, offer, now):
+        return (
+            offer.price,
+            offer.country,
+            offer.name,
+            offer.airports,
+            offer.brand,
+            offer.dates,
+            now,
+            offer.provider,
+            offer.key,
+        )
+
+    def _batches(self, offers, now):
+        batch = []
+        for offer in offers:
+            batch.append(self.offer_values(offer, now))
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def add_to_db(self, offers, mode=None, observed_at=None):
+        # Zwraca (wstawione, pominiete); observed_at np. przy odtwarzaniu nagranych odpowiedzi
+        mode = mode or self.bulk_mode
+        observed_at = observed_at or datetime.now()
+        now = observed_at.strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                Logger.info("Adding data to Database (%s)", mode)
+                month = self.ensure_partitions(cursor, observed_at)
+                if mode == "copy":
+                    total, inserted = self._copy_upsert(cursor, self._batches(offers, now))
+                else:
+                    total, inserted = self._values_upsert(cursor, self._batches(offers, now))
+            if month is not None:
+                self._partition_months.add(month)
+            Logger.info(
+                "Inserted %s rows, skipped %s", inserted, total - inserted, inserted=inserted
+            )
+            DB_ROWS_WRITTEN.inc(inserted, operation="insert")
+            return inserted, total - inserted
+        except Exception as e:
+            Logger.error(f"{e}")
+            return 0, 0
+
+    def _values_upsert(self, cursor, batches):
+        total = inserted = 0
+        for batch in batches:
+            result = psycopg2.extras.execute_values(
+                cursor,
                 """
-                CREATE TABLE IF NOT EXISTS destination_changes (
-                    id SERIAL PRIMARY KEY,
-                    price FLOAT,
-                    country VARCHAR(255),
-                    name VARCHAR(255),
-                    airports VARCHAR(255),
-                    dates VARCHAR(255),
-                    brand VARCHAR(255),
-                    provider VARCHAR(255),
-                    date TIMESTAMP,
-                    UNIQUE(price, country, name, airports, brand, dates)
+                WITH inserted AS (
+                    INSERT INTO destination_changes (
+                        price, country, name, airports, brand, dates, date, provider,
+                        offer_key, active
+                    ) VALUES %s
+                    ON CONFLICT (offer_key) DO NOTHING
+                    RETURNING date, offer_key, price, airports, dates, brand, provider
                 )
-                """
+                INSERT INTO price_observations (
+                    observed_at, offer_key, price, airports, dates, brand, provider
+                )
+                SELECT * FROM inserted
+                RETURNING 1
+                """,
+                batch,
+                template="(%s, %s, %s, %s, %s, %s, %s, %s, %s, True)",
+                page_size=len(batch),
+                fetch=True,
+            )
+            total += len(batch)
+            inserted += len(result)
+        return total, inserted
+
+    def _copy_upsert(self, cursor, batches):
+        cursor.execute(
+            """
+            CREATE TEMPORARY TABLE IF NOT EXISTS staging_destination_changes (
+                price DOUBLE PRECISION,
+                country TEXT,
+                name TEXT,
+                airports TEXT,
+                brand TEXT,
+                dates TEXT,
+                date TIMESTAMP,
+                provider TEXT,
+                offer_key BIGINT
+            ) ON COMMIT DELETE ROWS
+            """
+        )
+        total = 0
+        for batch in batches:
+            buffer = io.StringIO()
+            # csv zapisuje None i "" tak samo (pusty niecytowany = NULL w COPY), a offer_key
+            # odroznia je - NULL idzie jako jawny znacznik \N, "" zostaje pustym tekstem
+            csv.writer(buffer).writerows(
+                [COPY_NULL if value is None else value for value in values] for values in batch
+            )
+            buffer.seek(0)
+            cursor.copy_expert(
+                f"""
+                COPY staging_destination_changes (
+                    price, country, name, airports, brand, dates, date, provider,
+                    offer_key
+                ) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')
+                """,
+                buffer,
+            )
+            total += len(batch)
+        cursor.execute(
+            """
+            WITH inserted AS (
+                INSERT INTO destination_changes (
+                    price, country, name, airports, brand, dates, date, provider,
+                    offer_key, active
+                )
+                SELECT price, country, name, airports, brand, dates, date, provider,
+                    offer_key, True
+                FROM staging_destination_changes
+                ON CONFLICT (offer_key) DO NOTHING
+                RETURNING date, offer_key, price, airports, dates, brand, provider
             )
-            self.connection.commit()
+            INSERT INTO price_observations (
+                observed_at, offer_key, price, airports, dates, brand, provider
+            )
+            SELECT * FROM inserted
+            """
+        )
+        return total, cursor.rowcount
+
+    def price_history(self, days):
+        # Poziomy ceny tras (airports, dates, brand, price) z ostatnich `days` dni,
+        # w kolejnosci obserwacji - to samo, co DealDetector.update dopisuje w biegu
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    """
+                    SELECT airports, dates, brand, price
+                    FROM route_price_levels
+                    WHERE observed_at >= %s
+                    ORDER BY observed_at
+                    """,
+                    (datetime.now() - timedelta(days=days),),
+                )
+                return cursor.fetchall()
         except Exception as e:
             Logger.error(f"{e}")
-        finally:
-            self.connection.close()
+            return []
 
-    def add_to_db(self, rows):
+    def add_price_levels(self, levels):
+        # levels: [(observed_at, [(airports, dates, brand, price)])]; zwraca liczbe wierszy
+        # albo None przy bledzie
+        rows = [
+            (observed_at,) + level for observed_at, route_levels in levels for level in route_levels
+        ]
+        if not rows:
+            return 0
         try:
-            self.connect()
-            cursor = self.connection.cursor()
-            Logger.info(f"Adding data to Database")
-            for _, row in rows:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                psycopg2.extras.execute_values(
+                    cursor,
+                    """
+                    INSERT INTO route_price_levels (observed_at, airports, dates, brand, price)
+                    VALUES %s
+                    """,
+                    rows,
+                    page_size=self.batch_size,
+                )
+            return len(rows)
+        except Exception as e:
+            Logger.error(f"{e}")
+            return None
+
+    def alert_rules(self):
+        # Aktywne reguly subskrybentow; None przy bledzie, zeby zachowac poprzedni indeks
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
                 cursor.execute(
                     """
-                    INSERT INTO destination_changes (
-                        price, country, name, airports, brand, dates, date, provider, active
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, True)
-                    ON CONFLICT (price, country, name, airports, brand, dates) DO NOTHING
+                    SELECT id, chat_id, max_price, countries, departure_airports,
+                           date_from, date_to, providers
+                    FROM alert_rules
+                    WHERE active
+                    ORDER BY id
+                    """
+                )
+                return [AlertRule(*row) for row in cursor.fetchall()]
+        except Exception as e:
+            Logger.error(f"{e}")
+            return None
+
+    def add_alert_rule(
+        self,
+        chat_id,
+        max_price=None,
+        countries=None,
+        departure_airports=None,
+        date_from=None,
+        date_to=None,
+        providers=None,
+    ):
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    """
+                    INSERT INTO alert_rules (
+                        chat_id, max_price, countries, departure_airports,
+                        date_from, date_to, providers
+                    )
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                    RETURNING id
                     """,
                     (
-                        row["DataLayer"]["price"],
-                        row["Panstwo"],
-                        row["Nazwa"],
-                        "".join(row["DataLayer"]["name"].split(" ")[-4:-1]),
-                        row["DataLayer"]["brand"],
-                        row["TerminWyjazdu"].split(" ")[0],
-                        datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        row["provider"],
+                        str(chat_id),
+                        max_price,
+                        list(countries) if countries else None,
+                        list(departure_airports) if departure_airports else None,
+                        date_from,
+                        date_to,
+                        list(providers) if providers else None,
                     ),
                 )
-            self.connection.commit()
+                return cursor.fetchone()[0]
         except Exception as e:
             Logger.error(f"{e}")
-        finally:
-            self.connection.close()
+            return None
 
-    def check_active(self, rows):
+    def check_active(self, offers, provider=None):
+        # Zwraca (dezaktywowane, aktywowane) albo None przy bledzie; z provider uzgadniane
+        # sa tylko jego oferty
         try:
-            self.connect()
-            cursor = self.connection.cursor()
-            Logger.info("Checking and updating active status in Database")
-
-            # Create a temporary table with consistent data types
-            cursor.execute("""
-                CREATE TEMPORARY TABLE temp_changes (
-                    price DOUBLE PRECISION, 
-                    country TEXT, 
-                    name TEXT, 
-                    airports TEXT, 
-                    brand TEXT, 
-                    dates TEXT
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                Logger.info("Checking and updating active status in Database")
+
+                # Tabela zyje razem z polaczeniem z puli, wiec przygotowane zapytania pozostaja wazne
+                cursor.execute(
+                    """
+                    CREATE TEMPORARY TABLE IF NOT EXISTS current_offers (
+                        offer_key BIGINT PRIMARY KEY
+                    ) ON COMMIT DELETE ROWS
+                    """
                 )
-            """)
-
-            # Prepare data for insertion, handle empty or invalid dates
-            def format_date(date_str):
-                try:
-                    # Try parsing the date string
-                    return datetime.strptime(date_str, '%Y-%m-%d').date()
-                except ValueError:
-                    # Return None if the date format is invalid
-                    return None
-
-            insert_data = [
-                (
-                    row["DataLayer"]["price"],
-                    row["Panstwo"],
-                    row["Nazwa"],
-                    "".join(row["DataLayer"]["name"].split(" ")[-4:-1]),
-                    row["DataLayer"]["brand"],
-                    format_date(row["TerminWyjazdu"].split(" ")[0])  # Handle date formatting
+                self.prepare(
+                    conn,
+                    cursor,
+                    "deactivate_missing_offers",
+                    """
+                    UPDATE destination_changes AS d
+                    SET active = False
+                    WHERE d.active
+                    AND NOT EXISTS (
+                        SELECT 1 FROM current_offers AS c WHERE c.offer_key = d.offer_key
+                    )
+                    """,
+                )
+                self.prepare(
+                    conn,
+                    cursor,
+                    "deactivate_missing_provider_offers",
+                    """
+                    UPDATE destination_changes AS d
+                    SET active = False
+                    WHERE d.active
+                    AND d.provider = $1
+                    AND NOT EXISTS (
+                        SELECT 1 FROM current_offers AS c WHERE c.offer_key = d.offer_key
+                    )
+                    """,
+                )
+                self.prepare(
+                    conn,
+                    cursor,
+                    "activate_current_offers",
+                    """
+                    UPDATE destination_changes AS d
+                    SET active = True
+                    FROM current_offers AS c
+                    WHERE d.offer_key = c.offer_key
+                    AND d.active IS DISTINCT FROM True
+                    """,
                 )
-                for _, row in rows
-            ]
-
-            # Insert data into the temporary table
-            cursor.executemany(
-                """
-                INSERT INTO temp_changes (price, country, name, airports, brand, dates)
-                VALUES (%s, %s, %s, %s, %s, %s)
-                """,
-                insert_data
-            )
 
-            # Update all records to inactive that are not in the temporary table
-            cursor.execute(
-                """
-                UPDATE destination_changes
-                SET active = False
-                WHERE (price, country, name, airports, brand, dates) NOT IN (
-                    SELECT price, country, name, airports, brand, dates FROM temp_changes
+                keys = {offer.key for offer in offers}
+                if not keys:
+                    # Pusty snapshot to najpewniej awaria providerow, a nie brak ofert
+                    Logger.warn("Empty snapshot, skipping active status reconciliation")
+                    return 0, 0
+                psycopg2.extras.execute_values(
+                    cursor,
+                    "INSERT INTO current_offers (offer_key) VALUES %s",
+                    [(key,) for key in keys],
+                    page_size=self.batch_size,
                 )
-                """
+                cursor.execute("ANALYZE current_offers")
+
+                # Aktualizowane sa tylko wiersze, ktorych flaga faktycznie sie zmienia
+                if provider is None:
+                    cursor.execute("EXECUTE deactivate_missing_offers")
+                else:
+                    cursor.execute("EXECUTE deactivate_missing_provider_offers (%s)", (provider,))
+                deactivated = cursor.rowcount
+                cursor.execute("EXECUTE activate_current_offers")
+                activated = cursor.rowcount
+            Logger.info(
+                "Deactivated %s offers, reactivated %s",
+                deactivated,
+                activated,
+                deactivated=deactivated,
+                activated=activated,
             )
+            DB_ROWS_WRITTEN.inc(deactivated, operation="deactivate")
+            DB_ROWS_WRITTEN.inc(activated, operation="activate")
+            return deactivated, activated
+        except Exception as e:
+            Logger.error(f"{e}")
+            return None
 
-            # Update records in destination_changes to active
-            cursor.execute(
-                """
-                UPDATE destination_changes
-                SET active = True
-                WHERE (price, country, name, airports, brand, dates) IN (
-                    SELECT price, country, name, airports, brand, dates FROM temp_changes
+    def update_active(self, activate_keys, deactivate_keys):
+        # Uzgadnianie przyrostowe z SnapshotDelta - tylko klucze, ktore pojawily sie lub zniknely;
+        # zwraca (dezaktywowane, aktywowane) albo None przy bledzie
+        try:
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                self.prepare(
+                    conn,
+                    cursor,
+                    "set_offers_active",
+                    """
+                    UPDATE destination_changes
+                    SET active = $2
+                    WHERE offer_key = ANY($1)
+                    AND active IS DISTINCT FROM $2
+                    """,
                 )
-                """
+                deactivated = activated = 0
+                if deactivate_keys:
+                    cursor.execute(
+                        "EXECUTE set_offers_active (%s, False)", (list(deactivate_keys),)
+                    )
+                    deactivated = cursor.rowcount
+                if activate_keys:
+                    cursor.execute(
+                        "EXECUTE set_offers_active (%s, True)", (list(activate_keys),)
+                    )
+                    activated = cursor.rowcount
+            Logger.info(
+                "Deactivated %s offers, reactivated %s",
+                deactivated,
+                activated,
+                deactivated=deactivated,
+                activated=activated,
             )
-
-            # Commit changes
-            self.connection.commit()
-
+            DB_ROWS_WRITTEN.inc(deactivated, operation="deactivate")
+            DB_ROWS_WRITTEN.inc(activated, operation="activate")
+            return deactivated, activated
         except Exception as e:
             Logger.error(f"{e}")
-        finally:
-            self.connection.close()
+            return None
 
 
 class DataFetcher:
-    def __init__(self):
+    def __init__(self, provider_timeout=None, http_client=None):
         Logger.info("Data Fetcher Initialisation")
-        self.used = []
-
-    def check_data_lengths(self, data):
-        lengths = {key: len(value) for key, value in data.items()}
-        Logger.debug(f"Lengths of each list in data dictionary:{lengths}")
-        if len(set(lengths.values())) != 1:
-            raise ValueError(
-                "All lists in the data dictionary must be of the same length."
-            )
+        self.http = http_client or HttpClient.from_env(archive_prefix="flight")
+        self.used = SeenOfferIndex.from_env("flight_seen.idx")
+        self.provider_timeout = provider_timeout or float(
+            os.getenv("PROVIDER_TIMEOUT", 60)
+        )
+        # Oferty z ostatniej zmienionej odpowiedzi kazdego providera/strony
+        self.payload_offers = {}
+        self.short_circuits = 0
+        self.providers = {}
+        self.register_provider("Rainbow", self.fetch_rainbow_data)
+        self.register_provider("TUI", self.fetch_tui_data)
+        self.register_provider("ITAKA", self.fetch_itaka_data)
 
-    async def fetch_data(self):
-        Logger.info("Fetching Data")
-        data = {
-            "Panstwo": [],
-            "Nazwa": [],
-            "Klucz": [],
-            "TerminWyjazdu": [],
-            "Cena": [],
-            "DataLayer": [],
-            "provider": [],
-        }
+    def register_provider(self, name, fetch, timeout=None):
+        self.providers[name] = (fetch, timeout)
 
-        dataAll = {
-            "Panstwo": [],
-            "Nazwa": [],
-            "Klucz": [],
-            "TerminWyjazdu": [],
-            "Cena": [],
-            "DataLayer": [],
-            "provider": [],
-        }
+    async def run_provider(self, name, fetch, timeout):
+        # Kazdy provider ma wlasne listy, wiec blad jednego nie psuje wynikow pozostalych.
+        # Zwraca (nowe oferty, wszystkie oferty, changed, complete); niepelny wynik nie moze
+        # posluzyc do uzgadniania aktywnych ofert
+        offers = []
+        all_offers = []
+        changed = True
+        complete = False
+        started = time.monotonic()
+        try:
+            changed = await asyncio.wait_for(
+                fetch(offers, all_offers), timeout or self.provider_timeout
+            ) is not False
+            complete = True
+        except asyncio.TimeoutError:
+            Logger.warn(
+                "Provider %s timed out after %.1fs, keeping partial results",
+                name,
+                time.monotonic() - started,
+                provider=name,
+            )
+        except Exception as e:
+            Logger.error("Provider %s failed: %s", name, e, provider=name)
+        if not complete:
+            # Przerwany strumien nie zdazyl wyczyscic cache - nastepny cykl pobiera wszystko
+            self.http.forget_prefix(name)
+        elapsed = time.monotonic() - started
+        Logger.info(
+            "Provider %s finished in %.2fs (%s rows%s)",
+            name,
+            elapsed,
+            len(all_offers),
+            "" if changed else ", unchanged",
+            provider=name,
+            rows=len(all_offers),
+            seconds=elapsed,
+            changed=changed,
+        )
+        STAGE_DURATION.observe(elapsed, stage="fetch", provider=name)
+        ROWS_FETCHED.inc(len(all_offers), provider=name)
+        NEW_OFFERS.inc(len(offers), provider=name)
+        if not changed:
+            UNCHANGED_PAYLOADS.inc(provider=name)
+        return offers, all_offers, changed, complete
 
-        await self.fetch_rainbow_data(data, dataAll)
-        await self.fetch_tui_data(data, dataAll)
-        # await self.fetch_itaka_data(data)
+    async def fetch_provider(self, name):
+        # Zwraca (nowe oferty, wszystkie oferty, changed, complete) jednego providera
+        fetch, timeout = self.providers[name]
+        offers, all_offers, changed, complete = await self.run_provider(name, fetch, timeout)
+        if not changed:
+            self.short_circuits += 1
+        await self.used.save_async()
+        return offers, all_offers, changed, complete
 
-        self.check_data_lengths(data)
-        self.check_data_lengths(dataAll)
+    def forget_provider(self, name):
+        # Nastepne pobranie providera nie moze skonczyc sie skrotem "bez zmian" - bot
+        # dostaje pelny snapshot i uzgadnia go z baza
+        self.http.forget_prefix(name)
+        for cache_key in list(self.payload_offers):
+            if cache_key == name or cache_key.startswith(f"{name}:"):
+                del self.payload_offers[cache_key]
 
-        Logger.info("Fetching Data Completed")
-        return pd.DataFrame(data), pd.DataFrame(dataAll)
+    async def fetch_payload(self, cache_key, method, url, **kwargs):
+        # None oznacza, ze odpowiedz sie nie zmienila i mozna uzyc ofert z poprzedniego cyklu
+        payload, changed = await self.http.fetch_json(
+            method, url, cache_key=cache_key, **kwargs
+        )
+        if changed:
+            return payload
+        if cache_key in self.payload_offers:
+            return None
+        self.http.forget(cache_key)
+        payload, _ = await self.http.fetch_json(method, url, cache_key=cache_key, **kwargs)
+        return payload
 
-    async def fetch_rainbow_data(self, data, dataAll):
+    async def fetch_rainbow_data(self, offers, all_offers):
         try:
             Logger.info("Fetching Rainbow Data")
             url = "https://biletyczarterowe.r.pl/api/wyszukiwanie/wyszukaj?oneWay=false&dataUrodzenia%5B%5D=1989-10-30&dataUrodzenia%5B%5D=1989-10-30&sortowanie=cena"
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
-                    response.raise_for_status()
-                    json_data_rainbow = await response.json()
-
-            for destynacja in json_data_rainbow["Destynacje"]:
-                usedstring = json.dumps(destynacja, separators=(",", ":"))
-                if (
-                    usedstring not in self.used
-                    and destynacja["DataLayer"]["name"].split(" ")[-4] == "WAW"
-                ):
-                    data["Panstwo"].append(destynacja["Panstwo"])
-                    data["Nazwa"].append(destynacja["Nazwa"])
-                    data["Klucz"].append(destynacja["Klucz"])
-                    data["TerminWyjazdu"].append(
-                        str(
-                            datetime.strptime(
-                                destynacja["TerminWyjazdu"], "%Y-%m-%dT%H:%M:%SZ"
-                            )
-                        )
-                    )
-                    data["Cena"].append(int(str(destynacja["Cena"]).replace(" ", "")))
-                    data["DataLayer"].append(destynacja["DataLayer"])
-                    data["provider"].append("Rainbow")
-                    self.used.append(usedstring)
-
-                dataAll["Panstwo"].append(destynacja["Panstwo"])
-                dataAll["Nazwa"].append(destynacja["Nazwa"])
-                dataAll["Klucz"].append(destynacja["Klucz"])
-                dataAll["TerminWyjazdu"].append(
-                    str(
+            # Oferty sa parsowane w miare naplywania odpowiedzi
+            stream = self.http.stream_json(
+                "GET", url, path=("Destynacje",), cache_key="Rainbow"
+            )
+            async for destynacja in stream:
+                data_layer = destynacja["DataLayer"]
+                offer = Offer(
+                    provider="Rainbow",
+                    country=destynacja["Panstwo"],
+                    name=destynacja["Nazwa"],
+                    code=destynacja["Klucz"],
+                    departure=str(
                         datetime.strptime(
                             destynacja["TerminWyjazdu"], "%Y-%m-%dT%H:%M:%SZ"
                         )
-                    )
+                    ),
+                    list_price=int(str(destynacja["Cena"]).replace(" ", "")),
+                    price=data_layer["price"],
+                    brand=data_layer["brand"],
+                    route_name=data_layer["name"],
                 )
-                dataAll["Cena"].append(int(str(destynacja["Cena"]).replace(" ", "")))
-                dataAll["DataLayer"].append(destynacja["DataLayer"])
-                dataAll["provider"].append("Rainbow")
-        except Exception as e:
-            Logger.error(f"[Error][fetch_rainbow_data]: {e}")
+                if offer.departure_airport == "WAW" and self.used.check_and_add(
+                    destynacja
+                ):
+                    offers.append(offer)
+                all_offers.append(offer)
+            if stream.not_modified:
+                all_offers.extend(self.payload_offers.get("Rainbow", []))
+            else:
+                self.payload_offers["Rainbow"] = list(all_offers)
+            return stream.changed
+        except Exception:
+            self.http.forget("Rainbow")
+            raise
 
-    async def fetch_tui_data(self, data, dataAll):
+    async def fetch_tui_data(self, offers, all_offers):
         try:
             Logger.info("Fetching TUI Data")
             url = "https://www.tui.pl/api/www/multiCharters"
@@ -312,156 +732,126 @@ class DataFetcher:
                 "Content-Type": "application/json;charset=UTF-8",
             }
             payload = '{"adultsCt":2,"arrivalAirportCodes":[],"childrenBirthDates":[],"departureAirportCodes":["WAW"],"duration":"3-14"}'
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, headers=headers, data=payload) as response:
-                    response.raise_for_status()
-                    json_data_tui = await response.json()
-
-            for destynacja in json_data_tui:
-                usedstring = json.dumps(destynacja, separators=(",", ":"))
-                if usedstring not in self.used:
-                    data["Panstwo"].append(destynacja["countryName"])
-                    data["Nazwa"].append(destynacja["destinationName"])
-                    data["Klucz"].append(destynacja["airportCode"])
-                    data["TerminWyjazdu"].append("")
-                    data["Cena"].append(
-                        int(str(destynacja["perPersonPrice"]).replace(" ", ""))
-                    )
-                    data["DataLayer"].append(
-                        {
-                            "brand": "TUI",
-                            "price": int(
-                                str(destynacja["perPersonPrice"]).replace(" ", "")
-                            ),
-                            "name": destynacja["destinationName"]
-                            + f" WAW - {destynacja['airportCode']} NA/NA/NA",
-                        }
-                    )
-                    data["provider"].append("TUI")
-                    self.used.append(usedstring)
-                dataAll["Panstwo"].append(destynacja["countryName"])
-                dataAll["Nazwa"].append(destynacja["destinationName"])
-                dataAll["Klucz"].append(destynacja["airportCode"])
-                dataAll["TerminWyjazdu"].append("")
-                dataAll["Cena"].append(
-                    int(str(destynacja["perPersonPrice"]).replace(" ", ""))
+            stream = self.http.stream_json(
+                "POST", url, cache_key="TUI", headers=headers, data=payload
+            )
+            async for destynacja in stream:
+                price = int(str(destynacja["perPersonPrice"]).replace(" ", ""))
+                offer = Offer(
+                    provider="TUI",
+                    country=destynacja["countryName"],
+                    name=destynacja["destinationName"],
+                    code=destynacja["airportCode"],
+                    departure="",
+                    list_price=price,
+                    price=price,
+                    brand="TUI",
+                    route_name=destynacja["destinationName"]
+                    + f" WAW - {destynacja['airportCode']} NA/NA/NA",
                 )
-                dataAll["DataLayer"].append(
-                    {
-                        "brand": "TUI",
-                        "price": int(
-                            str(destynacja["perPersonPrice"]).replace(" ", "")
-                        ),
-                        "name": destynacja["destinationName"]
-                        + f" WAW - {destynacja['airportCode']} NA/NA/NA",
-                    }
+                if self.used.check_and_add(destynacja):
+                    offers.append(offer)
+                all_offers.append(offer)
+            if stream.not_modified:
+                all_offers.extend(self.payload_offers.get("TUI", []))
+            else:
+                self.payload_offers["TUI"] = list(all_offers)
+            return stream.changed
+        except Exception:
+            self.http.forget("TUI")
+            raise
+
+    def parse_itaka_item(self, el):
+        airport = el["departureRoute"]["airport"]
+        price = int(str(el["pricePerPerson"]["amount"]).replace(" ", ""))
+        return Offer(
+            provider="ITAKA",
+            country="Nieznane",
+            name=airport["city"],
+            code=airport["iata"],
+            departure=str(
+                datetime.strptime(
+                    el["departureRoute"]["date"],
+                    "%Y-%m-%dT%H:%M:%S",
                 )
-                dataAll["provider"].append("TUI")
-        except Exception as e:
-            Logger.error(f"{e}")
+            ),
+            list_price=price,
+            price=price,
+            brand="ITAKA",
+            route_name=f"{airport['city']} WAW - {airport['iata']} NA/NA/NA",
+        )
+
+    async def fetch_itaka_page(self, page, page_size):
+        # Zwraca ([(oferta, surowy element lub None dla strony z cache)], totalCount)
+        cache_key = f"ITAKA:{page}"
+        payload = {
+            "operationName": "charterFlights",
+            "variables": {
+                "adultsCount": 1,
+                "childrenCount": 0,
+                "departureRegions": "warszawa",
+                "infantsCount": 0,
+                "oneWay": False,
+                "page": page,
+                "limit": page_size,
+                "sort": "PRICE_ASC",
+            },
+            "query": ITAKA_QUERY,
+        }
+
+        json_data = await self.fetch_payload(
+            cache_key, "POST", "https://biletylotnicze.itaka.pl/api/graphql", json=payload
+        )
+        if json_data is None:
+            page_offers, total_count = self.payload_offers[cache_key]
+            return [(offer, None) for offer in page_offers], total_count
 
-    async def fetch_itaka_data(self, data, dataAll):
+        if (
+            "data" not in json_data
+            or "charterFlights" not in json_data["data"]
+            or "items" not in json_data["data"]["charterFlights"]
+        ):
+            self.http.forget(cache_key)
+            return [], 0
+
+        charter_flights = json_data["data"]["charterFlights"]
+        entries = []
         try:
-            Logger.info("Fetching ITAKA Data")
-            i = 1
-            while i > 0:
-                payload = {
-                    "operationName": "charterFlights",
-                    "variables": {
-                        "adultsCount": 1,
-                        "childrenCount": 0,
-                        "departureRegions": "warszawa",
-                        "infantsCount": 0,
-                        "oneWay": False,
-                        "page": i,
-                        "sort": "PRICE_ASC",
-                    },
-                    "query": "query charterFlights($adultsCount: Int!, $childrenCount: Int, $dateFrom: String, $dateTo: String, $departureRegions: [String!], $destinationRegions: [String!], $infantsCount: Int, $oneWay: Boolean, $page: Int, $limit: Int, $sort: CharterFlightSortDirection) {\n  charterFlights(\n    adultsCount: $adultsCount\n    childrenCount: $childrenCount\n    dateFrom: $dateFrom\n    dateTo: $dateTo\n    departureRegions: $departureRegions\n    destinationRegions: $destinationRegions\n    infantsCount: $infantsCount\n    oneWay: $oneWay\n    page: $page\n    limit: $limit\n    sort: $sort\n  ) {\n    items {\n      supplierObjectId\n      departureRoute {\n        airport {\n          city\n          iata\n          name\n          __typename\n        }\n        date\n        __typename\n      }\n      departureRouteId\n      returnRoute {\n        airport {\n          city\n          iata\n          name\n          __typename\n        }\n        date\n        __typename\n      }\n      returnRouteId\n      pricePerPerson {\n        amount\n        currency\n        __typename\n      }\n      pricePerGroup {\n        amount\n        currency\n        __typename\n      }\n      priceListCode\n      oneWay\n      url\n      offerId\n      participants {\n        adultsNumber\n        childrenAge\n        __typename\n      }\n      __typename\n    }\n    totalCount\n    __typename\n  }\n}\n",
-                }
-
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(
-                        "https://biletylotnicze.itaka.pl/api/graphql", json=payload
-                    ) as response:
-                        response.raise_for_status()
-                        json_data = await response.json()
-
-                if (
-                    "data" not in json_data
-                    or "charterFlights" not in json_data["data"]
-                    or "items" not in json_data["data"]["charterFlights"]
-                ):
+            for el in charter_flights["items"]:
+                if el is None:
                     break
+                entries.append((self.parse_itaka_item(el), el))
+        except Exception:
+            self.http.forget(cache_key)
+            raise
+        total_count = charter_flights.get("totalCount") or 0
+        self.payload_offers[cache_key] = ([offer for offer, _ in entries], total_count)
+        return entries, total_count
 
-                for el in json_data["data"]["charterFlights"]["items"]:
-                    if el is None:
-                        break
-                    else:
-                        usedstring = json.dumps(el, separators=(",", ":"))
-                        if usedstring not in self.used:
-                            data["Panstwo"].append("Nieznane")
-                            data["Nazwa"].append(
-                                el["departureRoute"]["airport"]["city"]
-                            )
-                            data["Klucz"].append(
-                                el["departureRoute"]["airport"]["iata"]
-                            )
-                            data["TerminWyjazdu"].append(
-                                str(
-                                    datetime.strptime(
-                                        el["departureRoute"]["date"],
-                                        "%Y-%m-%dT%H:%M:%S",
-                                    )
-                                )
-                            )
-                            data["Cena"].append(
-                                int(
-                                    str(el["pricePerPerson"]["amount"]).replace(" ", "")
-                                )
-                            )
-                            data["DataLayer"].append(
-                                {
-                                    "brand": "ITAKA",
-                                    "price": int(
-                                        str(el["pricePerPerson"]["amount"]).replace(
-                                            " ", ""
-                                        )
-                                    ),
-                                    "name": f"{el['departureRoute']['airport']['iata']} WAW",
-                                }
-                            )
-                            data["provider"].append("ITAKA")
-                            self.used.append(usedstring)
-                        dataAll["Panstwo"].append("Nieznane")
-                        dataAll["Nazwa"].append(el["departureRoute"]["airport"]["city"])
-                        dataAll["Klucz"].append(el["departureRoute"]["airport"]["iata"])
-                        dataAll["TerminWyjazdu"].append(
-                            str(
-                                datetime.strptime(
-                                    el["departureRoute"]["date"],
-                                    "%Y-%m-%dT%H:%M:%S",
-                                )
-                            )
-                        )
-                        dataAll["Cena"].append(
-                            int(str(el["pricePerPerson"]["amount"]).replace(" ", ""))
-                        )
-                        dataAll["DataLayer"].append(
-                            {
-                                "brand": "ITAKA",
-                                "price": int(
-                                    str(el["pricePerPerson"]["amount"]).replace(" ", "")
-                                ),
-                                "name": f"{el['departureRoute']['airport']['iata']} WAW",
-                            }
-                        )
-                        dataAll["provider"].append("ITAKA")
-                if i > 0:
-                    i += 1
-                else:
-                    break
-        except Exception as e:
-            Logger.error(f"{e}")
+    async def fetch_itaka_data(self, offers, all_offers):
+        changed = False
+        failed_pages = []
+        Logger.info("Fetching ITAKA Data")
+        page_size = int(os.getenv("ITAKA_PAGE_SIZE", 50))
+
+        async def fetch_page(page):
+            nonlocal changed
+            entries, total_count = await self.fetch_itaka_page(page, page_size)
+            # Pusta strona lub strona spoza cache oznacza zmiane
+            if not entries or entries[0][1] is not None:
+                changed = True
+            return entries, total_count
+
+        # Strony sa przetwarzane w kolejnosci w jakiej przychodza
+        async for entries in paginate(fetch_page, page_size, on_error=failed_pages.append):
+            for offer, el in entries:
+                if el is not None and self.used.check_and_add(el):
+                    offers.append(offer)
+                all_offers.append(offer)
+        if failed_pages:
+            # Bez tych stron snapshot jest niepelny
+            raise IncompleteFetch(f"ITAKA pages {sorted(failed_pages)} failed")
+        return changed
 
 
 class TravelDealsBot:
@@ -469,54 +859,170 @@ class TravelDealsBot:
         Logger.info("Travel Deals Bot Initialisation")
         self.bot = Bot(token=bot_token)
         self.chat_id = chat_id
+        # Wysylka w tle - pobieranie i zapis do bazy nie czekaja na Telegram
+        self.outbox = TelegramOutbox(
+            self.bot,
+            journal_path=worker_path(
+                os.getenv("FLIGHT_OUTBOX_JOURNAL", "flight_outbox.journal")
+            ),
+        )
         self.db_manager = db_manager
         self.data_fetcher = data_fetcher
+        # Ogloszenia tylko dla ofert tanszych od historii trasy (DEAL_DETECTION=0 - kazda nowa oferta)
+        self.deals = (
+            DealDetector() if os.getenv("DEAL_DETECTION", "1") != "0" else None
+        )
+        # Poprzednie snapshoty - zapis do bazy i ogloszenia tylko dla zmian
+        self.delta = DeltaEngine()
+        # Zapis do bazy w tle (write-behind) - petla nie czeka na psycopg2
+        self.writer = WriteBehindWriter(db_manager, on_failure=self.resync)
+        # Reguly subskrybentow z alert_rules, odswiezane co ALERT_RULES_REFRESH sekund
+        self.rules = RuleIndex()
+        self.rules_refresh = float(os.getenv("ALERT_RULES_REFRESH", 60))
+        self.rules_loaded_at = None
+        # Providerzy przejeci od innego procesu - pierwszy cykl tylko buduje stan, bez ogloszen
+        self.quiet = set()
+
+    def resync(self, scope):
+        # Po nieudanym zapisie baza nie odpowiada snapshotowi zakresu. Sam reset delty nie
+        # wystarczy - niezmieniona odpowiedz providera pomija uzgadnianie, wiec zapominamy tez
+        # walidatory HTTP i oferty z cache, a nastepny cykl zapisuje pelny snapshot.
+        self.delta.reset(scope)
+        self.data_fetcher.forget_provider(scope)
+
+    async def poll_provider(self, name):
+        # Jeden cykl jednego providera; wynik steruje czestotliwoscia jego odpytywania
+        with STAGE_DURATION.time(stage="cycle", provider=name):
+            offers, all_offers, changed, complete = await self.data_fetcher.fetch_provider(name)
+            if not changed:
+                Logger.info("%s payload unchanged, skipping DB update", name, provider=name)
+                return UNCHANGED
+            delta = self.reconcile(all_offers, name, complete)
+            deals, levels = self.filter_deals(delta.alerts(offers), all_offers, name)
+            await self.store(delta, name, complete, levels)
+            await self.refresh_rules()
+            if name in self.quiet:
+                # Cisza trwa do pierwszego pelnego snapshotu po przejeciu
+                if complete:
+                    self.quiet.discard(name)
+                Logger.info("Skipping %s alerts after taking over %s", len(deals), name)
+            else:
+                self.queue_offers(deals, name)
+        # Nowe ceny albo nowe trasy (zapis konczy sie w tle, wiec decyduje delta)
+        counts = delta.counts()
+        if complete and not delta.baseline and (counts[ADDED] or counts[REPRICED]):
+            return PRICES_MOVED
+        return CHANGED
+
+    def reconcile(self, all_offers, provider, complete):
+        # Niepelny snapshot (blad albo timeout czesci zapytan) sluzy tylko do ogloszen - brakujace
+        # oferty nie sa dezaktywowane, a poprzedni snapshot zostaje podstawa nastepnej delty
+        if not complete:
+            Logger.warn(
+                "%s fetch incomplete, skipping DB reconciliation", provider, provider=provider
+            )
+            return self.delta.diff(all_offers, provider, commit=False)
+        return self.delta.diff(all_offers, provider)
 
-    async def send_messages(self):
-        df, dfAll = await self.data_fetcher.fetch_data()
-        Logger.info("Updating DB Data!")
-        self.db_manager.add_to_db(dfAll.iterrows())
-        self.db_manager.check_active(dfAll.iterrows())
-
-        if not df.empty:
-            Logger.info("Sending message to Telegram!")
-            separator = "- - - - - - - - - - - - -"
-            df = df.reset_index()
-            df = df.sort_values(by="Cena")
-
-            await self.bot.send_message(
-                self.chat_id,
-                f"\n{separator}\n{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n{separator}\n",
+    async def store(self, delta, provider, complete=True, levels=()):
+        # Poza pierwszym snapshotem providera do bazy trafiaja tylko zmiany z delty; levels -
+        # nowe poziomy cen tras z DealDetector. Czeka tylko, gdy kolejka zapisu jest pelna.
+        if not complete:
+            if levels:
+                await self.writer.submit(
+                    WriteBatch(provider, levels=[(datetime.now(), levels)])
+                )
+            return
+        for kind, count in delta.counts().items():
+            OFFER_EVENTS.inc(count, kind=kind, provider=provider)
+        if delta.baseline or delta or levels:
+            Logger.info(
+                "%s changes, %s offers unchanged", len(delta), delta.unchanged, provider=provider
             )
+            await self.writer.submit(WriteBatch.from_delta(delta, provider, levels=levels))
+
+    def filter_deals(self, offers, all_offers, provider):
+        # Zwraca (okazje, nowe poziomy cen tras do zapisu)
+        if self.deals is None:
+            return offers, []
+        with STAGE_DURATION.time(stage="deal_scoring", provider=provider):
+            # Ocena wzgledem historii sprzed tego cyklu, potem dopisanie biezacych cen
+            deals = self.deals.deals(offers)
+            levels = self.deals.update(all_offers)
+        Logger.info(
+            "%s of %s new offers beat their route baseline", len(deals), len(offers)
+        )
+        return deals, levels
 
-            message_string = ""
-            message_len = 0
-            for index, row in df.iterrows():
-                message_string_temp = f'🤑 {row["DataLayer"]["price"]}zł 📅 {str(row["TerminWyjazdu"]).split(" ")[0].split("T")[0]}[{row["provider"][0]}]\
-                    \n🗺️{row["Panstwo"]}\n🌴{row["Nazwa"]}\n🛬({row["DataLayer"]["name"].split(" ")[-4]} - {row["Klucz"]}) ✈️ {row["DataLayer"]["brand"]}\n{separator}\n'
+    async def refresh_rules(self):
+        now = time.monotonic()
+        if self.rules_loaded_at is not None and now - self.rules_loaded_at < self.rules_refresh:
+            return
+        self.rules_loaded_at = now
+        rules = await asyncio.to_thread(self.db_manager.alert_rules)
+        if rules is not None:
+            self.rules = RuleIndex(rules)
+            Logger.info("Loaded %s alert rules", len(rules), rules=len(rules))
 
-                if message_len + len(message_string_temp) > 4096:
-                    if message_string != "":
-                        await self.bot.send_message(self.chat_id, message_string)
-                    else:
-                        Logger.warn("Aborted string!")
-                    message_len = 0
-                    message_string = ""
+    def deliveries(self, offers, provider):
+        # chat_id -> oferty: glowny czat dostaje wszystko, subskrybenci - oferty z ich regul
+        with STAGE_DURATION.time(stage="rule_matching", provider=provider):
+            chats = self.rules.deliveries(offers)
+        if self.chat_id:
+            chats[self.chat_id] = offers
+        return chats
+
+    def queue_offers(self, offers, provider):
+        if not offers:
+            return
+        header = (
+            f"\n{SEPARATOR}\n{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n{SEPARATOR}\n"
+        )
+        for chat_id, chat_offers in self.deliveries(offers, provider).items():
+            Logger.info("Sending %s offers to chat %s", len(chat_offers), chat_id)
+            chat_offers = sorted(chat_offers, key=lambda offer: offer.list_price)
 
-                message_len += len(message_string_temp)
-                message_string += message_string_temp
+            self.outbox.enqueue(chat_id, header)
+            with STAGE_DURATION.time(stage="render", provider=provider):
+                messages = render_offer_messages(chat_offers)
+            for message in messages:
+                self.outbox.enqueue(chat_id, message)
 
-            if message_string != "":
-                await self.bot.send_message(self.chat_id, message_string)
+    def lease_acquired(self, name, takeover):
+        # Stan tego procesu moze byc nieaktualny (walidatory HTTP z wczesniejszej dzierzawy
+        # daja "bez zmian") - pierwszy cykl pobiera i uzgadnia pelny snapshot, a po przejeciu
+        # nie ogloszamy ofert, ktore poprzedni wlasciciel juz wyslal
+        self.resync(name)
+        if takeover:
+            self.quiet.add(name)
 
-    async def run(self, interval=5 * 60):
+    async def run(self, interval=None, coordinator=None):
         Logger.info("Application started!")
-        while True:
-            await self.send_messages()
-            await asyncio.sleep(interval)
+        self.outbox.start()
+        if self.deals is not None:
+            self.deals.seed(
+                await asyncio.to_thread(
+                    self.db_manager.price_history, int(os.getenv("DEAL_HISTORY_DAYS", 60))
+                )
+            )
+        scheduler = AdaptiveScheduler(coordinator=coordinator)
+        for name in self.data_fetcher.providers:
+            scheduler.add(
+                name,
+                functools.partial(self.poll_provider, name),
+                interval,
+                on_acquire=functools.partial(self.lease_acquired, name),
+            )
+        try:
+            await scheduler.run_forever()
+        finally:
+            await self.writer.close()
+            await self.outbox.close()
+            await self.data_fetcher.http.close()
+            self.db_manager.close()
 
 
-async def main_run_bot():
+async def main_run_bot(coordinator=None):
     Logger.info("Bot Initialisation")
     BOT_TOKEN = os.getenv("TELEGRAM_BOT_FLIGHT_SEARCH_TOKEN")
     CHAT_ID = os.getenv("TELEGRAM_BOT_FLIGHT_SEARCH_CHAT_ID")
@@ -533,4 +1039,4 @@ async def main_run_bot():
 
     db_manager.create_table()
 
-    await travel_bot.run()
+    await travel_bot.run(coordinator=coordinator)
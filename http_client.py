@@ -0,0 +1,323 @@
+import codecs
+import hashlib
+import json
+import os
+from collections import Counter, defaultdict, deque
+
+import aiohttp
+
+from json_stream import JsonArrayItems
+from logger import Logger
+from response_archive import ResponseArchive, read_archive
+from worker_slot import worker_prefix
+
+try:
+    import aiodns  # noqa: F401
+
+    HAS_AIODNS = True
+except ImportError:
+    HAS_AIODNS = False
+
+try:
+    import brotli  # noqa: F401
+
+    HAS_BROTLI = True
+except ImportError:
+    try:
+        import brotlicffi  # noqa: F401
+
+        HAS_BROTLI = True
+    except ImportError:
+        HAS_BROTLI = False
+
+
+class HttpClient:
+    def __init__(
+        self,
+        limit=None,
+        limit_per_host=None,
+        keepalive_timeout=None,
+        dns_cache_ttl=None,
+        timeout=None,
+        archive=None,
+    ):
+        self.limit = limit or int(os.getenv("HTTP_POOL_LIMIT", 100))
+        self.limit_per_host = limit_per_host or int(
+            os.getenv("HTTP_POOL_LIMIT_PER_HOST", 8)
+        )
+        # Dluzej niz przerwa miedzy cyklami, zeby polaczenia przetrwaly do nastepnego cyklu
+        self.keepalive_timeout = keepalive_timeout or float(
+            os.getenv("HTTP_KEEPALIVE_TIMEOUT", 6 * 60)
+        )
+        self.dns_cache_ttl = dns_cache_ttl or int(os.getenv("HTTP_DNS_CACHE_TTL", 30 * 60))
+        self.timeout = aiohttp.ClientTimeout(
+            total=timeout or float(os.getenv("HTTP_TIMEOUT", 120))
+        )
+        self.chunk_size = int(os.getenv("HTTP_STREAM_CHUNK_SIZE", 64 * 1024))
+        self._session = None
+        # cache_key -> (ETag, Last-Modified, skrot tresci) ostatniej odpowiedzi
+        self.validators = {}
+        self.short_circuits = Counter()
+        # Opcjonalny zapis surowych odpowiedzi (ResponseArchive)
+        self.archive = archive
+
+    @classmethod
+    def from_env(cls, archive_prefix="responses"):
+        # HTTP_REPLAY_DIR - odtwarzanie nagranych odpowiedzi zamiast sieci,
+        # HTTP_RECORD_DIR - normalne zapytania z zapisem kazdej odpowiedzi
+        replay_dir = os.getenv("HTTP_REPLAY_DIR")
+        if replay_dir:
+            return ReplayHttpClient(replay_dir, prefix=archive_prefix)
+        record_dir = os.getenv("HTTP_RECORD_DIR")
+        if record_dir:
+            return cls(archive=ResponseArchive(record_dir, prefix=worker_prefix(archive_prefix)))
+        return cls()
+
+    @property
+    def accept_encoding(self):
+        return "gzip, deflate, br" if HAS_BROTLI else "gzip, deflate"
+
+    def session(self):
+        # Sesja tworzona leniwie, w petli zdarzen w ktorej dziala bot
+        if self._session is None or self._session.closed:
+            Logger.info("Opening shared HTTP session")
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                use_dns_cache=True,
+                ttl_dns_cache=self.dns_cache_ttl,
+                resolver=aiohttp.AsyncResolver() if HAS_AIODNS else None,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                headers={"Accept-Encoding": self.accept_encoding},
+            )
+        return self._session
+
+    def forget(self, cache_key):
+        self.validators.pop(cache_key, None)
+
+    def forget_prefix(self, prefix):
+        # Wszystkie klucze providera: "ITAKA" i strony "ITAKA:2", "ITAKA:3"...
+        for cache_key in list(self.validators):
+            if cache_key == prefix or cache_key.startswith(f"{prefix}:"):
+                self.validators.pop(cache_key, None)
+
+    def conditional_headers(self, cache_key, headers):
+        headers = dict(headers or {})
+        validator = self.validators.get(cache_key) if cache_key else None
+        if validator:
+            etag, last_modified, _ = validator
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        return validator, headers
+
+    def stream_json(self, method, url, path=(), cache_key=None, **kwargs):
+        return JsonStream(self, method, url, path, cache_key, kwargs)
+
+    async def fetch_json(self, method, url, cache_key=None, **kwargs):
+        # Zwraca (payload, changed); payload jest None, gdy odpowiedz sie nie zmienila
+        validator, headers = self.conditional_headers(
+            cache_key, kwargs.pop("headers", None)
+        )
+
+        async with self.session().request(
+            method, url, headers=headers, **kwargs
+        ) as response:
+            if response.status == 304 and validator:
+                if self.archive:
+                    self.archive.record(cache_key, method, url, 304)
+                self.short_circuits[cache_key] += 1
+                return None, False
+            response.raise_for_status()
+            body = await response.read()
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+        if self.archive:
+            self.archive.record(cache_key, method, url, response.status, body)
+        return self._decode(cache_key, validator, body, etag, last_modified)
+
+    def _decode(self, cache_key, validator, body, etag, last_modified):
+        digest = hashlib.blake2b(body, digest_size=16).digest()
+        if cache_key:
+            self.validators[cache_key] = (etag, last_modified, digest)
+            if validator and validator[2] == digest:
+                self.short_circuits[cache_key] += 1
+                return None, False
+        return json.loads(body), True
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            Logger.info("Closing shared HTTP session")
+            await self._session.close()
+        self._session = None
+        if self.archive:
+            self.archive.close()
+
+    async def __aenter__(self):
+        self.session()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+class JsonStream:
+    # Strumieniowe pobieranie tablicy JSON: elementy sa zwracane w miare naplywania danych.
+    # Po wyczerpaniu: changed=False, gdy serwer odpowiedzial 304 (not_modified) albo tresc
+    # ma ten sam skrot co poprzednio.
+    def __init__(self, client, method, url, path, cache_key, kwargs):
+        self.client = client
+        self.method = method
+        self.url = url
+        self.path = path
+        self.cache_key = cache_key
+        self.kwargs = kwargs
+        self.changed = None
+        self.not_modified = False
+
+    async def __aiter__(self):
+        client = self.client
+        validator, headers = client.conditional_headers(
+            self.cache_key, self.kwargs.get("headers")
+        )
+        kwargs = dict(self.kwargs, headers=headers)
+
+        async with client.session().request(self.method, self.url, **kwargs) as response:
+            if response.status == 304 and validator:
+                if client.archive:
+                    client.archive.record(self.cache_key, self.method, self.url, 304)
+                client.short_circuits[self.cache_key] += 1
+                self.not_modified = True
+                self.changed = False
+                return
+            response.raise_for_status()
+
+            digest = hashlib.blake2b(digest_size=16)
+            text_decoder = codecs.getincrementaldecoder(response.charset or "utf-8")()
+            items = JsonArrayItems(self.path)
+            # Przy nagrywaniu tresc jest dodatkowo zbierana w calosci
+            chunks = [] if client.archive else None
+            async for chunk in response.content.iter_chunked(client.chunk_size):
+                digest.update(chunk)
+                if chunks is not None:
+                    chunks.append(chunk)
+                for item in items.feed(text_decoder.decode(chunk)):
+                    yield item
+            for item in items.feed(text_decoder.decode(b"", final=True)):
+                yield item
+            items.close()
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+        if chunks is not None:
+            client.archive.record(
+                self.cache_key, self.method, self.url, response.status, b"".join(chunks)
+            )
+        self._finish(validator, digest.digest(), etag, last_modified)
+
+    def _finish(self, validator, digest, etag, last_modified):
+        client = self.client
+        self.changed = not (validator and validator[2] == digest)
+        if self.cache_key:
+            client.validators[self.cache_key] = (etag, last_modified, digest)
+            if not self.changed:
+                client.short_circuits[self.cache_key] += 1
+
+
+class ReplayExhausted(Exception):
+    pass
+
+
+class ReplayHttpClient(HttpClient):
+    # Odtwarza odpowiedzi z ResponseArchive bez sieci, dla kazdego cache_key w kolejnosci nagrania.
+    # Brak kolejnego nagrania dla klucza jest traktowany jak odpowiedz "bez zmian".
+    def __init__(self, directory, prefix="responses", since=None, until=None, **kwargs):
+        super().__init__(**kwargs)
+        self.responses = defaultdict(deque)
+        for entry in read_archive(directory, prefix, since, until):
+            self.responses[entry["key"]].append(entry)
+        # Grupa kluczy (np. "ITAKA" dla "ITAKA:3") -> czas ostatnio odtworzonej odpowiedzi
+        self.clock = {}
+        self.stale_after = float(os.getenv("HTTP_REPLAY_STALE_AFTER", 60))
+        self.replayed = 0
+        Logger.info(
+            "Loaded %s recorded responses for %s keys", self.remaining, len(self.responses)
+        )
+
+    @property
+    def remaining(self):
+        return sum(len(queue) for queue in self.responses.values())
+
+    @property
+    def current_time(self):
+        # Czas nagrania ostatnio odtworzonej odpowiedzi
+        return max(self.clock.values(), default=None)
+
+    def upcoming(self):
+        # Najwczesniejsze jeszcze nieodtworzone nagranie (archiwum jest czytane w kolejnosci ts)
+        heads = [queue[0] for queue in self.responses.values() if queue]
+        return min(heads, key=lambda entry: entry["ts"], default=None)
+
+    def skip(self, entry):
+        # Nagranie, ktorego cykl nie pobral (np. strona spoza nowego totalCount)
+        queue = self.responses.get(entry["key"])
+        if queue and queue[0] is entry:
+            queue.popleft()
+
+    def session(self):
+        raise ReplayExhausted("Network access is disabled while replaying")
+
+    def next_response(self, cache_key):
+        queue = self.responses.get(cache_key)
+        group = str(cache_key).split(":")[0]
+        clock = self.clock.get(group)
+        # Nagrania stron, ktorych nie pobrano w biezacym cyklu (np. gdy zmienil sie totalCount), sa pomijane
+        while queue and clock is not None and queue[0]["ts"] < clock - self.stale_after:
+            queue.popleft()
+        if not queue:
+            return None
+        entry = queue.popleft()
+        self.clock[group] = entry["ts"]
+        self.replayed += 1
+        return entry
+
+    async def fetch_json(self, method, url, cache_key=None, **kwargs):
+        validator = self.validators.get(cache_key) if cache_key else None
+        entry = self.next_response(cache_key)
+        if entry is None or entry["status"] == 304:
+            if not validator:
+                raise ReplayExhausted(f"No recorded response for {cache_key}")
+            self.short_circuits[cache_key] += 1
+            return None, False
+        return self._decode(cache_key, validator, entry["body"].encode("utf-8"), None, None)
+
+    def stream_json(self, method, url, path=(), cache_key=None, **kwargs):
+        return ReplayJsonStream(self, method, url, path, cache_key, kwargs)
+
+
+class ReplayJsonStream(JsonStream):
+    async def __aiter__(self):
+        client = self.client
+        validator = client.validators.get(self.cache_key) if self.cache_key else None
+        entry = client.next_response(self.cache_key)
+        if entry is None or entry["status"] == 304:
+            if not validator:
+                raise ReplayExhausted(f"No recorded response for {self.cache_key}")
+            client.short_circuits[self.cache_key] += 1
+            self.not_modified = True
+            self.changed = False
+            return
+
+        text = entry["body"]
+        items = JsonArrayItems(self.path)
+        # Ten sam parser przyrostowy co przy pobieraniu z sieci
+        for start in range(0, len(text), client.chunk_size):
+            for item in items.feed(text[start : start + client.chunk_size]):
+                yield item
+        items.close()
+        digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        self._finish(validator, digest, None, None)
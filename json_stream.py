@@ -0,0 +1,116 @@
+import json
+
+SEPARATORS = " \t\r\n,]"
+
+
+class JsonArrayItems:
+    # Przyrostowy parser: zwraca elementy tablicy pod podana sciezka kluczy,
+    # gdy tylko sa kompletne, bez budowania calego drzewa odpowiedzi.
+    # path=() oznacza tablice na najwyzszym poziomie, ("data", "offers") -> {"data": {"offers": [...]}}
+    def __init__(self, path=()):
+        self.path = tuple(path)
+        self.buffer = ""
+        self.pos = 0
+        self.stack = []
+        self.expect_key = False
+        self.state = "seek"
+        self.decoder = json.JSONDecoder()
+
+    def feed(self, text):
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+        if self.state == "seek":
+            self._seek()
+        if self.state == "items":
+            return self._items()
+        if self.state == "done":
+            # Reszta dokumentu nas nie interesuje
+            self.buffer = ""
+        return []
+
+    def close(self):
+        if self.state == "seek":
+            raise ValueError(f"JSON array {list(self.path)} not found in response")
+        if self.state != "done":
+            raise ValueError(f"JSON array {list(self.path)} is truncated or malformed")
+
+    def _at_target(self):
+        keys = []
+        for container, key in self.stack:
+            if container != "o":
+                return False
+            keys.append(key)
+        return tuple(keys) == self.path
+
+    def _seek(self):
+        buffer = self.buffer
+        pos = self.pos
+        while pos < len(buffer):
+            char = buffer[pos]
+            if char == '"':
+                end = self._string_end(buffer, pos)
+                if end == -1:
+                    break
+                if self.expect_key and self.stack and self.stack[-1][0] == "o":
+                    self.stack[-1][1] = json.loads(buffer[pos:end])
+                    self.expect_key = False
+                pos = end
+                continue
+            if char == "{":
+                self.stack.append(["o", None])
+                self.expect_key = True
+            elif char == "[":
+                if self._at_target():
+                    self.state = "items"
+                    pos += 1
+                    break
+                self.stack.append(["a", None])
+            elif char in "}]":
+                self.stack.pop()
+            elif char == ",":
+                self.expect_key = bool(self.stack) and self.stack[-1][0] == "o"
+            pos += 1
+        self.pos = pos
+
+    @staticmethod
+    def _string_end(buffer, start):
+        search = start + 1
+        while True:
+            quote = buffer.find('"', search)
+            if quote == -1:
+                return -1
+            backslashes = 0
+            while buffer[quote - 1 - backslashes] == "\\":
+                backslashes += 1
+            if backslashes % 2 == 0:
+                return quote + 1
+            search = quote + 1
+
+    def _items(self):
+        items = []
+        buffer = self.buffer
+        pos = self.pos
+        length = len(buffer)
+        while True:
+            while pos < length and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= length:
+                break
+            if buffer[pos] == "]":
+                self.state = "done"
+                pos += 1
+                break
+            try:
+                item, end = self.decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break
+            # Liczba jest kompletna dopiero przed separatorem ("1" + ".5e3" to jedna liczba);
+            # element konczacy sie na koncu bufora czeka na kolejny fragment
+            if end >= length or (
+                isinstance(item, (int, float)) and buffer[end] not in SEPARATORS
+            ):
+                break
+            items.append(item)
+            pos = end
+        self.pos = pos
+        return items
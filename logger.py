@@ -0,0 +1,122 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from datetime import datetime
+
+# Logi trafiaja do kolejki, a formatowanie i zapis robi osobny watek - wywolanie
+# Logger.info w petli zdarzen to tylko sprawdzenie poziomu i wlozenie rekordu do kolejki.
+# LOG_LEVEL (domyslnie INFO), LOG_FORMAT=json|text, LOG_CALLER=0 wylacza nazwe wywolujacego.
+
+LEVELS = {"DEBUG": logging.DEBUG, "INFO": logging.INFO, "WARN": logging.WARNING, "ERROR": logging.ERROR}
+# Atrybuty LogRecord, ktore nie sa polami uzytkownika
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "caller": record.funcName,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    # Dawny format: [czas][POZIOM][Klasa][funkcja]tekst
+    def format(self, record):
+        caller = record.funcName or ""
+        owner, _, function = caller.rpartition(".")
+        level = "WARN" if record.levelno == logging.WARNING else record.levelname
+        text = f"[{datetime.fromtimestamp(record.created)}][{level}][{owner or None}][{function}]{record.getMessage()}"
+        fields = {k: v for k, v in record.__dict__.items() if k not in RECORD_ATTRIBUTES}
+        if fields:
+            text += f" {fields}"
+        if record.exc_info:
+            text += "\n" + self.formatException(record.exc_info)
+        return text
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    # Standardowy QueueHandler formatuje wiadomosc przed wlozeniem do kolejki - tu robi to watek zapisu
+    def prepare(self, record):
+        return record
+
+
+def configure():
+    level = LEVELS.get(os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO)
+    logger = logging.getLogger("flightalert")
+    logger.setLevel(level)
+    logger.propagate = False
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(
+        TextFormatter() if os.getenv("LOG_FORMAT", "json") == "text" else JsonFormatter()
+    )
+    records = queue.SimpleQueue()
+    logger.addHandler(DeferredQueueHandler(records))
+    listener = logging.handlers.QueueListener(records, output)
+    listener.start()
+    atexit.register(listener.stop)
+    return logger
+
+
+_logger = configure()
+_caller_info = os.getenv("LOG_CALLER", "1") != "0"
+
+
+def _caller(depth):
+    # co_qualname (Python 3.11+) zawiera klase i funkcje bez zagladania w f_locals
+    code = sys._getframe(depth).f_code
+    return getattr(code, "co_qualname", code.co_name)
+
+
+class Logger:
+    # Tekst moze miec argumenty w stylu %s, formatowane dopiero w watku zapisu:
+    # Logger.info("Inserted %s rows", inserted, table="destination_changes")
+    @staticmethod
+    def _log(level, text, args, fields, exc_info=False):
+        record = logging.LogRecord(
+            _logger.name,
+            level,
+            "",
+            0,
+            text,
+            args,
+            sys.exc_info() if exc_info else None,
+            func=_caller(3) if _caller_info else None,
+        )
+        for key, value in fields.items():
+            # Pola nie moga nadpisac atrybutow rekordu
+            setattr(record, f"field_{key}" if key in RECORD_ATTRIBUTES else key, value)
+        _logger.handle(record)
+
+    @staticmethod
+    def info(text, *args, **fields):
+        if _logger.isEnabledFor(logging.INFO):
+            Logger._log(logging.INFO, text, args, fields)
+
+    @staticmethod
+    def debug(text, *args, **fields):
+        if _logger.isEnabledFor(logging.DEBUG):
+            Logger._log(logging.DEBUG, text, args, fields)
+
+    @staticmethod
+    def warn(text, *args, **fields):
+        if _logger.isEnabledFor(logging.WARNING):
+            Logger._log(logging.WARNING, text, args, fields)
+
+    @staticmethod
+    def error(text, *args, exc_info=False, **fields):
+        if _logger.isEnabledFor(logging.ERROR):
+            Logger._log(logging.ERROR, text, args, fields, exc_info)
@@ -0,0 +1,95 @@
+import re
+from string import Formatter
+
+from logger import Logger
+
+# Telegram liczy limit 4096 znakow po sparsowaniu encji, w jednostkach UTF-16
+MESSAGE_LIMIT = 4096
+
+MARKDOWN_V2_SPECIAL = "\\_*[]()~`>#+-=|{}.!"
+MARKDOWN_V2_ESCAPE = str.maketrans({char: "\\" + char for char in MARKDOWN_V2_SPECIAL})
+# W adresie linku [tekst](url) trzeba escapowac tylko ")" i "\"
+MARKDOWN_V2_LINK_ESCAPE = str.maketrans({")": "\\)", "\\": "\\\\"})
+
+MARKDOWN_V2_MARKUP = re.compile(r"\\(.)|\]\((?:[^)\\]|\\.)*\)|[*_~|\[\]`]|^>", re.M)
+
+
+def escape_markdown(text):
+    return str(text).translate(MARKDOWN_V2_ESCAPE)
+
+
+def utf16_length(text):
+    return len(text.encode("utf-16-le")) // 2
+
+
+def markdown_v2_length(text):
+    # Widoczna dlugosc tekstu MarkdownV2: bez znacznikow, escape'ow i adresow linkow
+    return utf16_length(
+        MARKDOWN_V2_MARKUP.sub(lambda match: match.group(1) or "", text)
+    )
+
+
+class MessageTemplate:
+    # Szablon wiersza kompilowany raz: literaly sa gotowym tekstem (w trybie markdown -
+    # poprawnym MarkdownV2), pola {nazwa} sa escapowane przy renderowaniu. Pola z `links`
+    # trafiaja do adresu linku i nie licza sie do widocznej dlugosci.
+    def __init__(self, template, markdown=False, links=()):
+        self.template = template
+        self.markdown = markdown
+        self.links = frozenset(links)
+        # pole -> liczba wystapien w szablonie
+        self.fields = {}
+        for _, field, spec, conversion in Formatter().parse(template):
+            if field is None:
+                continue
+            if spec or conversion or not field.isidentifier():
+                raise ValueError(f"Unsupported template field: {field!r}")
+            self.fields[field] = self.fields.get(field, 0) + 1
+        self.text_fields = tuple(
+            (field, count) for field, count in self.fields.items() if field not in self.links
+        )
+        self.link_fields = tuple(field for field in self.fields if field in self.links)
+        self.format = template.format
+        # Dlugosc czesci stalej liczona raz, na szablonie z pustymi polami
+        empty = dict.fromkeys(self.fields, "")
+        empty.update(dict.fromkeys(self.link_fields, "x"))
+        static = self.format(**empty)
+        self.static_length = markdown_v2_length(static) if markdown else utf16_length(static)
+
+    def render(self, **values):
+        # Zwraca (tekst, widoczna dlugosc)
+        length = self.static_length
+        if self.markdown:
+            for field, count in self.text_fields:
+                value = str(values[field])
+                length += utf16_length(value) * count
+                values[field] = value.translate(MARKDOWN_V2_ESCAPE)
+            for field in self.link_fields:
+                values[field] = str(values[field]).translate(MARKDOWN_V2_LINK_ESCAPE)
+        else:
+            for field, count in self.text_fields:
+                value = str(values[field])
+                length += utf16_length(value) * count
+                values[field] = value
+        return self.format(**values), length
+
+
+def pack_messages(rows, limit=MESSAGE_LIMIT):
+    # rows: (tekst, widoczna dlugosc) w docelowej kolejnosci. Zachlanne wypelnianie daje
+    # najmniejsza liczbe wiadomosci przy zachowanej kolejnosci wierszy.
+    messages = []
+    parts = []
+    length = 0
+    for text, row_length in rows:
+        if row_length > limit:
+            Logger.warn(f"Skipping row longer than {limit} characters")
+            continue
+        if length + row_length > limit:
+            messages.append("".join(parts))
+            parts = []
+            length = 0
+        parts.append(text)
+        length += row_length
+    if parts:
+        messages.append("".join(parts))
+    return messages
@@ -0,0 +1,166 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Minimalny rejestr metryk w formacie tekstowym Prometheusa. Bot dziala w osobnym watku,
+# a /metrics czyta z watku Flaska, wiec zmiany ida pod blokada.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in labels) + "}"
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self.values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{format_labels(labels)} {value:g}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self.values.get(key)
+            if state is None:
+                # [liczniki kubelkow..., +Inf], suma
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][bisect_left(self.buckets, value)] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        # Dziala tez wokol await - mierzy czas zegarowy etapu
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self.values.items()]
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                samples.append((f"{self.name}_bucket", key + (("le", le),), cumulative))
+            samples.append((f"{self.name}_sum", key, total))
+            samples.append((f"{self.name}_count", key, cumulative))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_DURATION = Histogram(
+    "flightalert_stage_duration_seconds",
+    "Duration of pipeline stages",
+    ("stage", "provider"),
+)
+ROWS_FETCHED = Counter(
+    "flightalert_rows_fetched_total", "Offers parsed from provider responses", ("provider",)
+)
+NEW_OFFERS = Counter(
+    "flightalert_new_offers_total", "Offers not seen before (sent to Telegram)", ("provider",)
+)
+CHANGED_OFFERS = Counter(
+    "flightalert_changed_offers_total",
+    "Offers with a new price or route written to the database",
+    ("provider",),
+)
+OFFER_EVENTS = Counter(
+    "flightalert_offer_events_total",
+    "Offers added, removed or repriced between consecutive snapshots",
+    ("kind", "provider"),
+)
+UNCHANGED_PAYLOADS = Counter(
+    "flightalert_unchanged_payloads_total",
+    "Provider polls short-circuited because the payload did not change",
+    ("provider",),
+)
+DB_ROWS_WRITTEN = Counter(
+    "flightalert_db_rows_written_total", "Rows written to the database", ("operation",)
+)
+DB_WRITE_QUEUE = Gauge(
+    "flightalert_db_write_queue", "Database write batches queued or being written"
+)
+DB_WRITE_LATENCY = Histogram(
+    "flightalert_db_write_latency_seconds",
+    "Time from queueing a database write batch to its commit",
+)
+LEASES_HELD = Gauge("flightalert_leases_held", "Polling jobs leased by this worker")
+MESSAGES = Counter(
+    "flightalert_messages_total", "Telegram messages by delivery outcome", ("status",)
+)
+OUTBOX_PENDING = Gauge(
+    "flightalert_outbox_pending", "Telegram messages waiting in the outbox", ("chat",)
+)
+
+
+def render():
+    return REGISTRY.render()
@@ -0,0 +1,294 @@
+from datetime import date
+
+import psycopg2.extras
+from psycopg2 import sql
+
+from logger import Logger
+from offer import offer_key
+
+# Staly klucz blokady doradczej, zeby migracje nie biegly rownolegle w kilku procesach
+MIGRATION_LOCK_KEY = 7342001
+
+
+def create_destination_changes(db, cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS destination_changes (
+            id SERIAL PRIMARY KEY,
+            price FLOAT,
+            country VARCHAR(255),
+            name VARCHAR(255),
+            airports VARCHAR(255),
+            dates VARCHAR(255),
+            brand VARCHAR(255),
+            provider VARCHAR(255),
+            date TIMESTAMP,
+            UNIQUE(price, country, name, airports, brand, dates)
+        )
+        """
+    )
+
+
+def add_active_and_offer_key(db, cursor):
+    cursor.execute(
+        """
+        ALTER TABLE destination_changes
+        ADD COLUMN IF NOT EXISTS active BOOLEAN DEFAULT True,
+        ADD COLUMN IF NOT EXISTS offer_key BIGINT
+        """
+    )
+
+
+def backfill_offer_keys(db, cursor, batch_size=5000):
+    backfilled = 0
+    while True:
+        cursor.execute(
+            """
+            SELECT id, price, country, name, airports, brand, dates
+            FROM destination_changes
+            WHERE offer_key IS NULL
+            LIMIT %s
+            """,
+            (batch_size,),
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        psycopg2.extras.execute_values(
+            cursor,
+            """
+            UPDATE destination_changes AS d
+            SET offer_key = v.offer_key
+            FROM (VALUES %s) AS v (id, offer_key)
+            WHERE d.id = v.id
+            """,
+            [(row[0], offer_key(*row[1:])) for row in rows],
+            page_size=batch_size,
+        )
+        backfilled += len(rows)
+    if backfilled:
+        Logger.info(f"Backfilled offer_key for {backfilled} rows")
+    cursor.execute(
+        """
+        UPDATE destination_changes SET active = True WHERE active IS NULL;
+        ALTER TABLE destination_changes
+        ALTER COLUMN offer_key SET NOT NULL,
+        ALTER COLUMN active SET NOT NULL
+        """
+    )
+
+
+def offer_key_unique(db, cursor):
+    # Jeden unikalny indeks na BIGINT zamiast szesciokolumnowego UNIQUE na FLOAT/VARCHAR
+    cursor.execute(
+        """
+        DROP INDEX IF EXISTS destination_changes_offer_key_idx;
+        CREATE UNIQUE INDEX IF NOT EXISTS destination_changes_offer_key_uidx
+        ON destination_changes (offer_key)
+        """
+    )
+    cursor.execute(
+        """
+        SELECT conname
+        FROM pg_constraint
+        WHERE conrelid = 'destination_changes'::regclass AND contype = 'u'
+        """
+    )
+    for (constraint_name,) in cursor.fetchall():
+        Logger.info(f"Dropping legacy constraint {constraint_name}")
+        cursor.execute(
+            sql.SQL("ALTER TABLE destination_changes DROP CONSTRAINT {}").format(
+                sql.Identifier(constraint_name)
+            )
+        )
+
+
+def active_and_route_indexes(db, cursor):
+    # Indeks czesciowy - antyzlaczenie w check_active skanuje tylko aktywne oferty
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS destination_changes_active_offer_key_idx
+        ON destination_changes (offer_key) WHERE active;
+        CREATE INDEX IF NOT EXISTS destination_changes_route_idx
+        ON destination_changes (airports, dates, brand);
+        CREATE INDEX IF NOT EXISTS destination_changes_active_route_idx
+        ON destination_changes (airports, price) WHERE active
+        """
+    )
+
+
+def create_price_observations(db, cursor):
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS price_observations (
+            observed_at TIMESTAMP NOT NULL,
+            offer_key BIGINT NOT NULL,
+            price FLOAT,
+            airports VARCHAR(255),
+            dates VARCHAR(255),
+            brand VARCHAR(255),
+            provider VARCHAR(255)
+        ) PARTITION BY RANGE (observed_at);
+        CREATE INDEX IF NOT EXISTS price_observations_offer_key_idx
+        ON price_observations (offer_key, observed_at);
+        CREATE INDEX IF NOT EXISTS price_observations_route_idx
+        ON price_observations (airports, dates, brand, observed_at)
+        """
+    )
+    # Historia z destination_changes trafia do partycji wg daty pierwszej obserwacji
+    cursor.execute(
+        "SELECT min(date), max(date) FROM destination_changes WHERE date IS NOT NULL"
+    )
+    first, last = cursor.fetchone()
+    if first is not None:
+        month = month_start(first)
+        while month <= month_start(last):
+            ensure_price_partition(cursor, month)
+            month = next_month(month)
+        cursor.execute(
+            """
+            INSERT INTO price_observations (
+                observed_at, offer_key, price, airports, dates, brand, provider
+            )
+            SELECT date, offer_key, price, airports, dates, brand, provider
+            FROM destination_changes
+            WHERE date IS NOT NULL
+            """
+        )
+        Logger.info(f"Copied {cursor.rowcount} rows into price_observations")
+
+
+def create_alert_rules(db, cursor):
+    # Reguly subskrybentow; NULL w kolumnie oznacza brak ograniczenia
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS alert_rules (
+            id SERIAL PRIMARY KEY,
+            chat_id VARCHAR(64) NOT NULL,
+            max_price FLOAT,
+            countries VARCHAR(255)[],
+            departure_airports VARCHAR(16)[],
+            date_from DATE,
+            date_to DATE,
+            providers VARCHAR(255)[],
+            active BOOLEAN NOT NULL DEFAULT True,
+            created_at TIMESTAMP NOT NULL DEFAULT now()
+        );
+        CREATE INDEX IF NOT EXISTS alert_rules_chat_idx ON alert_rules (chat_id) WHERE active
+        """
+    )
+
+
+def create_job_leases(db, cursor):
+    # Dzierzawy zadan (provider / wyszukiwanie) i zywe procesy bota - patrz coordinator.py
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS job_leases (
+            job VARCHAR(255) PRIMARY KEY,
+            owner VARCHAR(255) NOT NULL,
+            expires_at TIMESTAMP NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS coordinator_workers (
+            worker_id VARCHAR(255) PRIMARY KEY,
+            heartbeat_at TIMESTAMP NOT NULL
+        )
+        """
+    )
+
+
+def create_route_price_levels(db, cursor):
+    # Poziomy ceny tras z DealDetector.update (najnizsza cena trasy, gdy sie zmienila) -
+    # z nich seed() odtwarza bufory po restarcie
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS route_price_levels (
+            observed_at TIMESTAMP NOT NULL,
+            airports VARCHAR(255),
+            dates VARCHAR(255),
+            brand VARCHAR(255),
+            price FLOAT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS route_price_levels_observed_idx
+        ON route_price_levels (observed_at)
+        """
+    )
+    # Wczesniejsza historia tylko z price_observations (nowe offer_key) - najnizsza cena
+    # trasy w kazdym cyklu to najlepsze dostepne przyblizenie
+    cursor.execute(
+        """
+        INSERT INTO route_price_levels (observed_at, airports, dates, brand, price)
+        SELECT observed_at, airports, dates, brand, min(price)
+        FROM price_observations
+        WHERE price IS NOT NULL
+        GROUP BY observed_at, airports, dates, brand
+        """
+    )
+    Logger.info(f"Copied {cursor.rowcount} route price levels from price_observations")
+
+
+MIGRATIONS = [
+    (1, "create destination_changes", create_destination_changes),
+    (2, "add active and offer_key columns", add_active_and_offer_key),
+    (3, "backfill offer_key", backfill_offer_keys),
+    (4, "unique offer_key", offer_key_unique),
+    (5, "active and route indexes", active_and_route_indexes),
+    (6, "partitioned price_observations", create_price_observations),
+    (7, "alert rules", create_alert_rules),
+    (8, "job leases", create_job_leases),
+    (9, "route price levels", create_route_price_levels),
+]
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def next_month(value):
+    return date(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+
+def price_partition_name(month):
+    return f"price_observations_y{month.year}m{month.month:02d}"
+
+
+def ensure_price_partition(cursor, month):
+    cursor.execute(
+        sql.SQL(
+            """
+            CREATE TABLE IF NOT EXISTS {} PARTITION OF price_observations
+            FOR VALUES FROM (%s) TO (%s)
+            """
+        ).format(sql.Identifier(price_partition_name(month))),
+        (month, next_month(month)),
+    )
+
+
+def migrate(db):
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INT PRIMARY KEY,
+                name VARCHAR(255),
+                applied_at TIMESTAMP DEFAULT now()
+            )
+            """
+        )
+
+    for version, name, apply in MIGRATIONS:
+        # Kazda migracja w osobnej transakcji, pod blokada i z ponownym sprawdzeniem wersji
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_KEY,))
+            cursor.execute(
+                "SELECT 1 FROM schema_migrations WHERE version = %s", (version,)
+            )
+            if cursor.fetchone():
+                continue
+            Logger.info(f"Applying migration {version}: {name}")
+            apply(db, cursor)
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                (version, name),
+            )
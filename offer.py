@@ -0,0 +1,111 @@
+import hashlib
+import json
+
+
+def offer_key(price, country, name, airports, brand, dates):
+    # Stabilny 64-bitowy skrot szesciu kolumn unikalnosci (NULL i "" sa rozrozniane)
+    raw = json.dumps(
+        [float(price) if price is not None else None, country, name, airports, brand, dates],
+        separators=(",", ":"),
+        ensure_ascii=False,
+    ).encode("utf-8")
+    return int.from_bytes(
+        hashlib.blake2b(raw, digest_size=8).digest(), "big", signed=True
+    )
+
+
+class Offer:
+    # Oferta lotu czarterowego, znormalizowana raz przy parsowaniu odpowiedzi providera
+    __slots__ = (
+        "provider",
+        "country",
+        "name",
+        "code",
+        "departure",
+        "list_price",
+        "price",
+        "brand",
+        "route_name",
+        "departure_airport",
+        "airports",
+        "dates",
+        "key",
+    )
+
+    def __init__(
+        self, provider, country, name, code, departure, list_price, price, brand, route_name
+    ):
+        self.provider = provider
+        self.country = country
+        self.name = name
+        self.code = code
+        self.departure = departure
+        self.list_price = list_price
+        self.price = price
+        self.brand = brand
+        self.route_name = route_name
+
+        route = route_name.split(" ")
+        self.departure_airport = route[-4]
+        self.airports = "".join(route[-4:-1])
+        self.dates = departure.split(" ")[0]
+        self.key = offer_key(price, country, name, self.airports, brand, self.dates)
+
+    def __repr__(self):
+        return f"Offer({self.provider}, {self.airports}, {self.dates}, {self.price})"
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+class PackageOffer:
+    # Oferta wycieczki (hotel + przelot) z offer_search
+    __slots__ = (
+        "provider",
+        "adults",
+        "hotel_code",
+        "hotel_name",
+        "city",
+        "room_name",
+        "hotel_standard",
+        "board_type",
+        "offer_code",
+        "duration",
+        "offer_url",
+        "country",
+        "full_price",
+        "currency",
+        "departure_place",
+        "departure_date",
+        "return_date",
+        "trip_rating",
+        "departure_carrier",
+        "return_carrier",
+        "departure_hour",
+        "departure_hour_dest",
+        "return_hour",
+        "return_hour_dest",
+        "link",
+        "seen_key",
+    )
+
+    def __init__(self, provider, base_url, adults=1, **fields):
+        self.provider = provider
+        self.adults = adults
+        for field in self.__slots__[2:-2]:
+            setattr(self, field, fields.get(field, "N/A"))
+        self.link = base_url + str(self.offer_url)
+        self.seen_key = str(self.offer_code) + str(self.full_price)
+
+    def __repr__(self):
+        return f"PackageOffer({self.provider}, {self.hotel_name}, {self.full_price})"
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+def offers_to_frame(offers):
+    # Pandas tylko do analiz - glowna sciezka bota go nie wymaga
+    import pandas as pd
+
+    return pd.DataFrame([offer.as_dict() for offer in offers])
@@ -1,24 +1,33 @@
 import asyncio
+import functools
 import html
-import requests
+import aiohttp
 import sqlite3
 import inspect
 import json
-import pandas as pd
-import time
 from telegram.ext import Application
 from telegram.constants import ParseMode
 import inspect
 import traceback
-import re
 from typing import List
 from dotenv import load_dotenv
 import os
 
+from http_client import HttpClient
+from logger import Logger
+from message_renderer import MessageTemplate, pack_messages
+from metrics import NEW_OFFERS, STAGE_DURATION
+from offer import PackageOffer
+from outbox import TelegramOutbox
+from scheduler import CHANGED, PRICES_MOVED, UNCHANGED, AdaptiveScheduler
+from search_matrix import Search, SearchMatrix, load_searches
+from seen_index import SeenOfferIndex
+from worker_slot import worker_path
+
 load_dotenv()
 
-chat_id = os.getenv("TELEGRAM_BOT_OFFER_SEARCH_TOKEN")
-bot_token = os.getenv("TELEGRAM_BOT_OFFER_SEARCH_CHAT_ID")
+chat_id = os.getenv("TELEGRAM_BOT_OFFER_SEARCH_CHAT_ID")
+bot_token = os.getenv("TELEGRAM_BOT_OFFER_SEARCH_TOKEN")
 
 
 # CREATE DB
@@ -87,7 +96,14 @@ bot_token = os.getenv("TELEGRAM_BOT_OFFER_SEARCH_CHAT_ID")
 #         print(f"[Error][{current_function_name}]: {e}")
 
 
-used = []
+http = HttpClient.from_env(archive_prefix="offer_search")
+used = SeenOfferIndex.from_env("offer_seen.idx", prefix="OFFER_SEEN_INDEX")
+
+# Zapytanie laczace kilka celow latwo przekracza jedna strone wynikow
+PAGE_SIZE = int(os.getenv("OFFER_SEARCH_PAGE_SIZE", 500))
+MAX_PAGES = int(os.getenv("OFFER_SEARCH_MAX_PAGES", 20))
+# cache_key strony -> liczba ofert z ostatniej zmienionej odpowiedzi (strona bez zmian nic nie zwraca)
+page_rows = {}
 
 # Search Data
 departure_date_from = "2024-08-14"
@@ -97,6 +113,20 @@ duration_to = 5
 Adults_count = 1
 max_price = 4000 * Adults_count
 
+# Domyslne wyszukiwanie; wiele wyszukiwan mozna zadeklarowac w OFFER_SEARCHES (JSON)
+DEFAULT_SEARCH = Search(
+    name="default",
+    departure_date_from=departure_date_from,
+    departure_date_to=departure_date_to,
+    duration_from=duration_from,
+    duration_to=duration_to,
+    adults=Adults_count,
+    max_price=max_price,
+    tui_destinations=("PMI",),
+    wakacje_regions=("33006",),
+    wakacje_countries=("33",),
+)
+
 
 def log_error(e):
     tb = traceback.format_exc()
@@ -108,37 +138,42 @@ def log_error(e):
     print(tb)
 
 
-def escape_markdown(text):
-    special_chars = r"\*_[]()~`>#+-=|{}.!"
-
-    def escape_char(match):
-        return f"\\{match.group(0)}"
-
-    escaped_text = re.sub(f"[{re.escape(special_chars)}]", escape_char, text)
-
-    return escaped_text
-
-
-def strip_markdown_v2(text: str) -> str:
-    return re.sub(r"[\_\*\[\]\(\)\~\`\>\+\-\=\|\{\}\!]", "", text)
-
-
-def markdown_length(text: str) -> int:
-    stripped_text = strip_markdown_v2(text)
-    return len(stripped_text)
-
-
-async def send_message_async(bot, chat_id, text):
+async def send_message_async(outbox, chat_id, text):
+    # Wiadomosc trafia do kolejki; limity Telegrama i ponowienia obsluguje outbox
     if text != " " and text is not None and text != "":
-        await bot.send_message(
-            chat_id=chat_id,
-            text=text,
+        outbox.enqueue(
+            chat_id,
+            text,
             parse_mode=ParseMode.MARKDOWN_V2,
             disable_web_page_preview=True,
         )
 
 
-async def get_tui_data():
+async def stream_pages(query, url, path, request):
+    # request(page) -> argumenty stream_json dla strony (od 0); kolejna strona tylko,
+    # gdy poprzednia byla pelna
+    for page in range(MAX_PAGES):
+        cache_key = query.cache_key if page == 0 else f"{query.cache_key}:{page}"
+        stream = http.stream_json("POST", url, path=path, cache_key=cache_key, **request(page))
+        rows = 0
+        async for row in stream:
+            rows += 1
+            yield row
+        if stream.not_modified:
+            rows = page_rows.get(cache_key, 0)
+        else:
+            page_rows[cache_key] = rows
+        if rows < PAGE_SIZE:
+            return
+    Logger.warn(
+        "Query %s still returns full pages after %s pages",
+        query.cache_key,
+        MAX_PAGES,
+        provider=query.provider,
+    )
+
+
+async def get_tui_data(query):
     url = "https://www.tui.pl/api/services/tui-search/api/search/offers"
     headers = {
         "Content-Type": "application/json;charset=UTF-8",
@@ -146,8 +181,8 @@ async def get_tui_data():
 
     payload_json = {
         "childrenBirthdays": [],
-        "departureDateFrom": departure_date_from,
-        "departureDateTo": departure_date_to,
+        "departureDateFrom": query.departure_date_from,
+        "departureDateTo": query.departure_date_to,
         "departuresCodes": [
             "BZG",
             "GDN",
@@ -161,13 +196,11 @@ async def get_tui_data():
             "WRO",
             "LCJ",
         ],
-        "destinationsCodes": [
-            "PMI"
-        ],
-        "durationFrom": duration_from,
-        "durationTo": duration_to,
+        "destinationsCodes": list(query.destinations),
+        "durationFrom": query.duration_from,
+        "durationTo": query.duration_to,
         "occupancies": [],
-        "numberOfAdults": Adults_count,
+        "numberOfAdults": query.adults,
         "offerType": "BY_PLANE",
         "filters": [
             {"filterId": "priceSelector", "selectedValues": []},
@@ -179,7 +212,7 @@ async def get_tui_data():
                     "GT06-HB GT06-HBP",
                 ],
             },
-            {"filterId": "amountRange", "selectedValues": [f"#{str(max_price)}"]},
+            {"filterId": "amountRange", "selectedValues": [f"#{str(query.max_price)}"]},
             {
                 "filterId": "minHotelCategory",
                 "selectedValues": ["defaultHotelCategory"],
@@ -190,285 +223,310 @@ async def get_tui_data():
             },
             {"filterId": "beach_distance", "selectedValues": ["defaultBeachDistance"]},
         ],
-        "metaData": {"page": 0, "pageSize": 500, "sorting": "price"},
+        "metaData": {"page": 0, "pageSize": PAGE_SIZE, "sorting": "price"},
     }
 
+    def request(page):
+        payload_json["metaData"]["page"] = page
+        return dict(headers=headers, json=payload_json)
+
     try:
-        response = requests.post(url, headers=headers, json=payload_json)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as err:
+        # Oferty sa zwracane w miare naplywania odpowiedzi
+        async for row in stream_pages(query, url, ("offers",), request):
+            yield row
+    except aiohttp.ClientError as err:
         print(f"Błąd przy pobieraniu danych: {err}")
     except Exception as e:
         current_function_name = inspect.currentframe().f_code.co_name
         print(f"[Error][{current_function_name}]: {e}")
 
 
-async def get_wakacje_pl_data():
+async def get_wakacje_pl_data(query):
     url = "https://www.wakacje.pl/v2/api/offers"
     headers = {
         "Content-Type": "application/json;charset=UTF-8",
     }
-    payload = json.dumps(
-        [
-            {
-                "method": "search.tripsSearch",
-                "params": {
-                    "brand": "WAK",
-                    "limit": 500,
-                    "priceHistory": 1,
-                    "imageSizes": ["570,428"],
-                    "flatArray": True,
-                    "multiSearch": True,
-                    "withHotelRate": 1,
-                    "withPromoOffer": 0,
-                    "recommendationVersion": "",
-                    "withPromotionsInfo": False,
-                    "type": "tours",
-                    "firstMinuteTui": False,
-                    "countryId": [],
-                    "regionId": [
-                        "33006",
-                    ],
+    payload = [
+        {
+            "method": "search.tripsSearch",
+            "params": {
+                "brand": "WAK",
+                "limit": PAGE_SIZE,
+                "priceHistory": 1,
+                "imageSizes": ["570,428"],
+                "flatArray": True,
+                "multiSearch": True,
+                "withHotelRate": 1,
+                "withPromoOffer": 0,
+                "recommendationVersion": "",
+                "withPromotionsInfo": False,
+                "type": "tours",
+                "firstMinuteTui": False,
+                "countryId": [],
+                "regionId": list(query.destinations),
+                "cityId": [],
+                "hotelId": [],
+                "roundTripId": [],
+                "cruiseId": [],
+                "searchType": "wczasy",
+                "offersAttributes": [],
+                "alternative": {
+                    "countryId": list(query.countries),
+                    "regionId": [],
                     "cityId": [],
-                    "hotelId": [],
-                    "roundTripId": [],
-                    "cruiseId": [],
-                    "searchType": "wczasy",
-                    "offersAttributes": [],
-                    "alternative": {
-                        "countryId": ["33"],
-                        "regionId": [],
-                        "cityId": [],
-                    },
+                },
+                "qsVersion": "cx",
+                "query": {
+                    "campTypes": [],
                     "qsVersion": "cx",
-                    "query": {
-                        "campTypes": [],
-                        "qsVersion": "cx",
-                        "qsVersionLast": 0,
-                        "tab": False,
-                        "candy": False,
-                        "pok": None,
-                        "flush": False,
-                        "tourOpAndCode": None,
-                        "obj_type": None,
-                        "catalog": None,
-                        "roomType": None,
-                        "test": None,
-                        "year": None,
-                        "month": None,
-                        "rangeDate": None,
-                        "withoutLast": 0,
-                        "category": False,
-                        "not-attribute": False,
-                        "pageNumber": 1,
-                        "departureDate": departure_date_from,
-                        "arrivalDate": departure_date_to,
-                        "departure": None,
-                        "type": [1],
-                        "duration": {"min": duration_from, "max": duration_to},
-                        "minPrice": None,
-                        "maxPrice": str(max_price),
-                        "service": [1, 2, 5, 6],
-                        "firstminute": None,
-                        "attribute": [],
-                        "promotion": [],
-                        "tourId": None,
-                        "search": None,
-                        "minCategory": None,
-                        "maxCategory": 50,
-                        "sort": 1,
-                        "order": 0,
-                        "totalPrice": True,
-                        "rank": 60,
-                        "withoutTours": [],
-                        "withoutCountry": [],
-                        "withoutTrips": [],
-                        "rooms": [
-                            {"adult": Adults_count, "kid": 0, "ages": [], "inf": None}
-                        ],
-                        "offerCode": None,
-                        "dedicatedOffer": False,
+                    "qsVersionLast": 0,
+                    "tab": False,
+                    "candy": False,
+                    "pok": None,
+                    "flush": False,
+                    "tourOpAndCode": None,
+                    "obj_type": None,
+                    "catalog": None,
+                    "roomType": None,
+                    "test": None,
+                    "year": None,
+                    "month": None,
+                    "rangeDate": None,
+                    "withoutLast": 0,
+                    "category": False,
+                    "not-attribute": False,
+                    "pageNumber": 1,
+                    "departureDate": query.departure_date_from,
+                    "arrivalDate": query.departure_date_to,
+                    "departure": None,
+                    "type": [1],
+                    "duration": {
+                        "min": query.duration_from,
+                        "max": query.duration_to,
                     },
-                    "durationMin": str(duration_from),
+                    "minPrice": None,
+                    "maxPrice": str(query.max_price),
+                    "service": [1, 2, 5, 6],
+                    "firstminute": None,
+                    "attribute": [],
+                    "promotion": [],
+                    "tourId": None,
+                    "search": None,
+                    "minCategory": None,
+                    "maxCategory": 50,
+                    "sort": 1,
+                    "order": 0,
+                    "totalPrice": True,
+                    "rank": 60,
+                    "withoutTours": [],
+                    "withoutCountry": [],
+                    "withoutTrips": [],
+                    "rooms": [
+                        {"adult": query.adults, "kid": 0, "ages": [], "inf": None}
+                    ],
+                    "offerCode": None,
+                    "dedicatedOffer": False,
                 },
-            }
-        ]
-    )
+                "durationMin": str(query.duration_from),
+            },
+        }
+    ]
+
+    def request(page):
+        payload[0]["params"]["query"]["pageNumber"] = page + 1
+        return dict(headers=headers, data=json.dumps(payload))
 
     try:
-        response = requests.post(url, headers=headers, data=payload)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as err:
+        async for row in stream_pages(query, url, ("data", "offers"), request):
+            yield row
+    except aiohttp.ClientError as err:
         print(f"Błąd przy pobieraniu danych: {err}")
     except Exception as e:
         current_function_name = inspect.currentframe().f_code.co_name
         print(f"[Error][{current_function_name}]: {e}")
 
 
-async def send_messages(bot, chat_id):
-    data = {
-        "hotelCode": [],
-        "hotelName": [],
-        "City": [],
-        "roomName": [],
-        "hotelStandard": [],
-        "boardType": [],
-        "offerCode": [],
-        "duration": [],
-        "offerUrl": [],
-        "Country": [],
-        "FullPrice": [],
-        "PriceCurrency": [],
-        "departurePlace": [],
-        "departureDate": [],
-        "returnDate": [],
-        "tripRating": [],
-        "departureFlight_carrierName": [],
-        "returnFlight_carrierName": [],
-        "departureFlight_hour": [],
-        "departureFlight_hour_dest": [],
-        "returnFlight_hour": [],
-        "returnFlight_hour_dest": [],
-        "provider": [],
-    }
-
-    try:
-        json_data_tui = await get_tui_data()
-        for row in json_data_tui["offers"]:
-            data["hotelCode"].append(row.get("hotelCode", "N/A"))
-            data["hotelName"].append(row.get("hotelName", "N/A"))
-            data["City"].append(row.get("city", "N/A"))
-            data["roomName"].append(row.get("roomName", "N/A"))
-            data["hotelStandard"].append(row.get("hotelStandard", "N/A"))
-            data["boardType"].append(row.get("boardType", "N/A"))
-            data["offerCode"].append(row.get("offerCode", "N/A"))
-            data["duration"].append(row.get("duration", "N/A"))
-            data["offerUrl"].append(row.get("offerUrl", "N/A"))
-
-            # Sprawdź, czy 'breadcrumbs' istnieje oraz czy 'breadcrumbs' zawiera co najmniej jeden element
-            breadcrumbs = row.get("breadcrumbs", [])
-            data["Country"].append(
-                breadcrumbs[0].get("label", "N/A") if breadcrumbs else "N/A"
-            )
-
-            data["FullPrice"].append(int(row.get("discountFullPrice", 0)))
-            data["PriceCurrency"].append(row.get("currency", "N/A"))
-
-            # Sprawdź, czy 'departureFlight' istnieje oraz czy zawiera wymagane klucze
-            departureFlight = row.get("departureFlight", {})
-            data["departurePlace"].append(
-                departureFlight.get("departure", {}).get("airportName", "N/A")
-            )
-            data["departureDate"].append(row.get("departureDate", "N/A"))
-            data["returnDate"].append(row.get("returnDate", "N/A"))
-            data["departureFlight_carrierName"].append(
-                departureFlight.get("carrierName", "N/A")
-            )
-            data["departureFlight_hour"].append(
-                str(
-                    departureFlight.get("departure", {}).get("date", "N/A")
-                    + " "
-                    + departureFlight.get("departure", {}).get("time", "N/A")
-                )
-            )
-            data["departureFlight_hour_dest"].append(
-                departureFlight.get("arrival", {}).get("date", "N/A")
-            )
-
-            # Sprawdź, czy 'returnFlight' istnieje oraz czy zawiera wymagane klucze
-            returnFlight = row.get("returnFlight", {})
-            data["returnFlight_carrierName"].append(
-                returnFlight.get("carrierName", "N/A")
-            )
-            data["returnFlight_hour"].append(
-                returnFlight.get("departure", {}).get("date", "N/A")
-            )
-            data["returnFlight_hour_dest"].append(
-                returnFlight.get("arrival", {}).get("date", "N/A")
-            )
+async def parse_tui_offers(rows, adults):
+    async for row in rows:
+        # Sprawdź, czy 'departureFlight' istnieje oraz czy zawiera wymagane klucze
+        departureFlight = row.get("departureFlight", {})
+        returnFlight = row.get("returnFlight", {})
+        # Sprawdź, czy 'breadcrumbs' istnieje oraz czy 'breadcrumbs' zawiera co najmniej jeden element
+        breadcrumbs = row.get("breadcrumbs", [])
+        yield PackageOffer(
+            "TUI",
+            "https://tui.pl",
+            adults=adults,
+            hotel_code=row.get("hotelCode", "N/A"),
+            hotel_name=row.get("hotelName", "N/A"),
+            city=row.get("city", "N/A"),
+            room_name=row.get("roomName", "N/A"),
+            hotel_standard=row.get("hotelStandard", "N/A"),
+            board_type=row.get("boardType", "N/A"),
+            offer_code=row.get("offerCode", "N/A"),
+            duration=row.get("duration", "N/A"),
+            offer_url=row.get("offerUrl", "N/A"),
+            country=breadcrumbs[0].get("label", "N/A") if breadcrumbs else "N/A",
+            full_price=int(row.get("discountFullPrice", 0)),
+            currency=row.get("currency", "N/A"),
+            departure_place=departureFlight.get("departure", {}).get(
+                "airportName", "N/A"
+            ),
+            departure_date=row.get("departureDate", "N/A"),
+            return_date=row.get("returnDate", "N/A"),
+            trip_rating=row.get("tripAdvisorRating", "N/A"),
+            departure_carrier=departureFlight.get("carrierName", "N/A"),
+            return_carrier=returnFlight.get("carrierName", "N/A"),
+            departure_hour=str(
+                departureFlight.get("departure", {}).get("date", "N/A")
+                + " "
+                + departureFlight.get("departure", {}).get("time", "N/A")
+            ),
+            departure_hour_dest=departureFlight.get("arrival", {}).get("date", "N/A"),
+            return_hour=returnFlight.get("departure", {}).get("date", "N/A"),
+            return_hour_dest=returnFlight.get("arrival", {}).get("date", "N/A"),
+        )
 
-            data["tripRating"].append(row.get("tripAdvisorRating", "N/A"))
-            data["provider"].append("TUI")
 
-        json_data_wakacje = await get_wakacje_pl_data()
-        for row in json_data_wakacje["data"]["offers"]:
-            data["hotelCode"].append(row.get("id", "N/A"))
-            data["hotelName"].append(row.get("name", "N/A"))
-            
-            data["roomName"].append(row.get("roomType", "N/A"))
-            data["hotelStandard"].append(row.get("category", "N/A"))
-            data["boardType"].append(row.get("serviceDesc", "N/A"))
-            data["offerCode"].append(row.get("offerHash", "N/A"))
-            data["duration"].append(row.get("duration", "N/A"))
-            data["offerUrl"].append(row.get("link", "N/A"))
+async def parse_wakacje_offers(rows, adults):
+    async for row in rows:
+        place = row.get("place", {})
+        yield PackageOffer(
+            "WakacjePL - " + row.get("tourOperatorName", "N/A"),
+            "https://wakacje.pl",
+            adults=adults,
+            hotel_code=row.get("id", "N/A"),
+            hotel_name=row.get("name", "N/A"),
+            city=place.get("region", {}).get("name", "N/A"),
+            room_name=row.get("roomType", "N/A"),
+            hotel_standard=row.get("category", "N/A"),
+            board_type=row.get("serviceDesc", "N/A"),
+            offer_code=row.get("offerHash", "N/A"),
+            duration=row.get("duration", "N/A"),
+            offer_url=row.get("link", "N/A"),
+            country=place.get("country", {}).get("name", "N/A"),
+            full_price=int(row.get("originalCurrencyPrice", 0)),
+            currency=row.get("originalCurrency", "N/A"),
+            departure_place=row.get("departurePlace", "N/A"),
+            departure_date=row.get("departureDate", "N/A"),
+            return_date=row.get("returnDate", "N/A"),
+            trip_rating=row.get("ratingValue", "N/A"),
+            departure_carrier="n/a",
+            return_carrier="n/a",
+            departure_hour="n/a",
+            departure_hour_dest="n/a",
+            return_hour="n/a",
+            return_hour_dest="n/a",
+        )
 
-            place = row.get("place", {})
-            country = place.get("country", {})
-            data["Country"].append(country.get("name", "N/A"))
 
-            region = place.get("region", {})
-            data["City"].append(region.get("name", "N/A"))
+FETCHERS = {
+    "TUI": lambda query: parse_tui_offers(get_tui_data(query), query.adults),
+    "WakacjePL": lambda query: parse_wakacje_offers(
+        get_wakacje_pl_data(query), query.adults
+    ),
+}
 
-            data["FullPrice"].append(int(row.get("originalCurrencyPrice", 0)))
-            data["PriceCurrency"].append(row.get("originalCurrency", "N/A"))
 
-            data["departurePlace"].append(row.get("departurePlace", "N/A"))
-            data["departureDate"].append(row.get("departureDate", "N/A"))
-            data["returnDate"].append(row.get("returnDate", "N/A"))
+OFFER_ROW = MessageTemplate(
+    "\\- \\- {provider} \\- \\- 🔗[Link]({link})\n"
+    "✈️ {departure_place}\n"
+    "🌍{country} \\- {city}\n"
+    "⭐{hotel_standard} {board_type}\n"
+    "📅{departure_date} \\- {return_date}\n"
+    "💵 {full_price}{currency} \\({per_person}{currency}/os\\) \n\n",
+    markdown=True,
+    links=("link",),
+)
 
-            data["departureFlight_carrierName"].append("n/a")
-            data["departureFlight_hour"].append("n/a")
-            data["departureFlight_hour_dest"].append("n/a")
 
-            data["returnFlight_carrierName"].append("n/a")
-            data["returnFlight_hour"].append("n/a")
-            data["returnFlight_hour_dest"].append("n/a")
+def create_search_matrix():
+    return SearchMatrix(load_searches(DEFAULT_SEARCH), FETCHERS)
 
-            data["tripRating"].append(row.get("ratingValue", "N/A"))
-            data["provider"].append("WakacjePL - " + row.get("tourOperatorName", "N/A"))
 
-        df = pd.DataFrame(data)
+async def send_messages(outbox, chat_id, matrix, providers=None, quiet=None):
+    # Zwraca PRICES_MOVED, gdy pojawily sie nowe oferty lub ceny, inaczej UNCHANGED;
+    # quiet - providerzy przejeci od innego procesu (oferty tylko oznaczane jako widziane)
+    try:
+        # Wszystkie zapytania (po deduplikacji) wykonywane sa rownolegle
+        offers = await matrix.run(providers)
+        if not offers:
+            Logger.info(
+                "No offers (unchanged responses skipped: %s)", dict(http.short_circuits)
+            )
+            return UNCHANGED
+        offers.sort(key=lambda offer: offer.full_price)
 
-        df = df.reset_index()
-        df = df.sort_values(by="FullPrice")
         # add_to_db(rows_to_add)
-        message_string = ""
-        message_len = 0
-        for index, row in df.iterrows():
-            usedstring = row["offerCode"] + str(row["FullPrice"])
-            if usedstring not in used:
-                used.append(usedstring)
-                if row["provider"] == "TUI":
-                    link = "https://tui.pl" + row["offerUrl"]
-                else:
-                    link = "https://wakacje.pl" + row["offerUrl"]
-
-                message_string_temp = f"{escape_markdown('- - '+row['provider']+' - -')} 🔗[Link]({link})\n✈️ {escape_markdown(str(row['departurePlace']))}\n🌍{escape_markdown(str(row['Country'] + ' - ' + row['City']))}\n⭐{escape_markdown(str(row['hotelStandard']) + ' ' + row['boardType'])}\n📅{escape_markdown(str(row['departureDate'] + ' - ' + row['returnDate']))}\n💵 {escape_markdown(str(row['FullPrice']) + row['PriceCurrency'])} {escape_markdown(str('('+str(int(row['FullPrice'])/Adults_count) + row['PriceCurrency']+'/os)'))} \n\n"
-
-                temp_length = len(message_string_temp.replace(link,"").replace("\n",""))-4
-
-                if message_len + temp_length > 4096:
-                    await send_message_async(bot, chat_id, message_string)
-                    message_len = 0
-                    message_string = ""
-                
-                message_len += temp_length
-                message_string += message_string_temp
-
-        await send_message_async(bot, chat_id, message_string)
-        time.sleep(5)
+        new_offers = [offer for offer in offers if used.check_and_add(offer.seen_key)]
+        if quiet and providers and providers & quiet:
+            quiet -= providers
+            Logger.info(
+                "Skipping %s offers after taking over %s", len(new_offers), sorted(providers)
+            )
+            new_offers = []
+        for offer in new_offers:
+            NEW_OFFERS.inc(provider=offer.provider)
+        rows = (
+            OFFER_ROW.render(
+                provider=offer.provider,
+                link=offer.link,
+                departure_place=offer.departure_place,
+                country=offer.country,
+                city=offer.city,
+                hotel_standard=offer.hotel_standard,
+                board_type=offer.board_type,
+                departure_date=offer.departure_date,
+                return_date=offer.return_date,
+                full_price=offer.full_price,
+                currency=offer.currency,
+                per_person=int(offer.full_price) / offer.adults,
+            )
+            for offer in new_offers
+        )
+        with STAGE_DURATION.time(stage="render", provider="offer_search"):
+            messages = pack_messages(rows)
+        for message in messages:
+            await send_message_async(outbox, chat_id, message)
+        await used.save_async()
+        return PRICES_MOVED if messages else UNCHANGED
     except Exception as e:
+        # Wymus ponowne parsowanie w nastepnym cyklu
+        for query in matrix.queries:
+            http.forget_prefix(query.cache_key)
         log_error(e)
+        return CHANGED
 
 
-async def main():
+async def main(coordinator=None):
+    # Moze dzialac we wspolnej petli zdarzen razem z botem z flight_search
     bot = Application.builder().token(bot_token).build()
-    while True:
-        # bot.bot.send_message()
-        await send_messages(bot.bot, chat_id)
-        await asyncio.sleep(60 * 5)
+    matrix = create_search_matrix()
+    outbox = TelegramOutbox(
+        bot.bot,
+        journal_path=worker_path(os.getenv("OFFER_OUTBOX_JOURNAL", "offer_outbox.journal")),
+    )
+    outbox.start()
+    # Kazdy provider odpytywany we wlasnym rytmie
+    scheduler = AdaptiveScheduler(coordinator=coordinator)
+    quiet = set()
+
+    def acquired(provider, takeover):
+        if takeover:
+            quiet.add(provider)
+
+    for provider in FETCHERS:
+        scheduler.add(
+            f"offer_search_{provider}",
+            functools.partial(send_messages, outbox, chat_id, matrix, {provider}, quiet),
+            on_acquire=functools.partial(acquired, provider),
+        )
+    try:
+        await scheduler.run_forever()
+    finally:
+        await outbox.close()
+        await http.close()
 
 
-asyncio.run(main())
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,250 @@
+import asyncio
+import itertools
+import json
+import os
+import random
+from collections import deque
+from datetime import timedelta
+
+from logger import Logger
+from metrics import MESSAGES, OUTBOX_PENDING, STAGE_DURATION
+from rate_limit import TokenBucket
+
+# Bledy, ktorych ponawianie nic nie da (zla tresc, zablokowany bot, zly token)
+PERMANENT_ERRORS = {
+    "BadRequest",
+    "Forbidden",
+    "InvalidToken",
+    "TelegramBadRequest",
+    "TelegramForbiddenError",
+    "TelegramUnauthorizedError",
+    "TelegramNotFound",
+}
+
+
+def retry_after_seconds(error):
+    retry_after = getattr(error, "retry_after", None)
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return retry_after
+
+
+class TelegramOutbox:
+    # Kolejka wiadomosci: osobny worker na czat (zachowana kolejnosc), wspolny limit globalny,
+    # obsluga retry_after i ponawianie z wykladniczym backoffem. Z journal_path niedostarczone
+    # wiadomosci przetrwaja restart (dostarczenie co najmniej raz). Dziennik zapisywany jest
+    # partiami w osobnym watku i kompaktowany po compact_after potwierdzeniach.
+    def __init__(
+        self,
+        bot,
+        global_rate=None,
+        chat_rate=None,
+        group_rate=None,
+        max_retries=None,
+        journal_path=None,
+        compact_after=None,
+    ):
+        self.bot = bot
+        self.global_limit = TokenBucket(
+            global_rate or float(os.getenv("TELEGRAM_GLOBAL_RATE", 25))
+        )
+        self.chat_rate = chat_rate or float(os.getenv("TELEGRAM_CHAT_RATE", 1))
+        self.group_rate = group_rate or float(os.getenv("TELEGRAM_GROUP_RATE", 20 / 60))
+        self.max_retries = max_retries or int(os.getenv("TELEGRAM_MAX_RETRIES", 8))
+        self.journal_path = journal_path
+        self.compact_after = compact_after or int(os.getenv("OUTBOX_JOURNAL_COMPACT", 1000))
+        self.queues = {}
+        self.chat_limits = {}
+        self.workers = {}
+        self.ids = itertools.count()
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._journal = None
+        self._journal_lines = []
+        self._journal_task = None
+        # Niepotwierdzone wiadomosci (id -> linia enqueue) - z nich powstaje skompaktowany dziennik
+        self._unacked = {}
+        self._acked = 0
+        self._pending_replay = []
+        if self.journal_path:
+            self._replay_journal()
+
+    @property
+    def pending(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def enqueue(self, chat_id, text, **kwargs):
+        if text is None or not text.strip():
+            return None
+        message = {"id": next(self.ids), "chat_id": chat_id, "text": text, "kwargs": kwargs}
+        self._journal_write({"enqueue": message})
+        self._push(message)
+        return message["id"]
+
+    def _push(self, message, front=False):
+        chat_id = message["chat_id"]
+        queue = self.queues.setdefault(chat_id, deque())
+        if front:
+            queue.appendleft(message)
+        else:
+            queue.append(message)
+        self._idle.clear()
+        OUTBOX_PENDING.set(len(queue), chat=chat_id)
+        worker = self.workers.get(chat_id)
+        if worker is None or worker.done():
+            self.workers[chat_id] = asyncio.ensure_future(self._work(chat_id))
+
+    def _chat_limit(self, chat_id):
+        if chat_id not in self.chat_limits:
+            # Ujemne identyfikatory to grupy i kanaly - tam Telegram pozwala na ~20 wiadomosci/min
+            is_group = str(chat_id).startswith("-")
+            self.chat_limits[chat_id] = TokenBucket(
+                self.group_rate if is_group else self.chat_rate, capacity=1
+            )
+        return self.chat_limits[chat_id]
+
+    async def _work(self, chat_id):
+        queue = self.queues[chat_id]
+        chat_limit = self._chat_limit(chat_id)
+        while queue:
+            message = queue.popleft()
+            await chat_limit.acquire()
+            await self.global_limit.acquire()
+            await self._deliver(message, chat_limit)
+            OUTBOX_PENDING.set(len(queue), chat=chat_id)
+        if not self.pending:
+            self._idle.set()
+
+    async def _deliver(self, message, chat_limit):
+        attempt = message.setdefault("attempt", 0)
+        try:
+            with STAGE_DURATION.time(stage="telegram_send", provider="all"):
+                await self.bot.send_message(
+                    chat_id=message["chat_id"], text=message["text"], **message["kwargs"]
+                )
+            self.sent += 1
+            MESSAGES.inc(status="sent")
+            self._journal_write({"ack": message["id"]})
+            return
+        except Exception as e:
+            retry_after = retry_after_seconds(e)
+            if retry_after is not None:
+                Logger.warn("Telegram rate limit hit, retrying after %ss", retry_after)
+                chat_limit.pause(retry_after)
+                self.global_limit.pause(retry_after)
+            elif type(e).__name__ in PERMANENT_ERRORS or attempt >= self.max_retries:
+                Logger.error(
+                    "Dropping message %s after %s attempts: %s", message["id"], attempt + 1, e
+                )
+                self.failed += 1
+                MESSAGES.inc(status="failed")
+                self._journal_write({"ack": message["id"]})
+                return
+            else:
+                delay = min(300, 2**attempt) * (0.5 + random.random() / 2)
+                Logger.warn("Sending message failed (%s), retrying in %.1fs", e, delay)
+                chat_limit.pause(delay)
+            message["attempt"] = attempt + 1
+            self.retried += 1
+            MESSAGES.inc(status="retried")
+            self._push(message, front=True)
+
+    async def flush(self, timeout=None):
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def close(self, timeout=30):
+        if not self._idle.is_set() and not await self.flush(timeout):
+            Logger.warn(f"Closing outbox with {self.pending} undelivered messages")
+        for worker in self.workers.values():
+            worker.cancel()
+        self.workers.clear()
+        if self._journal_task is not None:
+            await self._journal_task
+            self._journal_task = None
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def _journal_write(self, entry):
+        if not self.journal_path:
+            return
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        if "enqueue" in entry:
+            self._unacked[entry["enqueue"]["id"]] = line
+        elif self._unacked.pop(entry["ack"], None) is not None:
+            self._acked += 1
+        self._journal_lines.append(line)
+        if self._journal_task is None or self._journal_task.done():
+            self._journal_task = asyncio.ensure_future(self._journal_flush())
+
+    async def _journal_flush(self):
+        # Wpisy zebrane w czasie poprzedniego zapisu ida jednym write + fsync w watku
+        while self._journal_lines:
+            lines, self._journal_lines = self._journal_lines, []
+            compact = self._acked >= self.compact_after
+            if compact:
+                # Stan po tej partii to dokladnie niepotwierdzone wiadomosci
+                lines, self._acked = list(self._unacked.values()), 0
+            try:
+                await asyncio.to_thread(self._journal_sync, lines, compact)
+            except Exception as e:
+                Logger.error(f"Could not write outbox journal: {e}")
+
+    def _journal_sync(self, lines, compact=False):
+        if compact:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            temp_path = f"{self.journal_path}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.writelines(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.journal_path)
+            return
+        if self._journal is None:
+            self._journal = open(self.journal_path, "a", encoding="utf-8")
+        self._journal.writelines(lines)
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def _replay_journal(self):
+        if not os.path.exists(self.journal_path):
+            return
+        pending = {}
+        try:
+            with open(self.journal_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Ostatnia linia moze byc urwana przy awarii
+                        continue
+                    if "enqueue" in entry:
+                        pending[entry["enqueue"]["id"]] = entry["enqueue"]
+                    elif "ack" in entry:
+                        pending.pop(entry["ack"], None)
+        except Exception as e:
+            Logger.error(f"Could not replay outbox journal: {e}")
+            return
+        # Kompaktowanie: w nowym dzienniku zostaja tylko niedostarczone wiadomosci
+        os.replace(self.journal_path, f"{self.journal_path}.old")
+        self._pending_replay = list(pending.values())
+        if self._pending_replay:
+            Logger.info(f"Re-sending {len(self._pending_replay)} undelivered messages")
+
+    def start(self):
+        # Wywolywane w dzialajacej petli zdarzen
+        for message in self._pending_replay:
+            message.pop("attempt", None)
+            message["id"] = next(self.ids)
+            self._journal_write({"enqueue": message})
+            self._push(message)
+        self._pending_replay = []
@@ -0,0 +1,53 @@
+import asyncio
+import math
+import os
+
+from logger import Logger
+
+
+async def paginate(
+    fetch_page, page_size, concurrency=None, max_pages=None, first_page=1, on_error=None
+):
+    # fetch_page(page) -> (items, total_count); on_error(page) - strona pominieta po bledzie
+    # Pierwsza strona podaje totalCount, pozostale sa pobierane rownolegle w ograniczonym oknie
+    concurrency = concurrency or int(os.getenv("PAGINATION_CONCURRENCY", 4))
+    max_pages = max_pages or int(os.getenv("PAGINATION_MAX_PAGES", 200))
+
+    items, total_count = await fetch_page(first_page)
+    if not items:
+        return
+    yield items
+
+    page_count = min(math.ceil((total_count or 0) / page_size), max_pages)
+    if page_count <= 1:
+        return
+    if math.ceil(total_count / page_size) > max_pages:
+        Logger.warn(
+            "totalCount %s needs more than %s pages, truncating", total_count, max_pages
+        )
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch_bounded(page):
+        async with semaphore:
+            try:
+                page_items, _ = await fetch_page(page)
+                return page_items
+            except Exception as e:
+                Logger.error("Page %s failed: %s", page, e, page=page)
+                if on_error is not None:
+                    on_error(page)
+                return []
+
+    tasks = [
+        asyncio.ensure_future(fetch_bounded(page))
+        for page in range(first_page + 1, first_page + page_count)
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            page_items = await next_done
+            if page_items:
+                yield page_items
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,193 @@
+import asyncio
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from logger import Logger
+from metrics import CHANGED_OFFERS, DB_WRITE_LATENCY, DB_WRITE_QUEUE, STAGE_DURATION
+
+
+class WriteBatch:
+    # Zapis jednego providera: pelny snapshot albo przyrost z SnapshotDelta
+    __slots__ = (
+        "scope", "snapshot", "inserts", "activate", "deactivate", "levels", "queued_at"
+    )
+
+    def __init__(self, scope, snapshot=None, inserts=(), activate=(), deactivate=(), levels=()):
+        self.scope = scope
+        self.snapshot = snapshot
+        # [(observed_at, oferty)] - czas obserwacji ustalany przy pobraniu, nie przy zapisie
+        self.inserts = list(inserts)
+        self.activate = set(activate)
+        self.deactivate = set(deactivate)
+        # [(observed_at, poziomy cen tras z DealDetector.update)]
+        self.levels = list(levels)
+        self.queued_at = time.monotonic()
+
+    @classmethod
+    def from_delta(cls, delta, scope, observed_at=None, levels=()):
+        observed_at = observed_at or datetime.now()
+        levels = [(observed_at, levels)] if levels else ()
+        if delta.baseline:
+            return cls(scope, snapshot=delta.offers, levels=levels)
+        entered = list(delta.entered())
+        return cls(
+            scope,
+            inserts=[(observed_at, entered)] if entered else (),
+            activate=(offer.key for offer in entered),
+            deactivate=delta.left(),
+            levels=levels,
+        )
+
+    def merge(self, later):
+        # Dwa przyrosty tego samego zakresu jako jeden: wygrywa pozniejszy stan flagi active
+        self.inserts.extend(later.inserts)
+        self.levels.extend(later.levels)
+        self.activate = (self.activate - later.deactivate) | later.activate
+        self.deactivate = (self.deactivate - later.activate) | later.deactivate
+
+    def __len__(self):
+        if self.snapshot is not None:
+            return len(self.snapshot)
+        return sum(len(offers) for _, offers in self.inserts) + len(self.deactivate)
+
+
+class WriteBehindWriter:
+    # Zapis do bazy w osobnym watku, zeby psycopg2 nie blokowal petli zdarzen. Kolejka jest
+    # ograniczona do max_pending partii: kolejne przyrosty tego samego zakresu sa scalane,
+    # a gdy miejsca brak, submit() czeka (pobieranie zwalnia do tempa bazy).
+    def __init__(self, db_manager, on_failure=None, max_pending=None):
+        self.db_manager = db_manager
+        self.on_failure = on_failure
+        self.max_pending = max_pending or int(os.getenv("DB_WRITE_QUEUE", 4))
+        self.pending = deque()
+        self.in_flight = None
+        self.written = 0
+        self.coalesced = 0
+        self.failed = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._changed = None
+        self._worker = None
+
+    @property
+    def depth(self):
+        return len(self.pending) + (self.in_flight is not None)
+
+    def _condition(self):
+        # Tworzony w dzialajacej petli
+        if self._changed is None:
+            self._changed = asyncio.Condition()
+        return self._changed
+
+    def start(self):
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.ensure_future(self._work())
+
+    async def submit(self, batch):
+        self.start()
+        changed = self._condition()
+        async with changed:
+            if self._coalesce(batch):
+                return
+            while len(self.pending) >= self.max_pending:
+                Logger.warn(
+                    "Database write queue full (%s batches), waiting", len(self.pending)
+                )
+                await changed.wait()
+                if self._coalesce(batch):
+                    return
+            self.pending.append(batch)
+            DB_WRITE_QUEUE.set(self.depth)
+            changed.notify_all()
+
+    def _coalesce(self, batch):
+        if batch.snapshot is not None:
+            return False
+        # Tylko z ostatnia oczekujaca partia tego zakresu, zeby zachowac kolejnosc zapisow
+        for queued in reversed(self.pending):
+            if queued.scope != batch.scope:
+                continue
+            if queued.snapshot is not None:
+                return False
+            queued.merge(batch)
+            self.coalesced += 1
+            return True
+        return False
+
+    async def _work(self):
+        changed = self._condition()
+        while True:
+            async with changed:
+                while not self.pending:
+                    await changed.wait()
+                self.in_flight = self.pending.popleft()
+                changed.notify_all()
+            batch = self.in_flight
+            try:
+                ok = await asyncio.get_running_loop().run_in_executor(
+                    self._executor, self.write, batch
+                )
+            except Exception as e:
+                Logger.error(f"Database write failed: {e}")
+                ok = False
+            DB_WRITE_LATENCY.observe(time.monotonic() - batch.queued_at)
+            if ok:
+                self.written += 1
+            else:
+                self.failed += 1
+                if self.on_failure is not None:
+                    self.on_failure(batch.scope)
+            async with changed:
+                self.in_flight = None
+                DB_WRITE_QUEUE.set(self.depth)
+                changed.notify_all()
+
+    def write(self, batch):
+        # Wykonywane w watku zapisu; False - baza moze nie odpowiadac snapshotowi
+        db = self.db_manager
+        provider = batch.scope
+        ok = True
+        if batch.levels:
+            ok = db.add_price_levels(batch.levels) is not None
+        if batch.snapshot is not None:
+            with STAGE_DURATION.time(stage="add_to_db", provider=provider):
+                inserted, skipped = db.add_to_db(batch.snapshot)
+            ok = ok and (not batch.snapshot or inserted + skipped > 0)
+            with STAGE_DURATION.time(stage="check_active", provider=provider):
+                reconciled = db.check_active(batch.snapshot, provider=provider)
+            ok = reconciled is not None and ok
+            CHANGED_OFFERS.inc(inserted, provider=provider)
+            return ok
+        for observed_at, offers in batch.inserts:
+            with STAGE_DURATION.time(stage="add_to_db", provider=provider):
+                inserted, skipped = db.add_to_db(offers, observed_at=observed_at)
+            ok = ok and inserted + skipped > 0
+            CHANGED_OFFERS.inc(inserted, provider=provider)
+        if batch.activate or batch.deactivate:
+            with STAGE_DURATION.time(stage="check_active", provider=provider):
+                ok = db.update_active(batch.activate, batch.deactivate) is not None and ok
+        return ok
+
+    async def flush(self, timeout=None):
+        changed = self._condition()
+
+        async def idle():
+            async with changed:
+                while self.depth:
+                    await changed.wait()
+
+        try:
+            await asyncio.wait_for(idle(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def close(self, timeout=60):
+        if self.depth and not await self.flush(timeout):
+            Logger.warn(f"Closing database writer with {self.depth} unwritten batches")
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        self._executor.shutdown(wait=True)
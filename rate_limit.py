@@ -0,0 +1,41 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    # rate - tokeny na sekunde, capacity - maksymalny "wybuch" zapytan
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, tokens=1):
+        # Ile sekund trzeba poczekac na podana liczbe tokenow (bez pobierania ich)
+        self._refill()
+        if self.tokens >= tokens:
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+    def try_acquire(self, tokens=1):
+        self._refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    async def acquire(self, tokens=1):
+        async with self._lock:
+            while not self.try_acquire(tokens):
+                await asyncio.sleep(self.delay(tokens))
+
+    def pause(self, seconds):
+        # Np. po "429 retry_after" - zabiera tokeny tak, by kolejne bylo mozliwe dopiero za `seconds`
+        self._refill()
+        self.tokens = min(self.tokens, -seconds * self.rate)
@@ -0,0 +1,147 @@
+# Odtwarzanie odpowiedzi nagranych z HTTP_RECORD_DIR, bez sieci i bez czekania na cykle:
+#   python replay.py flight archiwum/ [--since 2024-08-01] [--until 2024-09-01] [--db] [--print]
+#   python replay.py offers archiwum/ [--print]
+# --db zapisuje oferty do bazy z DB_* z czasem nagrania (uzupelnianie destination_changes),
+# --print wypisuje wiadomosci, ktore bot wyslalby w danym cyklu.
+import argparse
+import asyncio
+import os
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+from http_client import ReplayHttpClient
+from logger import Logger
+
+load_dotenv()
+# Odtwarzanie nie dotyka plikow stanu dzialajacego bota: indeksy widzianych ofert tylko w
+# pamieci, bez nagrywania odpowiedzi i bez blokady slotu workera (jak w pipeline_bench.py).
+# Moduly bota czytaja to przy imporcie, wiec sa importowane dopiero w replay_*.
+os.environ["SEEN_INDEX_PATH"] = ""
+os.environ["OFFER_SEEN_INDEX_PATH"] = ""
+os.environ["WORKER_SLOT"] = "0"
+os.environ.pop("HTTP_RECORD_DIR", None)
+
+
+class PrintOutbox:
+    # Zamiast Telegrama: liczy wiadomosci i opcjonalnie je wypisuje
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.messages = 0
+
+    def enqueue(self, chat_id, text, **kwargs):
+        self.messages += 1
+        if self.enabled:
+            print(text)
+
+
+def timestamp(value):
+    return datetime.fromisoformat(value).timestamp() if value else None
+
+
+async def replay_flight(args, http):
+    from deal_detector import DealDetector
+    from flight_search import DatabaseManager, DataFetcher, render_offer_messages
+
+    fetcher = DataFetcher(http_client=http)
+    deals = None if args.all_offers else DealDetector()
+    db = None
+    if args.db:
+        db = DatabaseManager(
+            host=os.getenv("DB_HOST"),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD"),
+            database=os.getenv("DB_DATABASE"),
+        )
+        db.create_table()
+
+    cycles = new_offers = inserted = 0
+    try:
+        # Cykle kazdego providera osobno, w kolejnosci nagrania - providerzy byli odpytywani
+        # w roznych momentach, wiec kazdy cykl ma czas swojej pierwszej odpowiedzi
+        while True:
+            entry = http.upcoming()
+            if entry is None:
+                break
+            name = str(entry["key"]).split(":")[0]
+            if name not in fetcher.providers:
+                http.skip(entry)
+                continue
+            offers, all_offers, changed, complete = await fetcher.fetch_provider(name)
+            # Cykl nie odtworzyl tego nagrania - pominiete, zeby petla szla dalej
+            http.skip(entry)
+            cycles += 1
+            levels = []
+            if deals is not None:
+                offers = deals.deals(offers)
+                levels = deals.update(all_offers)
+            new_offers += len(offers)
+            observed_at = datetime.fromtimestamp(entry["ts"])
+            if db is not None and levels:
+                db.add_price_levels([(observed_at, levels)])
+            if db is not None and changed and complete:
+                inserted += db.add_to_db(all_offers, observed_at=observed_at)[0]
+                db.check_active(all_offers, provider=name)
+            print(f"{observed_at} {name}: {len(all_offers)} offers, {len(offers)} alerted")
+            if args.print and offers:
+                offers.sort(key=lambda offer: offer.list_price)
+                for message in render_offer_messages(offers):
+                    print(message)
+    finally:
+        if db is not None:
+            db.close()
+    print(f"Replayed {cycles} cycles: {new_offers} alerted offers, {inserted} rows inserted")
+
+
+async def replay_offers(args, http):
+    import offer_search
+    from search_matrix import SearchMatrix, load_searches
+
+    offer_search.http = http
+    # Bez limitu zapytan - nie ma sieci
+    matrix = SearchMatrix(
+        load_searches(offer_search.DEFAULT_SEARCH), offer_search.FETCHERS, rate=1e9
+    )
+    outbox = PrintOutbox(args.print)
+    cycles = 0
+    while http.remaining:
+        replayed = http.replayed
+        sent = outbox.messages
+        await offer_search.send_messages(outbox, None, matrix)
+        if http.replayed == replayed:
+            break
+        cycles += 1
+        print(
+            f"{datetime.fromtimestamp(http.current_time)}: {outbox.messages - sent} messages"
+        )
+    print(f"Replayed {cycles} cycles: {outbox.messages} messages")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Replay recorded provider responses")
+    parser.add_argument("bot", choices=("flight", "offers"))
+    parser.add_argument("directory")
+    parser.add_argument("--since", help="ISO date/time of the first response")
+    parser.add_argument("--until", help="ISO date/time of the last response")
+    parser.add_argument("--db", action="store_true", help="write flight offers to DB_* database")
+    parser.add_argument("--print", action="store_true", help="print the Telegram messages")
+    parser.add_argument(
+        "--all-offers", action="store_true", help="alert every unseen offer, not only deals"
+    )
+    args = parser.parse_args()
+
+    prefix = "flight" if args.bot == "flight" else "offer_search"
+    http = ReplayHttpClient(
+        args.directory, prefix=prefix, since=timestamp(args.since), until=timestamp(args.until)
+    )
+    if not http.remaining:
+        Logger.warn("No recorded responses found in %s", args.directory)
+        return
+    if args.bot == "flight":
+        await replay_flight(args, http)
+    else:
+        await replay_offers(args, http)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
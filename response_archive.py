@@ -0,0 +1,69 @@
+import glob
+import gzip
+import heapq
+import json
+import os
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from logger import Logger
+
+
+class ResponseArchive:
+    # Surowe odpowiedzi providerow dopisywane do skompresowanych plikow dziennych
+    # {directory}/{prefix}-RRRRMMDD.jsonl.gz (kazdy wpis to osobny czlon gzip, wiec pliki
+    # sa tylko dopisywane). Zapis idzie w jednym watku, zeby nie blokowac petli i zachowac kolejnosc.
+    def __init__(self, directory, prefix="responses"):
+        self.directory = directory
+        self.prefix = prefix
+        os.makedirs(directory, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="archive")
+
+    def record(self, cache_key, method, url, status, body=None):
+        entry = {
+            "ts": time.time(),
+            "key": cache_key,
+            "method": method,
+            "url": url,
+            "status": status,
+            "body": body.decode("utf-8", "replace") if body is not None else None,
+        }
+        self._executor.submit(self._write, entry)
+
+    def _write(self, entry):
+        day = datetime.fromtimestamp(entry["ts"]).strftime("%Y%m%d")
+        path = os.path.join(self.directory, f"{self.prefix}-{day}.jsonl.gz")
+        try:
+            with gzip.open(path, "ab") as f:
+                f.write(json.dumps(entry, ensure_ascii=False).encode("utf-8") + b"\n")
+        except Exception as e:
+            Logger.error("Could not archive response %s: %s", entry["key"], e)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+def _read_file(path, since, until):
+    try:
+        with gzip.open(path, "rb") as f:
+            for line in f:
+                entry = json.loads(line)
+                if since is not None and entry["ts"] < since:
+                    continue
+                if until is not None and entry["ts"] > until:
+                    return
+                yield entry
+    except (EOFError, zlib.error, gzip.BadGzipFile, ValueError) as e:
+        # Ostatni czlon moze byc urwany, jesli proces zginal w trakcie zapisu
+        Logger.warn("Archive %s is truncated, skipping the rest: %s", path, e)
+
+
+def read_archive(directory, prefix="responses", since=None, until=None):
+    # Wpisy w kolejnosci czasu; pliki kilku workerow ({prefix}-wN-...) sa scalane po "ts".
+    # since/until to znaczniki czasu (sekundy)
+    paths = sorted(glob.glob(os.path.join(directory, f"{prefix}-*.jsonl.gz")))
+    return heapq.merge(
+        *(_read_file(path, since, until) for path in paths), key=lambda entry: entry["ts"]
+    )
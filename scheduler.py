@@ -0,0 +1,129 @@
+import asyncio
+import functools
+import os
+from datetime import datetime, timedelta
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.interval import IntervalTrigger
+
+from logger import Logger
+
+# Wynik pojedynczego odpytania providera
+UNCHANGED = "unchanged"
+CHANGED = "changed"
+PRICES_MOVED = "prices_moved"
+
+
+class AdaptiveInterval:
+    # Odstep rosnie, gdy odpowiedzi sie nie zmieniaja, i maleje, gdy zmieniaja sie ceny
+    def __init__(self, interval, min_interval, max_interval, backoff=1.5, tighten=0.5):
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.tighten = tighten
+
+    def update(self, outcome):
+        if outcome == UNCHANGED:
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+        elif outcome == PRICES_MOVED:
+            self.interval = max(self.min_interval, self.interval * self.tighten)
+        return self.interval
+
+
+class AdaptiveScheduler:
+    # Kazdy provider ma wlasne zadanie APSchedulera ze stalym rytmem (IntervalTrigger liczy
+    # terminy od zaplanowanego startu, nie od konca pracy, wiec nie ma dryfu)
+    # Z coordinator zadanie biegnie tylko w procesie, ktory ma na nie dzierzawe.
+    def __init__(self, scheduler=None, coordinator=None):
+        self.scheduler = scheduler or AsyncIOScheduler()
+        self.coordinator = coordinator
+        self.jobs = {}
+        self.intervals = {}
+
+    def add(
+        self,
+        name,
+        poll,
+        interval=None,
+        min_interval=None,
+        max_interval=None,
+        on_acquire=None,
+    ):
+        # poll: funkcja async zwracajaca UNCHANGED, CHANGED albo PRICES_MOVED;
+        # on_acquire(przejete): wywolywane po uzyskaniu dzierzawy zadania
+        key = name.upper()
+        interval = interval or float(
+            os.getenv(f"POLL_INTERVAL_{key}", os.getenv("POLL_INTERVAL", 5 * 60))
+        )
+        min_interval = min_interval or float(
+            os.getenv(f"POLL_MIN_INTERVAL_{key}", os.getenv("POLL_MIN_INTERVAL", 60))
+        )
+        max_interval = max_interval or float(
+            os.getenv(f"POLL_MAX_INTERVAL_{key}", os.getenv("POLL_MAX_INTERVAL", 30 * 60))
+        )
+        self.jobs[name] = poll
+        self.intervals[name] = AdaptiveInterval(
+            min(max(interval, min_interval), max_interval),
+            min_interval,
+            max_interval,
+            backoff=float(os.getenv("POLL_BACKOFF", 1.5)),
+            tighten=float(os.getenv("POLL_TIGHTEN", 0.5)),
+        )
+        start = datetime.now().astimezone()
+        self.scheduler.add_job(
+            self._run,
+            self._trigger(name, start),
+            args=[name],
+            next_run_time=start,
+            id=name,
+            name=name,
+            max_instances=1,
+            coalesce=True,
+            misfire_grace_time=None,
+        )
+        if self.coordinator is not None:
+            self.coordinator.register(
+                name, functools.partial(self._acquired, name, on_acquire)
+            )
+
+    def _acquired(self, name, on_acquire, takeover):
+        if on_acquire is not None:
+            on_acquire(takeover)
+        # Pierwszy cykl od razu, a nie dopiero w kolejnym terminie
+        self.scheduler.modify_job(name, next_run_time=datetime.now().astimezone())
+
+    def _trigger(self, name, start):
+        return IntervalTrigger(
+            seconds=self.intervals[name].interval, start_date=start
+        )
+
+    async def _run(self, name):
+        interval = self.intervals[name]
+        current = interval.interval
+        job = self.scheduler.get_job(name)
+        # Kolejny termin jest juz wyliczony, wiec biezacy to ten sprzed jednego odstepu
+        scheduled = job.next_run_time - timedelta(seconds=current)
+        if self.coordinator is not None and not self.coordinator.owns(name):
+            return
+        try:
+            outcome = await self.jobs[name]()
+        except Exception as e:
+            Logger.error("Polling %s failed: %s", name, e, exc_info=True)
+            outcome = CHANGED
+        new = interval.update(outcome)
+        if new != current:
+            Logger.info("Polling %s every %.0fs (%s)", name, new, outcome, interval=new)
+            self.scheduler.reschedule_job(
+                name, trigger=self._trigger(name, scheduled + timedelta(seconds=new))
+            )
+
+    async def run_forever(self):
+        # Musi byc wywolane w dzialajacej petli zdarzen
+        if self.coordinator is not None:
+            self.coordinator.start()
+        self.scheduler.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            self.scheduler.shutdown(wait=False)
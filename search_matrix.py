@@ -0,0 +1,175 @@
+import asyncio
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field, replace
+
+from logger import Logger
+from metrics import ROWS_FETCHED, STAGE_DURATION
+from rate_limit import TokenBucket
+
+PROVIDERS = ("TUI", "WakacjePL")
+
+
+@dataclass(frozen=True)
+class SearchQuery:
+    # Pojedyncze zapytanie do jednego providera; identyczne zapytania sa laczone
+    provider: str
+    departure_date_from: str
+    departure_date_to: str
+    duration_from: int
+    duration_to: int
+    adults: int
+    max_price: int
+    # Kody lotnisk docelowych TUI albo regionId wakacje.pl
+    destinations: tuple = ()
+    # countryId wakacje.pl (wyszukiwanie alternatywne)
+    countries: tuple = ()
+
+    @property
+    def cache_key(self):
+        raw = json.dumps(
+            [
+                self.departure_date_from,
+                self.departure_date_to,
+                self.duration_from,
+                self.duration_to,
+                self.adults,
+                self.max_price,
+                self.destinations,
+                self.countries,
+            ]
+        ).encode("utf-8")
+        return f"{self.provider}:{hashlib.blake2b(raw, digest_size=8).hexdigest()}"
+
+    def group_key(self):
+        return replace(self, destinations=(), countries=())
+
+
+@dataclass(frozen=True)
+class Search:
+    name: str
+    departure_date_from: str
+    departure_date_to: str
+    duration_from: int = 2
+    duration_to: int = 5
+    adults: int = 1
+    max_price: int = None
+    tui_destinations: tuple = ()
+    wakacje_regions: tuple = ()
+    wakacje_countries: tuple = ()
+    providers: tuple = field(default=PROVIDERS)
+
+    @classmethod
+    def from_dict(cls, spec):
+        spec = dict(spec)
+        for key in ("tui_destinations", "wakacje_regions", "wakacje_countries", "providers"):
+            if key in spec:
+                spec[key] = tuple(spec[key])
+        return cls(**spec)
+
+    def sub_queries(self):
+        max_price = self.max_price or 4000 * self.adults
+        common = dict(
+            departure_date_from=self.departure_date_from,
+            departure_date_to=self.departure_date_to,
+            duration_from=self.duration_from,
+            duration_to=self.duration_to,
+            adults=self.adults,
+            max_price=max_price,
+        )
+        if "TUI" in self.providers:
+            yield SearchQuery(
+                "TUI", destinations=tuple(sorted(self.tui_destinations)), **common
+            )
+        if "WakacjePL" in self.providers:
+            yield SearchQuery(
+                "WakacjePL",
+                destinations=tuple(sorted(self.wakacje_regions)),
+                countries=tuple(sorted(self.wakacje_countries)),
+                **common,
+            )
+
+
+def load_searches(default_search):
+    # OFFER_SEARCHES: sciezka do pliku JSON albo sam JSON z lista wyszukiwan
+    spec = os.getenv("OFFER_SEARCHES")
+    if not spec:
+        return [default_search]
+    if os.path.exists(spec):
+        with open(spec, encoding="utf-8") as f:
+            spec = f.read()
+    return [Search.from_dict(item) for item in json.loads(spec)]
+
+
+def plan_queries(searches, max_destinations=None):
+    # Zapytania rozniace sie tylko celami sa laczone w jedno (do max_destinations celow),
+    # a identyczne zapytania wykonywane sa tylko raz. Polaczone zapytanie zwraca wiecej ofert,
+    # wiec fetchery pobieraja kolejne strony, dopoki strona jest pelna
+    max_destinations = max_destinations or int(
+        os.getenv("OFFER_SEARCH_MAX_DESTINATIONS", 10)
+    )
+    groups = {}
+    for search in searches:
+        for query in search.sub_queries():
+            # Zapytanie bez celow oznacza "wszystkie cele" - nie wolno go zawezac
+            key = (query.group_key(), bool(query.destinations))
+            destinations, countries = groups.setdefault(key, (set(), set()))
+            destinations.update(query.destinations)
+            countries.update(query.countries)
+
+    queries = []
+    for (group, _), (destinations, countries) in groups.items():
+        destinations = sorted(destinations)
+        chunks = [
+            tuple(destinations[i : i + max_destinations])
+            for i in range(0, len(destinations), max_destinations)
+        ] or [()]
+        for chunk in chunks:
+            queries.append(
+                replace(group, destinations=chunk, countries=tuple(sorted(countries)))
+            )
+    return queries
+
+
+class SearchMatrix:
+    def __init__(self, searches, fetchers, concurrency=None, rate=None):
+        # fetchers: provider -> funkcja(query) zwracajaca asynchroniczny iterator ofert
+        self.searches = searches
+        self.fetchers = fetchers
+        self.concurrency = concurrency or int(os.getenv("OFFER_SEARCH_CONCURRENCY", 4))
+        rate = rate or float(os.getenv("OFFER_SEARCH_RATE", 2))
+        self.limiters = {provider: TokenBucket(rate) for provider in fetchers}
+        self.queries = plan_queries(searches)
+        Logger.info(
+            f"{len(searches)} searches planned as {len(self.queries)} provider queries"
+        )
+
+    async def run_query(self, semaphore, query):
+        async with semaphore:
+            await self.limiters[query.provider].acquire()
+            try:
+                with STAGE_DURATION.time(stage="search_query", provider=query.provider):
+                    offers = [offer async for offer in self.fetchers[query.provider](query)]
+                ROWS_FETCHED.inc(len(offers), provider=query.provider)
+                return offers
+            except Exception as e:
+                Logger.error("Query %s failed: %s", query.cache_key, e, provider=query.provider)
+                return []
+
+    async def run(self, providers=None):
+        # providers: tylko zapytania do tych providerow (None - wszystkie)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(
+            *(
+                self.run_query(semaphore, query)
+                for query in self.queries
+                if providers is None or query.provider in providers
+            )
+        )
+        # Ta sama oferta moze wrocic z kilku zapytan
+        offers = {}
+        for query_offers in results:
+            for offer in query_offers:
+                offers.setdefault(offer.seen_key, offer)
+        return list(offers.values())
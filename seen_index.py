@@ -0,0 +1,174 @@
+import asyncio
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+from logger import Logger
+from worker_slot import worker_path
+
+# Plik snapshotu: naglowek (magic, wersja, liczba wpisow) + rekordy (fingerprint, last_seen)
+SNAPSHOT_MAGIC = b"SEEN"
+SNAPSHOT_VERSION = 1
+FINGERPRINT_SIZE = 16
+_HEADER = struct.Struct("<4sHI")
+_RECORD = struct.Struct(f"<{FINGERPRINT_SIZE}sd")
+
+# Przyblizony koszt jednego wpisu w OrderedDict (klucz bytes + float + wezel listy)
+ENTRY_OVERHEAD_BYTES = 200
+
+
+def fingerprint(item):
+    if isinstance(item, bytes):
+        raw = item
+    elif isinstance(item, str):
+        raw = item.encode("utf-8")
+    else:
+        raw = json.dumps(
+            item, separators=(",", ":"), sort_keys=True, ensure_ascii=False
+        ).encode("utf-8")
+    return hashlib.blake2b(raw, digest_size=FINGERPRINT_SIZE).digest()
+
+
+class SeenOfferIndex:
+    def __init__(
+        self,
+        snapshot_path=None,
+        ttl=14 * 24 * 60 * 60,
+        max_entries=None,
+        max_memory_mb=None,
+    ):
+        self.snapshot_path = snapshot_path
+        self.ttl = ttl
+        if max_memory_mb is not None:
+            limit = int(max_memory_mb * 1024 * 1024 // ENTRY_OVERHEAD_BYTES)
+            max_entries = limit if max_entries is None else min(max_entries, limit)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._dirty = False
+        # Zapisy z kilku zadan naraz: starszy snapshot nie moze nadpisac nowszego
+        self._write_lock = threading.Lock()
+        self._snapshots = 0
+        self._written = 0
+        if self.snapshot_path:
+            self.load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, item):
+        fp = fingerprint(item)
+        last_seen = self._entries.get(fp)
+        return last_seen is not None and not self._expired(last_seen, time.time())
+
+    def _expired(self, last_seen, now):
+        return self.ttl is not None and now - last_seen > self.ttl
+
+    def add(self, item, now=None):
+        self._touch(fingerprint(item), time.time() if now is None else now)
+
+    def check_and_add(self, item, now=None):
+        # Zwraca True, jezeli oferta nie byla jeszcze widziana (i zapamietuje ja)
+        now = time.time() if now is None else now
+        fp = fingerprint(item)
+        last_seen = self._entries.get(fp)
+        is_new = last_seen is None or self._expired(last_seen, now)
+        self._touch(fp, now)
+        return is_new
+
+    def _touch(self, fp, now):
+        self._entries[fp] = now
+        self._entries.move_to_end(fp)
+        self._dirty = True
+        if self.max_entries is not None:
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def evict_expired(self, now=None):
+        if self.ttl is None:
+            return 0
+        now = time.time() if now is None else now
+        evicted = 0
+        # Wpisy sa uporzadkowane wg ostatniego uzycia, wiec najstarsze sa na poczatku
+        while self._entries:
+            fp, last_seen = next(iter(self._entries.items()))
+            if not self._expired(last_seen, now):
+                break
+            self._entries.popitem(last=False)
+            evicted += 1
+        if evicted:
+            self._dirty = True
+        return evicted
+
+    def load(self):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                magic, version, count = _HEADER.unpack(f.read(_HEADER.size))
+                if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+                    raise ValueError("Unsupported seen index snapshot format")
+                payload = f.read(count * _RECORD.size)
+            entries = OrderedDict()
+            for fp, last_seen in _RECORD.iter_unpack(payload):
+                entries[fp] = last_seen
+            self._entries = entries
+            self._dirty = False
+            evicted = self.evict_expired()
+            Logger.info(
+                f"Loaded {len(self._entries)} seen offers from snapshot ({evicted} expired)"
+            )
+        except Exception as e:
+            Logger.error(f"Could not load seen index snapshot: {e}")
+
+    def _serialize(self):
+        self.evict_expired()
+        return _HEADER.pack(
+            SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(self._entries)
+        ) + b"".join(
+            _RECORD.pack(fp, last_seen) for fp, last_seen in self._entries.items()
+        )
+
+    def _snapshot(self):
+        self._snapshots += 1
+        self._dirty = False
+        return self._serialize(), self._snapshots
+
+    def _write(self, payload, number):
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with self._write_lock:
+            if number < self._written:
+                return
+            try:
+                with open(tmp_path, "wb") as f:
+                    f.write(payload)
+                os.replace(tmp_path, self.snapshot_path)
+                self._written = number
+            except Exception as e:
+                self._dirty = True
+                Logger.error(f"Could not save seen index snapshot: {e}")
+
+    def save(self, force=False):
+        if not self.snapshot_path or not (self._dirty or force):
+            return
+        self._write(*self._snapshot())
+
+    async def save_async(self, force=False):
+        # Serializacja w petli zdarzen (bez wspolbieznych zmian), zapis na dysk w watku
+        if not self.snapshot_path or not (self._dirty or force):
+            return
+        await asyncio.get_running_loop().run_in_executor(None, self._write, *self._snapshot())
+
+    @classmethod
+    def from_env(cls, default_path, prefix="SEEN_INDEX"):
+        max_entries = os.getenv(f"{prefix}_MAX_ENTRIES")
+        max_memory_mb = os.getenv(f"{prefix}_MAX_MEMORY_MB")
+        return cls(
+            snapshot_path=worker_path(os.getenv(f"{prefix}_PATH", default_path)),
+            ttl=float(os.getenv(f"{prefix}_TTL_HOURS", 14 * 24)) * 60 * 60,
+            max_entries=int(max_entries) if max_entries else None,
+            max_memory_mb=float(max_memory_mb) if max_memory_mb else None,
+        )
@@ -0,0 +1,148 @@
+from logger import Logger
+
+ADDED = "added"
+REMOVED = "removed"
+REPRICED = "repriced"
+
+
+def offer_identity(offer):
+    # Tozsamosc oferty niezalezna od ceny (offer.key zawiera cene, wiec zmienia sie razem z nia)
+    return (offer.provider, offer.country, offer.name, offer.airports, offer.brand, offer.departure)
+
+
+class OfferEvent:
+    # old/new to krotki ofert o tej samej tozsamosci (zwykle jedna; kilka, gdy provider
+    # zwraca ten sam lot w kilku cenach)
+    __slots__ = ("kind", "identity", "old", "new")
+
+    def __init__(self, kind, identity, old=(), new=()):
+        self.kind = kind
+        self.identity = identity
+        self.old = old
+        self.new = new
+
+    def __repr__(self):
+        return f"OfferEvent({self.kind}, {self.identity}, {self.old_price} -> {self.new_price})"
+
+    @property
+    def old_price(self):
+        return min((offer.price for offer in self.old), default=None)
+
+    @property
+    def new_price(self):
+        return min((offer.price for offer in self.new), default=None)
+
+    @property
+    def cheaper(self):
+        return self.kind == ADDED or (
+            self.kind == REPRICED and self.new_price < self.old_price
+        )
+
+
+class SnapshotDelta:
+    # baseline=True - brak poprzedniego snapshotu, baze trzeba uzgodnic pelnym snapshotem
+    def __init__(self, events, offers, unchanged=0, baseline=False):
+        self.events = events
+        self.offers = offers
+        self.unchanged = unchanged
+        self.baseline = baseline
+
+    def __len__(self):
+        return len(self.events)
+
+    def counts(self):
+        counts = {ADDED: 0, REMOVED: 0, REPRICED: 0}
+        for event in self.events:
+            counts[event.kind] += 1
+        return counts
+
+    def entered(self):
+        # Oferty, ktorych offer_key pojawil sie w tym cyklu (do zapisu i aktywacji)
+        for event in self.events:
+            if event.kind == REMOVED:
+                continue
+            old_keys = {offer.key for offer in event.old}
+            for offer in event.new:
+                if offer.key not in old_keys:
+                    yield offer
+
+    def left(self):
+        # offer_key, ktore zniknely w tym cyklu (do dezaktywacji)
+        for event in self.events:
+            if event.kind == ADDED:
+                continue
+            new_keys = {offer.key for offer in event.new}
+            for offer in event.old:
+                if offer.key not in new_keys:
+                    yield offer.key
+
+    def alerts(self, offers):
+        # Nieoglaszane jeszcze oferty, ktore sa nowe albo potanialy
+        if self.baseline:
+            return offers
+        cheaper = {event.identity for event in self.events if event.cheaper}
+        return [offer for offer in offers if offer_identity(offer) in cheaper]
+
+
+class DeltaEngine:
+    # Poprzedni snapshot kazdego zakresu ("all" albo nazwa providera) jako slownik
+    # tozsamosc -> oferty; roznica liczona jednym przejsciem po biezacym snapshocie
+    def __init__(self):
+        self.snapshots = {}
+
+    def reset(self, scope=None):
+        # Po nieudanym zapisie baza nie odpowiada snapshotowi - nastepny cykl uzgadnia calosc
+        if scope is None:
+            self.snapshots.clear()
+        else:
+            self.snapshots.pop(scope, None)
+
+    @staticmethod
+    def _group(offers):
+        snapshot = {}
+        for offer in offers:
+            identity = offer_identity(offer)
+            group = snapshot.get(identity)
+            if group is None:
+                snapshot[identity] = (offer,)
+            elif all(offer.key != other.key for other in group):
+                snapshot[identity] = group + (offer,)
+        return snapshot
+
+    @staticmethod
+    def _same(old, new):
+        if len(old) == 1 and len(new) == 1:
+            return old[0].key == new[0].key
+        return {offer.key for offer in old} == {offer.key for offer in new}
+
+    def diff(self, offers, scope="all", commit=True):
+        # commit=False - tylko porownanie (np. niepelny snapshot), poprzedni zostaje bez zmian
+        current = self._group(offers)
+        previous = self.snapshots.get(scope)
+        if previous is None:
+            if commit:
+                self.snapshots[scope] = current
+            events = [OfferEvent(ADDED, identity, (), new) for identity, new in current.items()]
+            return SnapshotDelta(events, offers, baseline=True)
+        if not current and previous:
+            # Pusty snapshot to najpewniej awaria providerow, a nie brak ofert
+            Logger.warn("Empty snapshot for %s, keeping the previous one", scope)
+            return SnapshotDelta([], offers)
+
+        events = []
+        unchanged = 0
+        for identity, new in current.items():
+            old = previous.get(identity)
+            if old is None:
+                events.append(OfferEvent(ADDED, identity, (), new))
+            elif self._same(old, new):
+                unchanged += 1
+            else:
+                events.append(OfferEvent(REPRICED, identity, old, new))
+        # Oferty poprzedniego snapshotu, ktorych nie ma w biezacym, zniknely
+        for identity, old in previous.items():
+            if identity not in current:
+                events.append(OfferEvent(REMOVED, identity, old, ()))
+        if commit:
+            self.snapshots[scope] = current
+        return SnapshotDelta(events, offers, unchanged)
@@ -0,0 +1,7 @@
+import os
+
+# Testy nie dotykaja plikow stanu dzialajacego bota ani blokad slotow workerow
+os.environ.setdefault("WORKER_SLOT", "0")
+os.environ.setdefault("SEEN_INDEX_PATH", "")
+os.environ.setdefault("FLIGHT_OUTBOX_JOURNAL", "")
+os.environ.setdefault("DEAL_DETECTION", "0")
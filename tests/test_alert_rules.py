@@ -0,0 +1,90 @@
+import random
+
+from alert_rules import AlertRule, RuleIndex
+from offer import Offer
+
+COUNTRIES = ["Hiszpania", "Wlochy", "Grecja", "Egipt"]
+AIRPORTS = ["WAW", "KRK", "GDN"]
+PROVIDERS = ["Rainbow", "TUI", "ITAKA"]
+DATES = ["2026-11-01", "2026-11-15", "2026-12-01", "2026-12-24", "2027-01-10"]
+
+
+def make_offer(provider, country, airport, price, dates=""):
+    departure = f"{dates} 10:00:00" if dates else ""
+    return Offer(
+        provider=provider,
+        country=country,
+        name="Cel",
+        code="XXX",
+        departure=departure,
+        list_price=price,
+        price=price,
+        brand=provider,
+        route_name=f"Cel {airport} - XXX 1/1/1",
+    )
+
+
+def random_rule(rng, id):
+    def some(values):
+        return rng.sample(values, rng.randint(1, 2)) if rng.random() < 0.5 else None
+
+    date_from = rng.choice(DATES + [None, None])
+    date_to = rng.choice(DATES + [None, None])
+    if date_from and date_to and date_from > date_to:
+        date_from, date_to = date_to, date_from
+    return AlertRule(
+        id,
+        chat_id=rng.randint(1, 5),
+        max_price=rng.choice([None, 300, 500, 500, 800]),
+        countries=some(COUNTRIES),
+        departure_airports=some(AIRPORTS),
+        date_from=date_from,
+        date_to=date_to,
+        providers=some(PROVIDERS),
+    )
+
+
+def random_offer(rng):
+    return make_offer(
+        rng.choice(PROVIDERS),
+        rng.choice(COUNTRIES),
+        rng.choice(AIRPORTS),
+        rng.choice([100, 300, 499, 500, 501, 800, 1200]),
+        rng.choice(DATES + ["2026-11-20", ""]),
+    )
+
+
+def test_index_matches_reference_rules():
+    rng = random.Random(7)
+    rules = [random_rule(rng, id) for id in range(120)]
+    index = RuleIndex(rules)
+    for _ in range(2000):
+        offer = random_offer(rng)
+        expected = [rule.id for rule in rules if rule.matches(offer)]
+        assert [rule.id for rule in index.match(offer)] == expected
+
+
+def test_bounds_are_inclusive():
+    rule = AlertRule(1, chat_id=1, max_price=500, date_from="2026-11-01", date_to="2026-11-30")
+    index = RuleIndex([rule])
+    assert index.match(make_offer("TUI", "Egipt", "WAW", 500, "2026-11-01")) == [rule]
+    assert index.match(make_offer("TUI", "Egipt", "WAW", 500, "2026-11-30")) == [rule]
+    assert index.match(make_offer("TUI", "Egipt", "WAW", 501, "2026-11-15")) == []
+    assert index.match(make_offer("TUI", "Egipt", "WAW", 400, "2026-12-01")) == []
+    # Oferta bez daty nie pasuje do reguly z zakresem dat
+    assert index.match(make_offer("TUI", "Egipt", "WAW", 400)) == []
+
+
+def test_deliveries_once_per_chat():
+    rules = [
+        AlertRule(1, chat_id=10, countries=["Egipt"]),
+        AlertRule(2, chat_id=10, max_price=1000),
+        AlertRule(3, chat_id=20, providers=["ITAKA"]),
+    ]
+    first = make_offer("TUI", "Egipt", "WAW", 400)
+    second = make_offer("ITAKA", "Grecja", "KRK", 2000)
+    assert RuleIndex(rules).deliveries([first, second]) == {10: [first], 20: [second]}
+
+
+def test_empty_index():
+    assert RuleIndex().match(make_offer("TUI", "Egipt", "WAW", 400)) == []
@@ -0,0 +1,76 @@
+import random
+
+import numpy as np
+
+from deal_detector import DealDetector
+from offer import Offer
+
+ROUTES = [("Malaga", "AGP"), ("Rzym", "FCO"), ("Ateny", "ATH")]
+
+
+def make_offer(name, code, price, brand):
+    return Offer(
+        provider="Rainbow",
+        country="Nieznane",
+        name=name,
+        code=code,
+        departure="2026-11-01 10:00:00",
+        list_price=price,
+        price=price,
+        brand=brand,
+        route_name=f"{name} WAW - {code} 1/1/1",
+    )
+
+
+def random_cycles(count, seed=3):
+    # Kilka ofert na trase w cyklu; ceny wracaja do wczesniejszych poziomow
+    rng = random.Random(seed)
+    cycles = []
+    for _ in range(count):
+        offers = []
+        for name, code in ROUTES:
+            for brand in ("Enter", "Smartwings"):
+                for _ in range(rng.randint(1, 3)):
+                    offers.append(make_offer(name, code, rng.choice([399, 449, 499, 549]), brand))
+        cycles.append(offers)
+    return cycles
+
+
+def baselines(detector, offers):
+    ids = detector._route_ids(
+        (offer.airports, offer.dates, offer.brand) for offer in offers
+    )
+    return detector.median[ids], detector.low[ids], np.minimum(detector.count[ids], detector.window)
+
+
+def test_seed_then_update_matches_update_alone():
+    cycles = random_cycles(40)
+    live = DealDetector(window=8, percentile=25)
+    levels = []
+    for offers in cycles[:25]:
+        levels.extend(live.update(offers))
+
+    # Restart: bufory odtworzone z zapisanych poziomow
+    restarted = DealDetector(window=8, percentile=25)
+    restarted.seed(levels)
+    for offers in cycles[25:]:
+        live.update(offers)
+        restarted.update(offers)
+
+    probe = cycles[-1]
+    for expected, actual in zip(baselines(live, probe), baselines(restarted, probe)):
+        np.testing.assert_allclose(actual, expected)
+    assert [offer.key for offer in restarted.deals(probe)] == [
+        offer.key for offer in live.deals(probe)
+    ]
+
+
+def test_update_returns_only_changed_route_minimum():
+    detector = DealDetector(window=4)
+    first = [make_offer("Malaga", "AGP", 500, "Enter"), make_offer("Malaga", "AGP", 450, "Enter")]
+    assert detector.update(first) == [("WAW-AGP", "2026-11-01", "Enter", 450.0)]
+    # Drozsza oferta tej samej trasy nie zmienia minimum
+    assert detector.update(first + [make_offer("Malaga", "AGP", 600, "Enter")]) == []
+    assert detector.update([make_offer("Malaga", "AGP", 500, "Enter")]) == [
+        ("WAW-AGP", "2026-11-01", "Enter", 500.0)
+    ]
@@ -0,0 +1,106 @@
+import asyncio
+import json
+
+from flight_search import DataFetcher, TravelDealsBot
+from http_client import HttpClient, ReplayJsonStream
+from scheduler import UNCHANGED
+
+RAINBOW = json.dumps(
+    {
+        "Destynacje": [
+            {
+                "Panstwo": "Hiszpania",
+                "Nazwa": "Malaga",
+                "Klucz": "AGP",
+                "TerminWyjazdu": "2026-11-01T10:00:00Z",
+                "Cena": 499,
+                "DataLayer": {"price": 499, "brand": "Enter", "name": "Malaga WAW - AGP 1/1/1"},
+            }
+        ]
+    }
+)
+
+
+class StaticHttpClient(HttpClient):
+    # Zawsze ta sama odpowiedz - skrot tresci daje "bez zmian" jak przy prawdziwym providerze
+    def __init__(self, body):
+        super().__init__()
+        self.body = body
+
+    def next_response(self, cache_key):
+        return {"status": 200, "body": self.body}
+
+    def stream_json(self, method, url, path=(), cache_key=None, **kwargs):
+        return ReplayJsonStream(self, method, url, path, cache_key, kwargs)
+
+
+class MemoryDatabase:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.snapshots = []
+
+    def add_to_db(self, offers, observed_at=None):
+        return (0, 0) if self.fail else (len(offers), 0)
+
+    def check_active(self, offers, provider=None):
+        self.snapshots.append(provider)
+        return None if self.fail else (0, 0)
+
+    def update_active(self, activate_keys, deactivate_keys):
+        return 0, 0
+
+    def alert_rules(self):
+        return []
+
+
+def make_bot(db):
+    fetcher = DataFetcher(http_client=StaticHttpClient(RAINBOW))
+    fetcher.providers = {"Rainbow": fetcher.providers["Rainbow"]}
+    return TravelDealsBot("123456:TEST", None, db, fetcher)
+
+
+def test_unchanged_payload_is_skipped():
+    async def run():
+        bot = make_bot(MemoryDatabase())
+        await bot.poll_provider("Rainbow")
+        assert await bot.poll_provider("Rainbow") == UNCHANGED
+        await bot.writer.close()
+
+    asyncio.run(run())
+
+
+def test_failed_write_is_retried_with_unchanged_payload():
+    async def run():
+        db = MemoryDatabase(fail=True)
+        bot = make_bot(db)
+        await bot.poll_provider("Rainbow")
+        await bot.writer.flush()
+        assert bot.writer.failed == 1
+
+        # Odpowiedz providera sie nie zmienila, ale baza nie ma snapshotu - cykl go zapisuje
+        db.fail = False
+        assert await bot.poll_provider("Rainbow") != UNCHANGED
+        await bot.writer.flush()
+        assert bot.writer.written == 1
+        assert db.snapshots == ["Rainbow", "Rainbow"]
+        await bot.writer.close()
+
+    asyncio.run(run())
+
+
+def test_lease_takeover_reconciles_unchanged_payload():
+    async def run():
+        db = MemoryDatabase()
+        bot = make_bot(db)
+        await bot.poll_provider("Rainbow")
+        await bot.writer.flush()
+
+        # Dzierzawa wrocila od innego procesu - walidatory z wczesniejszej dzierzawy nie pomijaja cyklu
+        bot.lease_acquired("Rainbow", takeover=True)
+        assert await bot.poll_provider("Rainbow") != UNCHANGED
+        await bot.writer.flush()
+        assert db.snapshots == ["Rainbow", "Rainbow"]
+        assert "Rainbow" not in bot.quiet
+        await bot.writer.close()
+
+    asyncio.run(run())
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from json_stream import JsonArrayItems
+
+DOCUMENT = {
+    "meta": {"offers": "not this one", "list": [1, [2, 3]]},
+    "data": {
+        "total": 4,
+        "offers": [
+            {"name": "Rzym \"Fiumicino\" \\ FCO", "price": 1.5e3, "tags": ["a", "]"]},
+            1,
+            -12.25e-1,
+            "tekst, z ] i \\\" w srodku",
+            None,
+            True,
+            [],
+            {},
+        ],
+        "after": [9],
+    },
+}
+
+
+def parse(text, path, size):
+    items = JsonArrayItems(path)
+    result = []
+    for start in range(0, len(text), size):
+        result.extend(items.feed(text[start : start + size]))
+    items.close()
+    return result
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1000])
+def test_items_are_independent_of_chunking(size):
+    text = json.dumps(DOCUMENT, ensure_ascii=False)
+    assert parse(text, ("data", "offers"), size) == DOCUMENT["data"]["offers"]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3])
+def test_top_level_array(size):
+    assert parse("[10, 2.5 , -3e2,\n4]", (), size) == [10, 2.5, -300.0, 4]
+
+
+def test_number_split_across_chunks():
+    items = JsonArrayItems()
+    assert items.feed("[1") == []
+    assert items.feed(".") == []
+    assert items.feed("5e3") == []
+    assert items.feed(", 2]") == [1500.0, 2]
+    items.close()
+
+
+def test_missing_array():
+    items = JsonArrayItems(("data", "offers"))
+    items.feed('{"data": {"other": []}}')
+    with pytest.raises(ValueError, match="not found"):
+        items.close()
+
+
+def test_truncated_array():
+    items = JsonArrayItems()
+    assert items.feed('[{"a": 1}, {"b"') == [{"a": 1}]
+    with pytest.raises(ValueError, match="truncated"):
+        items.close()
@@ -0,0 +1,46 @@
+import asyncio
+
+from outbox import TelegramOutbox
+
+
+class HangingBot:
+    # Wiadomosci do czatu "slow" nigdy nie dochodza
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if chat_id == "slow":
+            await asyncio.Event().wait()
+        self.sent.append(text)
+
+
+def make_outbox(path, bot=None):
+    return TelegramOutbox(
+        bot or HangingBot(), global_rate=1000, chat_rate=1000, journal_path=str(path), compact_after=3
+    )
+
+
+def test_journal_is_compacted_and_replays_undelivered(tmp_path):
+    path = tmp_path / "outbox.journal"
+
+    async def run():
+        outbox = make_outbox(path)
+        outbox.enqueue("slow", "zalegla")
+        for number in range(3):
+            outbox.enqueue("fast", f"oferta {number}")
+        while len(outbox.bot.sent) < 3:
+            await asyncio.sleep(0.01)
+        await outbox.close(timeout=0.1)
+
+    asyncio.run(run())
+    # Po trzech potwierdzeniach w dzienniku zostaje tylko niedostarczona wiadomosc
+    assert len(path.read_text(encoding="utf-8").splitlines()) == 1
+
+    async def resend():
+        bot = HangingBot()
+        outbox = make_outbox(path, bot)
+        assert [message["text"] for message in outbox._pending_replay] == ["zalegla"]
+        outbox.start()
+        await outbox.close(timeout=0.1)
+
+    asyncio.run(resend())
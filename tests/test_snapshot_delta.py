@@ -0,0 +1,83 @@
+from offer import Offer
+from snapshot_delta import ADDED, REMOVED, REPRICED, DeltaEngine
+
+
+def make_offer(name, price, provider="Rainbow"):
+    return Offer(
+        provider=provider,
+        country="Hiszpania",
+        name=name,
+        code="AGP",
+        departure="2026-11-01 10:00:00",
+        list_price=price,
+        price=price,
+        brand=provider,
+        route_name=f"{name} WAW - AGP 1/1/1",
+    )
+
+
+def kinds(delta):
+    return sorted((event.kind, event.identity[2]) for event in delta.events)
+
+
+def test_first_snapshot_is_baseline():
+    offers = [make_offer("Malaga", 500), make_offer("Rzym", 300)]
+    delta = DeltaEngine().diff(offers, "Rainbow")
+    assert delta.baseline
+    assert delta.alerts(offers) == offers
+    assert delta.counts()[ADDED] == 2
+
+
+def test_added_removed_repriced():
+    engine = DeltaEngine()
+    engine.diff([make_offer("Malaga", 500), make_offer("Rzym", 300), make_offer("Ateny", 700)])
+    cheaper = make_offer("Malaga", 450)
+    added = make_offer("Kair", 900)
+    offers = [cheaper, make_offer("Rzym", 350), make_offer("Ateny", 700), added]
+    delta = engine.diff(offers)
+    assert not delta.baseline
+    assert kinds(delta) == [(ADDED, "Kair"), (REPRICED, "Malaga"), (REPRICED, "Rzym")]
+    assert delta.unchanged == 1
+    # Ogloszenia tylko dla nowych i tanszych ofert
+    assert delta.alerts(offers) == [cheaper, added]
+
+    delta = engine.diff([cheaper, added])
+    assert kinds(delta) == [(REMOVED, "Ateny"), (REMOVED, "Rzym")]
+    assert set(delta.left()) == {make_offer("Ateny", 700).key, make_offer("Rzym", 350).key}
+
+
+def test_entered_and_left_keys():
+    engine = DeltaEngine()
+    old = make_offer("Malaga", 500)
+    engine.diff([old])
+    new = make_offer("Malaga", 450)
+    delta = engine.diff([new])
+    assert list(delta.entered()) == [new]
+    assert list(delta.left()) == [old.key]
+
+
+def test_empty_snapshot_keeps_previous():
+    engine = DeltaEngine()
+    offers = [make_offer("Malaga", 500)]
+    engine.diff(offers)
+    assert len(engine.diff([])) == 0
+    assert len(engine.diff(offers)) == 0
+
+
+def test_uncommitted_diff_keeps_previous():
+    engine = DeltaEngine()
+    full = [make_offer("Malaga", 500), make_offer("Rzym", 300)]
+    engine.diff(full, "Rainbow")
+    partial = engine.diff([make_offer("Malaga", 500)], "Rainbow", commit=False)
+    assert kinds(partial) == [(REMOVED, "Rzym")]
+    # Nastepny pelny snapshot porownywany z ostatnim zatwierdzonym
+    assert len(engine.diff(full, "Rainbow")) == 0
+
+
+def test_scopes_and_reset():
+    engine = DeltaEngine()
+    engine.diff([make_offer("Malaga", 500)], "Rainbow")
+    assert engine.diff([make_offer("Malaga", 500, "TUI")], "TUI").baseline
+    engine.reset("Rainbow")
+    assert engine.diff([make_offer("Malaga", 500)], "Rainbow").baseline
+    assert not engine.diff([make_offer("Malaga", 500, "TUI")], "TUI").baseline
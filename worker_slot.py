@@ -0,0 +1,60 @@
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows - bot dziala tam jako jeden proces
+    fcntl = None
+
+from logger import Logger
+
+_lock = threading.Lock()
+_slot = None
+_handle = None
+
+
+def worker_slot():
+    # Najmniejszy wolny numer workera na tej maszynie. Blokada pliku jest trzymana do konca
+    # procesu, wiec dwa workery nigdy nie dziela plikow stanu, a po restarcie workera jego
+    # numer (razem z indeksem widzianych ofert i dziennikiem outboxa) przejmuje nastepny.
+    global _slot, _handle
+    with _lock:
+        if _slot is not None:
+            return _slot
+        forced = os.getenv("WORKER_SLOT")
+        if forced:
+            _slot = int(forced)
+            return _slot
+        if fcntl is None:
+            _slot = 0
+            return _slot
+        directory = os.getenv("WORKER_STATE_DIR", ".")
+        os.makedirs(directory, exist_ok=True)
+        for slot in range(int(os.getenv("WORKER_MAX_SLOTS", 64))):
+            handle = open(os.path.join(directory, f".worker-{slot}.lock"), "a")
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                handle.close()
+                continue
+            _slot, _handle = slot, handle
+            Logger.info("Using worker slot %s", slot, slot=slot)
+            return _slot
+        raise RuntimeError("No free worker slot, raise WORKER_MAX_SLOTS")
+
+
+def worker_path(path):
+    # Plik stanu tego workera; slot 0 zachowuje dotychczasowa nazwe (pusta sciezka - bez pliku)
+    if not path:
+        return path
+    slot = worker_slot()
+    if slot == 0:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.w{slot}{ext}"
+
+
+def worker_prefix(prefix):
+    # Prefiks archiwum odpowiedzi; read_archive(prefix) czyta tez pliki pozostalych workerow
+    slot = worker_slot()
+    return prefix if slot == 0 else f"{prefix}-w{slot}"
@@ -1,32 +1,98 @@
 import asyncio
-from flask import Flask, jsonify
+import os
+from flask import Flask, Response, jsonify
 from threading import Thread
 import threading
 
-from flight_search import main_run_bot
+import metrics
+from coordinator import Coordinator
+from flight_search import DatabaseManager, main_run_bot
 
 app = Flask(__name__)
 
 # Global variable to track if the bot has been started
 bot_started = threading.Event()
+coordinator = None
+
+
+def create_coordinator():
+    # With several gunicorn workers or nodes each provider/search job runs in exactly one
+    # process, chosen through leases in Postgres (COORDINATION=0 runs every job locally)
+    if os.getenv("COORDINATION", "1").lower() in ("0", "false", "no"):
+        return None
+    db = DatabaseManager(
+        host=os.getenv("DB_HOST"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        database=os.getenv("DB_DATABASE"),
+        min_connections=1,
+        max_connections=1,
+    )
+    return Coordinator(db)
+
+
+async def run_bots():
+    bots = [main_run_bot(coordinator)]
+    if os.getenv("OFFER_SEARCH_ENABLED", "").lower() in ("1", "true", "yes"):
+        # offer_search runs in the same event loop as the flight bot
+        import offer_search
+
+        bots.append(offer_search.main(coordinator))
+    try:
+        await asyncio.gather(*bots)
+    finally:
+        if coordinator is not None:
+            await coordinator.close()
+
 
 def run_bot():
     # Run the bot with asyncio
-    asyncio.run(main_run_bot())
+    asyncio.run(run_bots())
+
+def ensure_started():
+    # Returns False if this process was already running the bots
+    global coordinator
+    if bot_started.is_set():
+        return False
+    bot_started.set()  # Set the event to indicate that the bot has started
+    coordinator = create_coordinator()
+    bot_thread = Thread(target=run_bot)
+    bot_thread.start()
+    return True
+
+
+def worker_id():
+    return coordinator.worker_id if coordinator is not None else None
+
 
 @app.route('/start')
 def start_bot():
-    if not bot_started.is_set():
-        bot_thread = Thread(target=run_bot)
-        bot_thread.start()
-        bot_started.set()  # Set the event to indicate that the bot has started
-        return jsonify({"status": "Bot started"}), 200
+    if ensure_started():
+        return jsonify({"status": "Bot started", "worker": worker_id()}), 200
     else:
-        return jsonify({"status": "Bot already running"}), 200
+        return jsonify({"status": "Bot already running", "worker": worker_id()}), 200
+
+
+@app.route('/leases')
+def leases():
+    # Jobs this worker currently runs
+    if coordinator is None:
+        return jsonify({"worker": None, "jobs": []}), 200
+    jobs = sorted(name for name in coordinator.jobs if coordinator.owns(name))
+    return jsonify({"worker": coordinator.worker_id, "jobs": jobs}), 200
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 @app.route('/test')
 def test():
     return "TEST!"
 
+# Under gunicorn /start only reaches the worker that served it; BOT_AUTOSTART=1 starts the
+# bots in every worker on import (do not combine with --preload - threads do not survive fork)
+if os.getenv("BOT_AUTOSTART", "").lower() in ("1", "true", "yes"):
+    ensure_started()
+
 if __name__ == "__main__":
     app.run()